@@ -9,11 +9,27 @@ cwd = os.getcwd()
 RoboVersion = 2.60
 ######################################
 # Sampler Selection
-sampler = 'wolfram' # options are 'default' or 'wolfram'
+sampler = 'wolfram' # options are 'default', 'wolfram' or 'native'
 # 'wolfram' is default, if wolfram fails, fall back to default using this toggle
+# 'native' samples the same convex hull as 'wolfram' in numpy (no Wolfram Engine needed)
+sampling_sequence = 'sobol' # 'default' sampler draws: 'sobol', 'halton' (both scrambled) or 'random'
+# a run can override this with 'sampling_sequence' and fix the draws with 'sampling_seed' in the specification
+sampling_molar_limits = False # bound the 'default' draws, the state set and quantized wells by the chem<N>_molarmax/_molarmin limits (v2.7 ignored them)
+# a run can override this with 'sampling_molar_limits' in the specification
+sampling_workers = None # experiments of a run are sampled in parallel, None uses one worker per core
+hull_cache = True # keep the geometry of reagent hulls in ./localfiles/hullcache for later runs
+hull_cache_max_bytes = 50 * 2 ** 20 # least recently used hulls are dropped beyond this size
 ######################################
 # ESCALATE_Capture settings
 volspacing = 50  # reagent microliter (uL) spacing between points in the stateset generation
+volume_resolution = 1  # pipette resolution (uL), sampled volumes are snapped to it keeping the total of each well
+stateset_chunksize = 100000  # stateset rows enumerated and written at a time, None builds the whole stateset in memory
+storage_backend = 'google'  # 'google' or 'local': in-memory Drive and Sheets stand-in (see googleapi.localstore)
+local_storage_dir = None  # 'local' backend: directory mirroring the uploaded files, None keeps them in memory only
+local_storage_latency = 0.  # 'local' backend: seconds added to every round trip
+upload_workers = 4  # files uploaded to Drive at once
+upload_chunksize = 8 * 2 ** 20  # larger files are sent as resumable uploads in chunks of this size (multiple of 256 KiB)
+upload_retries = 3  # attempts per file (per chunk of a resumable upload) before the upload fails
 '''
   Targets for lab specific will overrides (defaults used otherwise)
 target folder MUST be set for a lab, no default will be provided
@@ -178,6 +194,11 @@ if sampler == 'wolfram':
 # Mac or Windows
 elif system == "Darwin" or system == 'Windows':
     wolfram_kernel_path = None
+
+# kernels are started once and shared by every experiment of a run (see wolframsampler.WolframKernelPool)
+wolfram_pool_size = 1  # number of kernels running at once (each uses a Wolfram Engine license slot)
+wolfram_pool_warmup = False  # start all of the kernels up front rather than on first use
+wolfram_precompile = True  # cache the loaded .wls definitions as a .mx file in ./localfiles
 ### END WOLFRAM ###
 
 ### CHEMDESCRIPTOR KERNALS ### 
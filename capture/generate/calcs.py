@@ -1,38 +1,140 @@
-import pandas as pd 
+import pandas as pd
+import numpy as np
 import logging
+import re
+
+from capture.models.reagent import ReagentSet
+import capture.devconfig as config
 
 modlog = logging.getLogger('capture.generate.calcs')
 
-def mmolextension(reagentdf, rdict, experiment, reagent):
-    """TODO Pendltoonize this docc"""
-
-    mmoldf = (pd.DataFrame(reagentdf))
-    portionmmoldf = pd.DataFrame()
-    for chemlistlocator, conc in (rdict['%s' %reagent].concs.items()):
-        listposition = chemlistlocator.split('m')[1]
-        chemnameint = int(listposition)
-        truechemname = rdict['%s'%reagent].chemicals[chemnameint-1]
-        newmmoldf = mmoldf * conc / 1000
-        oldheaders = newmmoldf.columns
-        newmmoldf.rename\
-            (columns={'Reagent%s (ul)'%reagent:'mmol_experiment%s_reagent%s_%s' \
-                %(experiment, reagent, truechemname)}, inplace=True)
-        modlog.info('dataframe columns: %s renamed to: %s'%(oldheaders, newmmoldf.columns))
-        portionmmoldf = pd.concat([portionmmoldf, newmmoldf], axis=1)
-    return portionmmoldf
-
-def finalmmolsums(chemicals, mmoldf):
-    """TODO Pendltoonize this docc"""
-    finalsummedmmols = pd.DataFrame()
-    for chemical in chemicals:
-        cname = '%s' %chemical
-        coutname = '%s [M]' %chemical  # The technical output of this function is a mmol, simplier to rename the columns here
-        tempdf = pd.DataFrame()
-        for header in mmoldf.columns:
-            if cname in header:
-                tempdf = pd.concat([tempdf, mmoldf[header]], axis=1)
-        summedmmols = pd.DataFrame(tempdf.sum(axis=1))
-        summedmmols.columns = [coutname]
-        finalsummedmmols = pd.concat([finalsummedmmols, summedmmols], axis=1)
-    finalsummedmmols.fillna(value=0, inplace=True) # Total mmmols added of each chemical in previous reagent additions
-    return finalsummedmmols
+
+class ConcentrationMatrix:
+    """(reagents x chemicals) molarity matrix of the reagents of a run
+
+    mmols of every chemical in every well are then one product of the (wells x reagents) volume matrix with
+    this matrix.  The breakout by experiment, reagent and chemical is only built when asked for (mmol_breakout).
+
+    :param rdict: {reagent number: perovskitereagent} or a models.reagent.ReagentSet
+    """
+
+    def __init__(self, rdict):
+        self.reagents = rdict if isinstance(rdict, ReagentSet) else ReagentSet(rdict)
+        self.chemicals = self.reagents.chemicals
+        self.matrix = self.reagents.matrix
+        # (chemical, concentration) of each mmol breakout column, per reagent
+        self.breakout = {}
+        for name, reagent in zip(self.reagents.names, self.reagents.reagents):
+            self.breakout[name] = [(chemical, conc) for chemical, conc, present
+                                   in zip(reagent.chemicals, reagent.concentrations, reagent.hasconc) if present]
+
+    def volume_matrix(self, voldf):
+        """(wells x reagents) volumes (ul) from the 'Reagent<i> (ul)' columns of voldf, absent reagents are zero
+
+        :raises ValueError: for a reagent column of voldf that is not a reagent of the run
+        """
+        unknown = [reagentname for reagentname in voldf.columns if 'Reagent' in reagentname
+                   and reagentname.split('t')[1].split(' ')[0] not in self.reagents.names]
+        if unknown:
+            raise ValueError('Volumes given for reagents missing from the reagent dictionary: %s' % unknown)
+        volumes = np.zeros((len(voldf), len(self.reagents)))
+        for row, reagent in enumerate(self.reagents.names):
+            reagentname = 'Reagent%s (ul)' % reagent
+            if reagentname in voldf.columns:
+                volumes[:, row] = voldf[reagentname].values
+        return volumes
+
+    def mmols(self, voldf):
+        """mmol of each chemical in each well: DataFrame with one column per chemical"""
+        mmols = self.volume_matrix(voldf).dot(self.matrix) / 1000
+        return pd.DataFrame(mmols, index=voldf.index, columns=self.chemicals)
+
+    def molarity(self, voldf, chemicals=None):
+        """Nominal molarity of each chemical in each well (emsumdf), columns '<chemical> [M]'
+
+        :param chemicals: chemicals (and column order) to report, all chemicals of the run by default
+        """
+        mmols = self.mmols(voldf)
+        if chemicals is not None:
+            mmols = mmols.reindex(columns=list(chemicals), fill_value=0)
+        emsumdf = mmols.divide(voldf.sum(axis=1), axis='rows') * 1000
+        emsumdf.columns = ['%s [M]' % chemical for chemical in emsumdf.columns]
+        return emsumdf
+
+    def mmol_breakout(self, voldf, experiment):
+        """mmol broken out by experiment, reagent and chemical: the wide ermmoldf layout
+
+        Columns are 'mmol_experiment<experiment>_reagent<i>_<chemical>' for every reagent column of voldf.
+        Only needed for the mmol breakout files, the molarities come from molarity()
+        """
+        columns = {}
+        for reagentname in voldf.columns:
+            if 'Reagent' not in reagentname:
+                continue
+            reagent = reagentname.split('t')[1].split(' ')[0]
+            volumes = voldf[reagentname].values
+            for truechemname, conc in self.breakout[reagent]:
+                columns['mmol_experiment%s_reagent%s_%s' % (experiment, reagent, truechemname)] = volumes * conc / 1000
+        return pd.DataFrame(columns, index=voldf.index)
+
+
+def molar_limits_enabled(rxndict):
+    """Whether the chemical molarity limits of the rxndict bound the generated wells
+
+    One switch for the default sampler draws (qrandom), the state set enumeration (statespace) and the
+    repair of quantized wells (quantize): devconfig.sampling_molar_limits, or 'sampling_molar_limits' in
+    the specification
+    """
+    return bool(rxndict.get('sampling_molar_limits', config.sampling_molar_limits))
+
+
+def molar_limits(rxndict, chemicals):
+    """(molarmin, molarmax) of every chemical of chemicals with a molarity limit in the rxndict
+
+    The specification numbers its limited chemicals: chem<N>_molarmin / chem<N>_molarmax hold the limits of
+    the chemical named by chem<N>_abbreviation (see chemical.chemicallimits and log.init).  A chemical
+    name in place of N (chem<name>_molarmax) is read as well.
+
+    :param chemicals: names of the chemicals to report, as in the reagents
+    """
+    limits = {}
+    unnamed = set()
+    for key, value in rxndict.items():
+        match = re.match(r'chem(.+)_molar(min|max)$', key)
+        if match is None or value is None:
+            continue
+        number, bound = match.groups()
+        chemical = rxndict.get('chem%s_abbreviation' % number, number)
+        if chemical not in chemicals:
+            if chemical == number and number.isdigit():
+                unnamed.add(number)
+            continue
+        molarmin, molarmax = limits.get(chemical, (0., np.inf))
+        if bound == 'min':
+            molarmin = float(value)
+        else:
+            molarmax = float(value)
+        limits[chemical] = (molarmin, molarmax)
+    if unnamed:
+        modlog.warning('Molarity limits of chem%s are ignored: no chem<N>_abbreviation names the chemical'
+                       % ', chem'.join(sorted(unnamed)))
+    return limits
+
+
+def well_molarity(mmols, volumes):
+    """(N x chemicals) molarity of mmols (N x chemicals) in total volumes (N,) ul, zero volume counts as 0 M"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(volumes[:, None] > 0, mmols / volumes[:, None] * 1000, 0.)
+
+
+def within_molar_limits(mmols, volumes, limits):
+    """Boolean mask of the rows whose molarity (mmols / volumes) lies within limits, zero volume counts as 0 M
+
+    :param mmols: (N x chemicals) array of mmol
+    :param volumes: (N,) array of total volumes (ul)
+    :param limits: list of (molarmin, molarmax) matching the columns of mmols
+    """
+    molarity = well_molarity(mmols, volumes)
+    lower = np.array([low for low, _ in limits])
+    upper = np.array([high for _, high in limits])
+    return np.all((molarity >= lower) & (molarity <= upper), axis=1)
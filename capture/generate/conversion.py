@@ -0,0 +1,130 @@
+"""Batched conversion of concentration space points to reagent volumes
+
+Python replacement of convertConcentrationsToVolumes / ConvexSolution in randomSampling.wls, which
+runs one FindInstance solve per point.  Here every point is solved against the same precomputed
+factorizations so a whole sample (or enumeration grid) is converted with a few matrix products.
+"""
+import itertools
+import logging
+
+import numpy as np
+
+from capture.generate.polytope import drop_zero_columns, affine_basis, TOL
+from capture.generate.quantize import largest_remainder
+import capture.devconfig as config
+
+modlog = logging.getLogger('capture.generate.conversion')
+
+# largest allowed mismatch (molar) between a requested point and the mixture returned for it
+RESIDUAL_TOL = 1e-6
+
+
+class VolumeConverter:
+    """Solve w >= 0, sum(w) = 1, w.reagent_vectors = x for many concentration points x
+
+    Every affinely independent (dim + 1)-subset of the reagents (dim = dimension of the reagent hull)
+    defines a simplex; its barycentric system is inverted once at construction.  Each point takes the
+    first subset that gives non-negative weights; by Caratheodory's theorem one exists for every point
+    of the hull.  With no redundant reagents there is a single subset and the solution is unique.
+    Points left over (numerically just outside the hull) go through a batched non-negative least squares.
+
+    :param reagent_vectors: dict {'Reagent<i> (ul)': [concentrations]} as made by qrandom.build_reagent_vectors
+    """
+
+    def __init__(self, reagent_vectors):
+        self.reagent_names, self.vectors, self.nonzero_mask, _ = drop_zero_columns(reagent_vectors)
+        self.center, self.basis = affine_basis(self.vectors)
+        self.dim = self.basis.shape[1]
+        self.reduced_vertices = (self.vectors - self.center).dot(self.basis)
+
+        self.factors = []
+        for subset in itertools.combinations(range(len(self.reagent_names)), self.dim + 1):
+            subset = list(subset)
+            system = np.vstack([self.reduced_vertices[subset].T, np.ones(len(subset))])
+            if np.linalg.matrix_rank(system) < len(subset):
+                continue
+            self.factors.append((subset, np.linalg.inv(system)))
+
+    def _nonzero_columns(self, concentrations):
+        """Accept points in either the full species basis or the nonzero species basis"""
+        concentrations = np.asarray(concentrations, dtype=float)
+        if concentrations.size == 0:
+            return np.zeros((0, self.vectors.shape[1]))
+        concentrations = np.atleast_2d(concentrations)
+        if concentrations.shape[1] == len(self.nonzero_mask) and concentrations.shape[1] != self.vectors.shape[1]:
+            absent = np.abs(concentrations[:, ~self.nonzero_mask]).max(axis=1) > RESIDUAL_TOL
+            if absent.any():
+                raise ValueError('%s concentration points hold species that are in none of the reagents'
+                                 % absent.sum())
+            concentrations = concentrations[:, self.nonzero_mask]
+        if concentrations.shape[1] != self.vectors.shape[1]:
+            raise ValueError('concentration points have %s species, reagent vectors have %s'
+                             % (concentrations.shape[1], self.vectors.shape[1]))
+        return concentrations
+
+    def fractions(self, concentrations):
+        """Volume fraction of each reagent for each concentration point
+
+        :param concentrations: (N x species) array of concentrations
+        :return: (N x reagents) array of non-negative volume fractions summing to one, columns ordered as reagent_names
+        :raises ValueError: if a point cannot be made from the reagents
+        """
+        concentrations = self._nonzero_columns(concentrations)
+        npoints = len(concentrations)
+        reduced = (concentrations - self.center).dot(self.basis)
+        rhs = np.vstack([reduced.T, np.ones(npoints)])
+        fractions = np.zeros((npoints, len(self.reagent_names)))
+        solved = np.zeros(npoints, dtype=bool)
+
+        for subset, inverse in self.factors:
+            weights = inverse.dot(rhs[:, ~solved])
+            ok = weights.min(axis=0) >= -TOL * 100
+            idx = np.flatnonzero(~solved)[ok]
+            fractions[np.ix_(idx, subset)] = weights[:, ok].T
+            solved[idx] = True
+            if solved.all():
+                break
+
+        if not solved.all():
+            fractions[~solved] = self._nnls(concentrations[~solved])
+            modlog.info('%s points solved by least squares (outside of every reagent simplex)' % (~solved).sum())
+
+        fractions = np.clip(fractions, 0, None)
+        fractions = fractions / fractions.sum(axis=1, keepdims=True)
+        residual = np.abs(fractions.dot(self.vectors) - concentrations).max(axis=1) if npoints else np.zeros(0)
+        unreachable = residual > RESIDUAL_TOL * max(self.vectors.max(), 1.0)
+        if unreachable.any():
+            raise ValueError('%s concentration points cannot be made from the reagents (largest mismatch %.3g M)'
+                             % (unreachable.sum(), residual.max()))
+        return fractions
+
+    def volumes(self, concentrations, finalVolume=500.):
+        """(N x reagents) array of reagent volumes that make each concentration point at finalVolume"""
+        return finalVolume * self.fractions(concentrations)
+
+    def volume_dict(self, concentrations, finalVolume=500., processValues=None):
+        """Volumes in the format returned by the .wls samplers: {reagent name: list(volumes)}
+
+        :param processValues: function applied to the volumes (np.rint matches the Round default of the .wls),
+                              None snaps each point to devconfig.volume_resolution keeping finalVolume exactly
+                              (quantize.largest_remainder)
+        """
+        volumes = self.volumes(concentrations, finalVolume)
+        if processValues is None:
+            volumes = largest_remainder(volumes, finalVolume, config.volume_resolution)
+        else:
+            volumes = processValues(volumes)
+            if processValues is np.rint:
+                volumes = volumes.astype(int)
+        return {name: volumes[:, i].tolist() for i, name in enumerate(self.reagent_names)}
+
+    def _nnls(self, concentrations, iterations=2000):
+        """Batched projected gradient for min |w.vectors - x|^2, w >= 0, with sum(w) = 1 as a heavy penalty"""
+        weight = max(self.vectors.max(), 1.0) * 10
+        system = np.vstack([self.vectors.T, weight * np.ones(len(self.reagent_names))])
+        targets = np.vstack([concentrations.T, weight * np.ones(len(concentrations))])
+        step = 1.0 / np.linalg.norm(system, 2) ** 2
+        fractions = np.full((len(self.reagent_names), len(concentrations)), 1.0 / len(self.reagent_names))
+        for _ in range(iterations):
+            fractions = np.maximum(fractions - step * system.T.dot(system.dot(fractions) - targets), 0)
+        return fractions.T
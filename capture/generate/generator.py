@@ -10,6 +10,8 @@ import logging
 #from capture.inspect import plotter
 from capture.generate import qrandom
 from capture.generate import statespace
+from capture.generate import schema
+from capture.generate.lattice import StateLattice
 from capture.prepare import stateset
 from capture.prepare import experiment_interface as expint
 import capture.devconfig as config
@@ -42,28 +44,79 @@ def generate_cp_files(vardict, chemdf, rxndict, edict, rdict, climits):
 
 def stateset_generation_pipeline(vardict, chemdf, rxndict, edict, rdict, volspacing):
     """Generate stateset and associated files
-    """
-    erdf, ermmoldf, emsumdf = statespace.preprocess_and_enumerate(chemdf,
-                                                                  rxndict,
-                                                                  edict,
-                                                                  rdict,
-                                                                  volspacing)
 
-    # Clean up dataframe for robot file -> create xls --> upload
-    erdfrows = erdf.shape[0]
-    erdf = expint.cleanvolarray(erdf, lab_safeget(config.lab_vars, globals.get_lab(),'max_reagents'))
-    abstract_reagent_colnames(erdf)
+    With config.stateset_chunksize set the state set is enumerated and written in chunks of that many rows
+    (statespace.enumerate_chunks) so memory use does not grow with the size of the state set, otherwise it
+    is built in memory in one piece.  The returned emsumdf is that of the last chunk written (the whole
+    state set when it is built in one piece).
 
-    ermmolcsv = 'localfiles/%s_mmolbreakout.csv' % rxndict['RunID']
-    abstract_reagent_colnames(ermmoldf)
-    ermmoldf.to_csv(ermmolcsv)
+    Either way the volumes of the whole state set are also kept as a lattice.StateLattice and saved to
+    localfiles/<RunID>_stateset_lattice.npz with the secondary files.
 
+    :raises ValueError: when the state set is empty
+    """
+    if config.stateset_chunksize:
+        chunks = statespace.enumerate_chunks(chemdf, rxndict, edict, rdict, volspacing, config.stateset_chunksize)
+    else:
+        chunks = [statespace.preprocess_and_enumerate(chemdf, rxndict, edict, rdict, volspacing)]
+
+    ermmolcsv = 'localfiles/%s_mmolbreakout.csv' % rxndict['RunID']
     # has no reagent names
     emsumcsv = 'localfiles/%s_nominalMolarity.csv' % rxndict['RunID']
-    emsumdf.to_csv(emsumcsv)
-
     statesetfile = 'localfiles/%sstateset.csv' % rdict['2'].chemicals
     prerun = 'localfiles/%sstateset.link.csv' % rdict['2'].chemicals
+    latticefile = 'localfiles/%s_stateset_lattice.npz' % rxndict['RunID']
+
+    emsumdf = None
+    rowoffset = 0
+    lattices = []
+    for erdf, ermmoldf, emsumdf in chunks:
+        if erdf.shape[0] == 0:
+            continue
+        schema.check(erdf, 'volumes', 'stateset')
+        schema.check(ermmoldf, 'mmol', 'stateset')
+        schema.check(emsumdf, 'molarity', 'stateset')
+        lattices.append(StateLattice.from_volumes(erdf, statespace.lattice_spacing()))
+        firstchunk = rowoffset == 0
+        # append to the files after the first chunk, keeping one running row index
+        mode = 'w' if firstchunk else 'a'
+        rowindex = pd.RangeIndex(rowoffset, rowoffset + erdf.shape[0])
+        abstract_reagent_colnames(ermmoldf)
+        ermmoldf.set_index(rowindex).to_csv(ermmolcsv, mode=mode, header=firstchunk)
+        emsumdf.set_index(rowindex).to_csv(emsumcsv, mode=mode, header=firstchunk)
+
+        emsumdf, prerun_df, stateset_df = stateset_frames(erdf, emsumdf, vardict, chemdf, rxndict, rdict,
+                                                          log_renames=firstchunk)
+        prerun_df.index = rowindex
+        stateset_df.index = rowindex
+        prerun_df.to_csv(prerun, mode=mode, header=firstchunk)
+        stateset_df.to_csv(statesetfile, mode=mode, header=firstchunk)
+        rowoffset += erdf.shape[0]
+    if rowoffset == 0:
+        # nothing was written, there would be no files to upload
+        raise ValueError('The state set of run %s is empty: no volume combination meets the volume and '
+                         'chemical limits of the specification' % rxndict['RunID'])
+    modlog.info('Wrote a state set of %s rows' % rowoffset)
+    lattice = StateLattice.concat(lattices)
+    repeated = int(lattice.duplicated().sum())
+    if repeated:
+        modlog.info('%s rows of the state set repeat the volumes of an earlier row' % repeated)
+    lattice.save(latticefile)
+
+    uploadlist = [prerun, statesetfile]
+    secfilelist = [ermmolcsv, emsumcsv, latticefile, vardict['exefilename']]
+    return emsumdf, uploadlist, secfilelist, rdict
+
+
+def stateset_frames(erdf, emsumdf, vardict, chemdf, rxndict, rdict, log_renames=True):
+    """Turn (part of) an enumerated state set into the frames written out by stateset_generation_pipeline
+
+    :return: (emsumdf, prerun df, stateset df)
+    """
+    # Clean up dataframe for robot file -> create xls --> upload
+    erdfrows = erdf.shape[0]
+    erdf = expint.cleanvolarray(erdf, lab_safeget(config.lab_vars, globals.get_lab(),'max_reagents'))
+    abstract_reagent_colnames(erdf)
 
     # Hardcode the inchikey lookup for the "amine" aka chemical 3 for the time being, though there must be a BETTER WAY!
     inchilist = [(chemdf.loc[rdict['2'].chemicals[1], "InChI Key (ID)"])]*erdfrows
@@ -75,26 +128,22 @@ def stateset_generation_pipeline(vardict, chemdf, rxndict, edict, rdict, volspac
         if chemicalname in vardict['solventlist'] and chemicalname != "FAH":
             solventheader = chemical
 
-    emsumdf.drop(columns=[solventheader], inplace=True)
+    emsumdf = emsumdf.drop(columns=[solventheader])
     emsumdf.rename(columns={"%s [M]" % rdict['2'].chemicals[0]: "_rxn_M_inorganic",
                             "%s [M]" % rdict['2'].chemicals[1]: "_rxn_M_organic",
                             "%s [M]" % rdict['7'].chemicals[0]: "_rxn_M_acid"}, inplace=True)
 
-    modlog.warning("The following chemicals have been assigned generic column names:")
-    modlog.warning("%s [M] --> _rxn_M_inorganic" % rdict['2'].chemicals[0])
-    modlog.warning("%s [M] --> _rxn_M_organic" % rdict['2'].chemicals[1])
-    modlog.warning("%s [M] --> _rxn_M_acid" % rdict['7'].chemicals[0])
+    if log_renames:
+        modlog.warning("The following chemicals have been assigned generic column names:")
+        modlog.warning("%s [M] --> _rxn_M_inorganic" % rdict['2'].chemicals[0])
+        modlog.warning("%s [M] --> _rxn_M_organic" % rdict['2'].chemicals[1])
+        modlog.warning("%s [M] --> _rxn_M_acid" % rdict['7'].chemicals[0])
 
     ddf = stateset.augdescriptors(inchidf, rxndict, erdfrows)
     prerun_df = pd.concat([erdf, emsumdf, ddf], axis=1)
     stateset_df = pd.concat([emsumdf,ddf], axis=1)
     # stateset_df = emsumdf #toggle to prevent state space from having all of the features added # todo ??
-    prerun_df.to_csv(prerun)
-    stateset_df.to_csv(statesetfile)
-
-    uploadlist = [prerun, statesetfile]
-    secfilelist = [ermmolcsv, emsumcsv, vardict['exefilename']]
-    return emsumdf, uploadlist, secfilelist, rdict
+    return emsumdf, prerun_df, stateset_df
 
 
 ####################################
@@ -121,6 +170,10 @@ def quasirandom_generation_pipeline(vardict, chemdf, rxndict, edict, rdict, old_
                                                                            rdict,
                                                                            old_reagents,
                                                                            climits)
+    schema.check(erdf, 'volumes', 'quasirandom')
+    schema.check(ermmoldf, 'mmol', 'quasirandom')
+    schema.check(emsumdf, 'molarity', 'quasirandom')
+    schema.check(model_info_df, 'models', 'quasirandom')
     # Clean up dataframe for robot file -> create xls --> upload
     erdf = expint.cleanvolarray(erdf, maxr=lab_safeget(config.lab_vars, globals.get_lab(),'max_reagents'))
 
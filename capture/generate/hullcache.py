@@ -0,0 +1,147 @@
+"""Content addressed on-disk cache of reagent hull geometry
+
+The same stock solutions are used across many runs, so the facets of their hull are looked up by a hash of
+the reagent vectors, max_conc and the nonzero species mask instead of being enumerated again.  Entries are
+.npz files in localfiles/hullcache; the least recently used ones are deleted once the directory grows past
+config.hull_cache_max_bytes.
+
+Every ReagentHull of the samplers comes from cached_hull: NativeSampler sampling, difference sampling and
+grid enumeration, and the Python simplex path of the Wolfram sampler.  The Wolfram kernel functions
+(randomlySample, enumerativelySample) build their hull inside Mathematica and cannot use it.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+import capture.devconfig as config
+from capture.generate.polytope import ReagentHull, drop_zero_columns
+
+modlog = logging.getLogger('capture.generate.hullcache')
+
+CACHE_DIR = './localfiles/hullcache'
+
+# bump when the cached fields or their meaning change
+CACHE_VERSION = 2
+
+
+def hull_key(reagent_vectors, max_conc):
+    """Hash of everything the hull geometry depends on"""
+    names, vectors, nonzero_mask, _ = drop_zero_columns(reagent_vectors)
+    digest = hashlib.sha1()
+    digest.update(json.dumps([CACHE_VERSION, names, float(max_conc)]).encode())
+    digest.update(np.ascontiguousarray(vectors, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(nonzero_mask, dtype=bool).tobytes())
+    return digest.hexdigest()
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, '%s.npz' % key)
+
+
+def load_entry(key, cache_dir=CACHE_DIR):
+    """Cached arrays for key (marking the entry as recently used), None on a miss
+
+    Entries that cannot be read (a truncated or otherwise damaged .npz) count as a miss.
+    """
+    path = _entry_path(key, cache_dir)
+    try:
+        with np.load(path) as entry:
+            arrays = {name: entry[name] for name in entry.files}
+    except (IOError, OSError, ValueError, zipfile.BadZipFile):
+        return None
+    try:
+        os.utime(path, None)
+    except OSError:
+        # evicted by another worker since, the arrays are still good
+        pass
+    return arrays
+
+
+def store_entry(key, arrays, cache_dir=CACHE_DIR, max_bytes=None):
+    """Write an entry atomically (workers may share the cache) and evict the least recently used entries
+
+    The entry is written to a .tmp file first, which evict leaves alone, and renamed into place when complete.
+    """
+    tmppath = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        handle, tmppath = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        with os.fdopen(handle, 'wb') as tmpfile:
+            np.savez(tmpfile, **arrays)
+        os.replace(tmppath, _entry_path(key, cache_dir))
+    except (IOError, OSError) as e:
+        modlog.warning('Unable to write hull cache entry %s: %s' % (key, e))
+        if tmppath is not None and os.path.exists(tmppath):
+            os.remove(tmppath)
+        return
+    evict(cache_dir, config.hull_cache_max_bytes if max_bytes is None else max_bytes)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=None):
+    """Delete the least recently used entries until the cache fits in max_bytes
+
+    Only complete entries (.npz) are considered, never the .tmp files of entries still being written.
+    """
+    max_bytes = config.hull_cache_max_bytes if max_bytes is None else max_bytes
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith('.npz'):
+            path = os.path.join(cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def describe_hull(hull):
+    """Arrays stored for a hull: the geometry to rebuild it and its redundant reagents
+
+    Only what comes out of the facet enumeration is stored.  The vertices and volume of the allowed region
+    are not needed to sample or enumerate it and cost far more than the facets, they are left to
+    hull.vertices() / hull.volume() for whoever asks.
+    """
+    return {'center': hull.center,
+            'basis': hull.basis,
+            'hull_A': hull.hull_A,
+            'hull_b': hull.hull_b,
+            'A': hull.A,
+            'b': hull.b,
+            'redundant_reagents': np.array(hull.redundant_reagents(), dtype=str)}
+
+
+def cached_hull(reagent_vectors, max_conc, cache_dir=CACHE_DIR):
+    """ReagentHull for the reagent vectors, rebuilt from the cache when the same hull was seen before
+
+    The cache entry (see describe_hull) is attached as hull.cached.
+    Disabled with config.hull_cache = False.
+    """
+    if not config.hull_cache:
+        return ReagentHull(reagent_vectors, max_conc)
+
+    key = hull_key(reagent_vectors, max_conc)
+    entry = load_entry(key, cache_dir)
+    if entry is not None:
+        modlog.info('Hull cache hit %s' % key)
+        hull = ReagentHull(reagent_vectors, max_conc, geometry=entry)
+    else:
+        hull = ReagentHull(reagent_vectors, max_conc)
+        entry = describe_hull(hull)
+        store_entry(key, entry, cache_dir)
+        modlog.info('Hull cache miss %s: redundant reagents %s' % (key, entry['redundant_reagents'].tolist()))
+    hull.cached = entry
+    return hull
@@ -0,0 +1,194 @@
+"""Integer lattice representation of enumerated state sets
+
+Every volume of an enumerated state set is offset + k * spacing for a small non-negative integer k
+(k * config.volspacing for the default enumeration, k * config.volume_resolution for the hull enumerations).
+StateLattice keeps the k as a (rows x reagents) uint16 array with the spacing, offsets and largest index of
+each column as a header, a quarter of the memory of the float64 volume frame, and packs each row into one 64
+bit key so that dropping duplicates and looking rows up are hash table operations instead of float row
+comparisons.
+
+The enumerations drop repeated rows by key (statespace), and the state set of a run is stored in this form
+next to its csv files (generator.stateset_generation_pipeline).
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from capture.generate import calcs
+
+modlog = logging.getLogger('capture.generate.lattice')
+
+# largest lattice index a uint16 can hold
+MAX_INDEX = np.iinfo(np.uint16).max
+KEY_BITS = 64
+# how far (in units of spacing) a volume may be off the lattice and still be snapped to it
+SNAP_TOL = 1e-6
+
+
+class StateLattice:
+    """State set volumes as uint16 lattice indices: volume = offset + index * spacing
+
+    Keys of two lattices are comparable when their headers (columns, spacing, offsets and maxindex) match,
+    so lattices built chunk by chunk with the same header can be checked against each other.
+
+    :param indices: (rows x reagents) non-negative integer array
+    :param columns: reagent column names ('Reagent<i> (ul)'), one per column of indices
+    :param spacing: volume (ul) between neighbouring lattice points
+    :param offset: per column volume (ul) of index 0, zero by default
+    :param maxindex: per column largest index the lattice may hold (sets the bits of each column in the
+                     keys), the largest index present by default
+    """
+
+    def __init__(self, indices, columns, spacing, offset=None, maxindex=None):
+        indices = np.asarray(indices).reshape(-1, len(columns))
+        if indices.size and (indices.min() < 0 or indices.max() > MAX_INDEX):
+            raise ValueError('Lattice indices must lie within [0, %s]' % MAX_INDEX)
+        self.indices = np.ascontiguousarray(indices, dtype=np.uint16)
+        self.columns = list(columns)
+        self.spacing = spacing
+        self.offset = np.zeros(len(self.columns)) if offset is None else np.asarray(offset, dtype=float)
+
+        present = self.indices.max(axis=0).astype(int) if len(self.indices) else np.zeros(len(self.columns), int)
+        if maxindex is None:
+            maxindex = present
+        maxindex = np.broadcast_to(np.asarray(maxindex, dtype=int), (len(self.columns),))
+        if np.any(present > maxindex):
+            raise ValueError('Lattice indices exceed the maxindex of the header')
+        self.maxindex = np.array(maxindex, dtype=int)
+        # bits of each column in the packed keys
+        self.widths = np.array([max(int(value).bit_length(), 1) for value in self.maxindex], dtype=np.uint64)
+        self.shifts = np.concatenate([[0], np.cumsum(self.widths)[:-1]]).astype(np.uint64)
+
+    @classmethod
+    def from_volumes(cls, voldf, spacing, offset=None, columns=None, maxindex=None):
+        """Lattice of the volumes in voldf, missing values (reagents absent from a row) count as 0 ul
+
+        :param spacing: lattice spacing (ul)
+        :param columns: reagent columns to keep (and their order), those of voldf by default
+        :param maxindex: see StateLattice
+        :raises ValueError: if a volume is not on the lattice or beyond MAX_INDEX steps
+        """
+        columns = list(voldf.columns) if columns is None else list(columns)
+        volumes = voldf.reindex(columns=columns).values.astype(float)
+        volumes = np.where(np.isnan(volumes), 0., volumes)
+        offset = np.zeros(len(columns)) if offset is None else np.broadcast_to(np.asarray(offset, float), (len(columns),))
+        steps = (volumes - offset) / spacing
+        indices = np.rint(steps)
+        if steps.size and np.abs(steps - indices).max() > SNAP_TOL:
+            raise ValueError('Volumes are not on the lattice of spacing %s ul' % spacing)
+        return cls(indices, columns, spacing, offset, maxindex)
+
+    @classmethod
+    def concat(cls, lattices, columns=None):
+        """Stack lattices with the same spacing, columns absent from a lattice are index 0
+
+        :param columns: columns of the result, the sorted union of the columns of the lattices by default
+        :raises ValueError: if the spacings differ, or an absent column would need a nonzero offset
+        """
+        lattices = list(lattices)
+        spacings = set(lattice.spacing for lattice in lattices)
+        if len(spacings) > 1:
+            raise ValueError('Cannot combine lattices of different spacings: %s' % sorted(spacings))
+        if columns is None:
+            columns = sorted(set(column for lattice in lattices for column in lattice.columns))
+        offset = np.zeros(len(columns))
+        maxindex = np.zeros(len(columns), dtype=int)
+        present = np.zeros(len(columns), dtype=bool)
+        parts = []
+        for lattice in lattices:
+            position = [columns.index(column) for column in lattice.columns]
+            if np.any(present[position] & (offset[position] != lattice.offset)):
+                raise ValueError('Cannot combine lattices with different offsets')
+            offset[position] = lattice.offset
+            maxindex[position] = np.maximum(maxindex[position], lattice.maxindex)
+            present[position] = True
+            part = np.zeros((len(lattice), len(columns)), dtype=np.uint16)
+            part[:, position] = lattice.indices
+            parts.append(part)
+        if any(len(lattice.columns) < len(columns) for lattice in lattices) and offset.any():
+            raise ValueError('Columns absent from some of the lattices must have a zero offset')
+        indices = np.concatenate(parts) if parts else np.zeros((0, len(columns)), dtype=np.uint16)
+        return cls(indices, columns, spacings.pop() if spacings else 1, offset, maxindex)
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes
+
+    def same_header(self, other):
+        """True when the keys of other can be compared with the keys of this lattice"""
+        return (other.columns == self.columns and other.spacing == self.spacing
+                and np.array_equal(other.offset, self.offset) and np.array_equal(other.maxindex, self.maxindex))
+
+    def keys(self):
+        """One uint64 per row packing all of its lattice indices (comparable between lattices of the same header)
+
+        :raises ValueError: if the columns need more than KEY_BITS bits together
+        """
+        if not self.keyable:
+            raise ValueError('Rows need %s bits, more than fit in a %s bit key' % (int(self.widths.sum()), KEY_BITS))
+        keys = np.zeros(len(self.indices), dtype=np.uint64)
+        for column, shift in enumerate(self.shifts):
+            keys |= self.indices[:, column].astype(np.uint64) << shift
+        return keys
+
+    def take(self, rows):
+        """Lattice of the selected rows (positions or boolean mask), same header"""
+        return StateLattice(self.indices[rows], self.columns, self.spacing, self.offset, self.maxindex)
+
+    @property
+    def keyable(self):
+        """True when a row fits in one KEY_BITS bit key"""
+        return int(self.widths.sum()) <= KEY_BITS
+
+    def duplicated(self):
+        """Boolean mask of the rows repeating an earlier row
+
+        Hashes the packed keys, rows too wide for a key are compared index by index instead.
+        """
+        if not self.keyable:
+            return pd.DataFrame(self.indices).duplicated(keep='first').values
+        return pd.Index(self.keys()).duplicated(keep='first')
+
+    def unique(self):
+        """Lattice without repeated rows, first occurrences kept in order"""
+        return self.take(~self.duplicated())
+
+    def lookup(self, other):
+        """Row of this lattice holding each row of other, -1 where there is none
+
+        :param other: StateLattice with the same header
+        :raises ValueError: if the headers differ or this lattice has repeated rows
+        """
+        if not self.same_header(other):
+            raise ValueError('Lattices must share columns, spacing, offsets and maxindex to be compared')
+        index = pd.Index(self.keys())
+        if not index.is_unique:
+            raise ValueError('Lookup needs a lattice without repeated rows, see unique()')
+        return index.get_indexer(other.keys())
+
+    def volumes(self):
+        """Volume (ul) DataFrame with the lattice columns, integer when the header is"""
+        volumes = self.offset + self.indices * float(self.spacing)
+        if float(self.spacing).is_integer() and np.all(np.mod(self.offset, 1) == 0):
+            volumes = volumes.astype(np.int64)
+        return pd.DataFrame(volumes, columns=self.columns)
+
+    def mmols(self, rdict):
+        """mmol of each chemical in each row, see calcs.ConcentrationMatrix.mmols"""
+        return calcs.ConcentrationMatrix(rdict).mmols(self.volumes())
+
+    def save(self, path):
+        """Write the indices and header to a .npz file"""
+        np.savez_compressed(path, indices=self.indices, columns=np.array(self.columns),
+                            spacing=self.spacing, offset=self.offset, maxindex=self.maxindex)
+
+    @classmethod
+    def load(cls, path):
+        """Read a lattice written by save"""
+        with np.load(path) as data:
+            return cls(data['indices'], data['columns'].tolist(), data['spacing'].item(), data['offset'],
+                       data['maxindex'])
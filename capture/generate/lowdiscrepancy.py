@@ -0,0 +1,170 @@
+"""Scrambled low-discrepancy sequences (Sobol and Halton) for quasi-random sampling
+
+Engines are seedable and batched: successive calls to random(n) continue the same sequence,
+so large candidate pools can be generated in chunks.
+"""
+import logging
+
+import numpy as np
+
+modlog = logging.getLogger('capture.generate.lowdiscrepancy')
+
+# bits of precision of the Sobol points
+SOBOL_BITS = 30
+
+# Joe & Kuo (2008) direction numbers for dimensions 2..21: (degree s, polynomial a, initial m_1..m_s)
+# dimension 1 is the van der Corput sequence (all m_i = 1)
+_SOBOL_DIRECTIONS = [
+    (1, 0, (1,)),
+    (2, 1, (1, 3)),
+    (3, 1, (1, 3, 1)),
+    (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)),
+    (5, 4, (1, 1, 5, 5, 5)),
+    (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)),
+    (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+    (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+]
+
+_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73]
+
+MAX_DIM = len(_SOBOL_DIRECTIONS) + 1
+
+SEQUENCES = ('sobol', 'halton', 'random')
+
+
+def _sobol_direction_numbers(dim):
+    """Return the (dim x SOBOL_BITS) integer direction numbers v_j = m_j * 2^(BITS - j)"""
+    directions = np.zeros((dim, SOBOL_BITS), dtype=np.int64)
+    shifts = SOBOL_BITS - 1 - np.arange(SOBOL_BITS)
+    directions[0] = np.left_shift(1, shifts)
+    for d in range(1, dim):
+        degree, poly, initial = _SOBOL_DIRECTIONS[d - 1]
+        m = list(initial)
+        for i in range(degree, SOBOL_BITS):
+            new = m[i - degree] ^ (m[i - degree] << degree)
+            for k in range(1, degree):
+                new ^= ((poly >> (degree - 1 - k)) & 1) * m[i - k] << k
+            m.append(new)
+        directions[d] = np.left_shift(np.array(m, dtype=np.int64), shifts)
+    return directions
+
+
+class SobolEngine:
+    """Sobol sequence with linear matrix scrambling and a random digital shift (Matousek 1998)
+
+    :param dim: dimension of the points (at most MAX_DIM)
+    :param scramble: apply the random scrambling, False gives the plain Sobol sequence
+    :param seed: seed or numpy RandomState for the scrambling
+    """
+
+    def __init__(self, dim, scramble=True, seed=None):
+        if not 1 <= dim <= MAX_DIM:
+            raise ValueError('Sobol engine supports 1 to %s dimensions, got %s' % (MAX_DIM, dim))
+        self.dim = dim
+        self.index = 0
+        rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+        directions = _sobol_direction_numbers(dim)
+        self.shift = np.zeros(dim, dtype=np.int64)
+        if scramble:
+            bitweights = np.left_shift(1, SOBOL_BITS - 1 - np.arange(SOBOL_BITS)).astype(np.int64)
+            for d in range(dim):
+                # random lower triangular matrix with unit diagonal acting on the bits (most significant first)
+                lower = np.tril(rng.randint(0, 2, size=(SOBOL_BITS, SOBOL_BITS)), -1) + np.eye(SOBOL_BITS, dtype=int)
+                bits = (directions[d][:, None] & bitweights[None, :]) > 0
+                directions[d] = ((bits.astype(int).dot(lower.T) % 2) * bitweights).sum(axis=1)
+            self.shift = rng.randint(0, 2 ** SOBOL_BITS, size=dim).astype(np.int64)
+        self.directions = directions
+
+    def random(self, n):
+        """Return the next n points of the sequence as an (n x dim) array in [0, 1)"""
+        if n <= 0:
+            return np.zeros((0, self.dim))
+        # first point directly from the gray code of its index, the rest by the usual
+        # one-direction-per-step gray code recursion done as a cumulative xor
+        gray = self.index ^ (self.index >> 1)
+        first = self.shift.copy()
+        for bit in range(SOBOL_BITS):
+            if (gray >> bit) & 1:
+                first ^= self.directions[:, bit]
+        steps = np.arange(self.index + 1, self.index + n, dtype=np.int64)
+        changed = np.log2(steps & -steps).astype(int)  # index of the lowest set bit
+        points = np.bitwise_xor.accumulate(np.vstack([first, self.directions[:, changed].T]), axis=0)
+        self.index += n
+        return points / float(2 ** SOBOL_BITS)
+
+    def fast_forward(self, n):
+        """Skip the next n points"""
+        self.index += n
+        return self
+
+
+class HaltonEngine:
+    """Halton sequence with random digit permutations (0 kept fixed so expansions stay finite)
+
+    :param dim: dimension of the points (at most MAX_DIM)
+    :param scramble: apply the random permutations, False gives the plain Halton sequence
+    :param seed: seed or numpy RandomState for the scrambling
+    """
+
+    def __init__(self, dim, scramble=True, seed=None):
+        if not 1 <= dim <= MAX_DIM:
+            raise ValueError('Halton engine supports 1 to %s dimensions, got %s' % (MAX_DIM, dim))
+        self.dim = dim
+        self.index = 0
+        rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+        self.bases = _PRIMES[:dim]
+        self.permutations = []
+        for base in self.bases:
+            permutation = np.arange(base)
+            if scramble:
+                permutation[1:] = 1 + rng.permutation(base - 1)
+            self.permutations.append(permutation)
+
+    def random(self, n):
+        """Return the next n points of the sequence as an (n x dim) array in [0, 1)"""
+        indices = np.arange(self.index, self.index + n, dtype=np.int64)
+        points = np.zeros((n, self.dim))
+        for d, (base, permutation) in enumerate(zip(self.bases, self.permutations)):
+            remaining = indices.copy()
+            scale = 1.0 / base
+            while remaining.any():
+                points[:, d] += permutation[remaining % base] * scale
+                remaining //= base
+                scale /= base
+        self.index += n
+        return points
+
+    def fast_forward(self, n):
+        """Skip the next n points"""
+        self.index += n
+        return self
+
+
+def unit_hypercube(n, dim, sequence='sobol', rng=None):
+    """Draw n points in the dim dimensional unit hypercube
+
+    :param sequence: one of SEQUENCES: 'sobol' or 'halton' (scrambled, seeded from rng) or 'random' (rng directly)
+    :param rng: numpy RandomState, a fresh one is made if None
+    :return: (n x dim) array in [0, 1)
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    if sequence == 'sobol':
+        return SobolEngine(dim, seed=rng).random(n)
+    elif sequence == 'halton':
+        return HaltonEngine(dim, seed=rng).random(n)
+    elif sequence == 'random':
+        return rng.random_sample((n, dim))
+    raise ValueError('Unknown sampling sequence: {}, expected one of {}'.format(sequence, SEQUENCES))
@@ -0,0 +1,295 @@
+import logging
+
+import numpy as np
+
+from capture.generate.hullcache import cached_hull
+from capture.generate.polytope import simplex_acceptance, TOL
+from capture.generate.conversion import VolumeConverter
+
+modlog = logging.getLogger('capture.generate.nativesampler')
+
+
+class NativeSampler:
+
+    def __init__(self, seed=None, burnin_per_dim=50, thinning_per_dim=5, max_chains=256):
+        """Pure NumPy stand in for WolframSampler
+
+        Uniformly samples the convex hull of the reagent vectors (intersected with the max molarity
+        cuboid) with vectorized hit-and-run, no Wolfram kernel required.  Points are turned into
+        volumes with conversion.VolumeConverter.
+        Exposes the same call signatures and return formats as WolframSampler.randomlySample and
+        WolframSampler.enumerativelySample.
+
+        :param seed: seed or numpy RandomState for the random number generator, None draws fresh entropy
+        :param burnin_per_dim: hit-and-run steps discarded per dimension of the hull before the first sample
+        :param thinning_per_dim: hit-and-run steps per dimension of the hull between samples of one chain
+        :param max_chains: number of hit-and-run chains advanced together
+        """
+        self.rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+        self.burnin_per_dim = burnin_per_dim
+        self.thinning_per_dim = thinning_per_dim
+        self.max_chains = max_chains
+        self.acceptance = None  # measured acceptance rate of the last rejection sample or grid enumeration
+
+    def randomlySample(self, reagentVectors, oldReagents=None, nExpt=96, maxMolarity=9., finalVolume=500.):
+        """Randomly sample possible experiments in the convex hull of concentration space defined by the reagentVectors
+
+        Matches WolframSampler.randomlySample (generateExperiments in randomSampling.wls)
+
+        :param reagentVectors: a dictionary of vector representations of reagents living in species-concentration space
+        :param nExpt: the number of samples to draw
+        :param maxMolarity: the maximum concentration of any species: defines a hypercube bounding the convex hull
+        :param finalVolume: a scalar to act on the concentrations to convert to desired volume
+        :return: a dictionary mapping: {reagents => list(volumes)} where list(volumes) has length nExpt
+        :param oldReagents: optional dictionary of old reagent vectors (same species as reagentVectors), experiments
+                            inside their convex hull are excluded (multi-stock sampling)
+        :raises TypeError: to keep parity with the Wolfram sampler
+        :raises ValueError: if the allowed region is empty or covered by the hull of the old reagents
+        """
+        if not isinstance(reagentVectors, dict):
+            raise TypeError('reagentVectors must be dict, got {}'.format(type(reagentVectors)))
+        if not isinstance(nExpt, int):
+            raise TypeError('nExpt must be int, got {}'.format(type(nExpt)))
+        if not isinstance(maxMolarity, float):
+            raise TypeError('maxMolarity must be float, got {}'.format(type(maxMolarity)))
+        if not isinstance(finalVolume, float):
+            raise TypeError('finalVolume must be float, got {}'.format(type(finalVolume)))
+        if oldReagents and not isinstance(oldReagents, dict):
+            raise TypeError('oldReagents must be dict, got {}'.format(type(oldReagents)))
+
+        self.acceptance = None
+        hull = cached_hull(reagentVectors, maxMolarity)
+        oldhull = None
+        if oldReagents:
+            try:
+                oldhull = cached_hull(oldReagents, maxMolarity)
+            except ValueError:
+                modlog.info('Old reagents describe a single composition, nothing to exclude')
+        if oldhull is not None:
+            concentrations = self.sampleDifference(hull, oldhull, nExpt)
+        else:
+            concentrations = self.sampleConcentrations(hull, nExpt)
+        return VolumeConverter(reagentVectors).volume_dict(concentrations, finalVolume)
+
+    def sampleDifference(self, hull, oldhull, nExpt, max_draws=10 ** 7):
+        """Draw nExpt points uniformly from hull minus oldhull (multi-stock sampling)
+
+        Candidate batches are drawn uniformly from hull and the ones inside oldhull (a half-space test in the
+        old hull's coordinates) are rejected, which works in any dimension.  Batch sizes follow the measured
+        acceptance rate, which is logged and kept in self.acceptance.
+
+        :param hull: ReagentHull of the new reagents
+        :param oldhull: ReagentHull of the old reagents, over the same species
+        :return: (nExpt x nonzero species of hull) array of concentrations
+        :raises ValueError: when (almost) all of hull is covered by oldhull
+        """
+        if len(oldhull.nonzero_mask) != len(hull.nonzero_mask):
+            raise ValueError('Old reagents are defined over %s species, new reagents over %s'
+                             % (len(oldhull.nonzero_mask), len(hull.nonzero_mask)))
+        nspecies = len(hull.nonzero_mask)
+        accepted = []
+        naccepted = 0
+        ndrawn = 0
+        acceptance = 1.0
+        while naccepted < nExpt and ndrawn < max_draws:
+            batch = int(min(max_draws - ndrawn, max(256, 1.2 * (nExpt - naccepted) / max(acceptance, 1e-3))))
+            candidates = self.sampleConcentrations(hull, batch)
+            full = np.zeros((batch, nspecies))
+            full[:, hull.nonzero_mask] = candidates
+            # points with a species absent from every old reagent are outside of the old hull
+            outside_span = np.any(full[:, ~oldhull.nonzero_mask] > TOL, axis=1)
+            inside = ~outside_span & oldhull.contains(full[:, oldhull.nonzero_mask])
+            accepted.append(candidates[~inside])
+            naccepted += int((~inside).sum())
+            ndrawn += batch
+            acceptance = naccepted / float(ndrawn)
+            if naccepted == 0 and ndrawn >= 10 ** 5:
+                break
+
+        self.acceptance = acceptance
+        modlog.info('Multi-stock sampling: measured acceptance %.3g over %s candidates' % (acceptance, ndrawn))
+        if naccepted == 0:
+            raise ValueError('New reagents define a convex hull that is covered by that of old reagents.')
+        if naccepted < nExpt:
+            raise ValueError('Only %s of %s candidates fall outside of the old reagent hull, the remaining space is '
+                             'too small to sample %s experiments' % (naccepted, ndrawn, nExpt))
+        return np.concatenate(accepted)[:nExpt]
+
+    def sampleConcentrations(self, hull, nExpt):
+        """Draw nExpt points uniformly from the allowed region
+
+        Simplex hulls go through sampleSimplex, anything else (or a simplex mostly cut off by max_conc)
+        through sampleHitAndRun.
+
+        :param hull: ReagentHull
+        :param nExpt: number of points
+        :return: (nExpt x nonzero species) array of concentrations
+        """
+        if hull.is_simplex:
+            concentrations = self.sampleSimplex(hull, nExpt)
+            if concentrations is not None:
+                return concentrations
+        return self.sampleHitAndRun(hull, nExpt)
+
+    def sampleSimplex(self, hull, nExpt, min_acceptance=1e-3, max_draws=10 ** 7):
+        """Draw nExpt points uniformly from a simplex hull by drawing the reagent fractions directly
+
+        Fractions uniform on the simplex (Dirichlet(1, ..., 1)) map to concentrations uniform on the hull,
+        only the points outside of the max_conc cuboid are rejected.
+
+        :param min_acceptance: give up (return None) when the measured acceptance falls below this
+        :param max_draws: give up (return None) after this many fractions are drawn
+        :return: (nExpt x nonzero species) array of concentrations, or None when rejection is not practical
+        """
+        estimate = simplex_acceptance(hull.vectors, hull.max_conc)
+        modlog.info('Reagent hull is a simplex, drawing reagent fractions directly (analytic acceptance estimate %.3g)'
+                    % estimate)
+        accepted = []
+        naccepted = 0
+        ndrawn = 0
+        while naccepted < nExpt and ndrawn < max_draws:
+            expected = max(estimate, min_acceptance)
+            batch = int(min(max_draws - ndrawn, max(1024, 1.2 * (nExpt - naccepted) / expected)))
+            fractions = self.rng.dirichlet(np.ones(len(hull.vectors)), size=batch)
+            points = fractions.dot(hull.vectors)
+            points = points[np.all(points <= hull.max_conc + TOL, axis=1)]
+            accepted.append(points)
+            naccepted += len(points)
+            ndrawn += batch
+            if naccepted / ndrawn < min_acceptance:
+                break
+
+        acceptance = naccepted / float(ndrawn)
+        self.acceptance = acceptance
+        modlog.info('Measured acceptance %.3g over %s draws' % (acceptance, ndrawn))
+        if naccepted < nExpt:
+            modlog.warning('Only %s of %s simplex draws fall inside max_conc=%s, switching to hit-and-run'
+                           % (naccepted, ndrawn, hull.max_conc))
+            return None
+        return np.concatenate(accepted)[:nExpt]
+
+    def sampleHitAndRun(self, hull, nExpt):
+        """Draw nExpt points uniformly from the allowed region with hit-and-run
+
+        Chains are advanced together as one (chains x dim) array.  Directions are drawn from a normal
+        distribution shaped by the covariance of a pilot sample, which keeps mixing reasonable in
+        elongated hulls; any symmetric direction distribution leaves the uniform distribution invariant.
+
+        :param hull: ReagentHull
+        :param nExpt: number of points
+        :return: (nExpt x nonzero species) array of concentrations
+        """
+        start, pilot = hull.interior_point(self.rng)
+        dim = hull.dim
+        if len(pilot) > 2 * dim:
+            cov = np.atleast_2d(np.cov(pilot, rowvar=False))
+            try:
+                shape = np.linalg.cholesky(cov + TOL * np.eye(dim))
+            except np.linalg.LinAlgError:
+                shape = np.eye(dim)
+        else:
+            shape = np.eye(dim)
+
+        nchains = max(1, min(nExpt, self.max_chains))
+        nrounds = -(-nExpt // nchains)
+        burnin = self.burnin_per_dim * dim
+        thinning = max(1, self.thinning_per_dim * dim)
+
+        points = np.tile(start, (nchains, 1))
+        samples = []
+        for step in range(burnin + nrounds * thinning):
+            direction = self.rng.standard_normal((nchains, dim)).dot(shape.T)
+            tmin, tmax = hull.chord(points, direction)
+            points = points + (tmin + self.rng.random_sample(nchains) * (tmax - tmin))[:, None] * direction
+            if step >= burnin and (step - burnin + 1) % thinning == 0:
+                samples.append(points.copy())
+
+        reduced = np.concatenate(samples)[:nExpt]
+        return hull.to_concentrations(reduced)
+
+    def enumerativelySample(self, reagentVectors, uniqueChemNames, deltaV=10., maxMolarity=9., finalVolume=500.,
+                            blocksize=2 ** 18):
+        """Enumerate the regularly spaced grid of experiments in the convex hull defined by the reagentVectors
+
+        Matches WolframSampler.enumerativelySample (generateEnumerations in enumerativeSampling.wls)
+
+        :param reagentVectors: a dictionary of vector representations of reagents living in species-concentration space
+        :param uniqueChemNames: list of chemicals making up the reagents
+        :param deltaV: the spacing of reagent volumes that define the spacing of the grid in concentration space
+        :param maxMolarity: the maximum concentration of any species: defines a hypercube bounding the convex hull
+        :param finalVolume: a scalar to act on the concentration points to convert to desired volume
+        :param blocksize: grid points tested at a time
+        :return:  a dictionary {'concentrations': {species => list(concentrations)}, 'volumes': {reagents => list(volumes)}}
+        :raises TypeError: to keep parity with the Wolfram sampler
+        """
+        concentrations = {}
+        volumes = {}
+        for block in self.enumerativeBlocks(reagentVectors, uniqueChemNames, deltaV, maxMolarity, finalVolume,
+                                            blocksize):
+            for key, result in (('concentrations', concentrations), ('volumes', volumes)):
+                for name, values in block[key].items():
+                    result.setdefault(name, []).extend(values)
+        return {'concentrations': concentrations, 'volumes': volumes}
+
+    def enumerativeBlocks(self, reagentVectors, uniqueChemNames, deltaV=10., maxMolarity=9., finalVolume=500.,
+                          blocksize=2 ** 18):
+        """Stream the result of enumerativelySample: one {'concentrations', 'volumes'} dict per block of grid points
+
+        Blocks without an accepted point are skipped.  Arguments as enumerativelySample.
+        """
+        if not isinstance(reagentVectors, dict):
+            raise TypeError('reagentVectors must be dict, got {}'.format(type(reagentVectors)))
+        if not isinstance(uniqueChemNames, list):
+            raise TypeError('uniqueChemNames must be a list, got {}'.format(type(uniqueChemNames)))
+        if not isinstance(maxMolarity, float):
+            raise TypeError('maxMolarity must be float, got {}'.format(type(maxMolarity)))
+        if not isinstance(deltaV, float):
+            raise TypeError('deltaV must be float, got {}'.format(type(deltaV)))
+        if not isinstance(finalVolume, float):
+            raise TypeError('finalVolume must be float, got {}'.format(type(finalVolume)))
+
+        hull = cached_hull(reagentVectors, maxMolarity)
+        names = [name for name, nonzero in zip(uniqueChemNames, hull.nonzero_mask) if nonzero]
+        converter = VolumeConverter(reagentVectors)
+        for points in self.enumerateConcentrations(hull, deltaV, finalVolume, blocksize):
+            yield {'concentrations': {name: points[:, i].tolist() for i, name in enumerate(names)},
+                   'volumes': converter.volume_dict(points, finalVolume)}
+
+    def enumerateConcentrations(self, hull, deltaV, finalVolume, blocksize=2 ** 18):
+        """Grid points of achievableGrid (enumerativeSampling.wls) inside the allowed region, block by block
+
+        The axis of every nonzero species runs from the largest concentration of that species in any reagent
+        down to 0 in steps of max*deltaV/finalVolume (Range[max, 0, -max*deltaV/totalVolume]).  Values above
+        max_conc can never be inside and are dropped from the axes up front.  The remaining product grid is
+        walked in blocks of flat indices and each block is tested with one A.x <= b product (hull.contains),
+        so points come out in the order of Flatten[Outer[...]] without the grid ever being held in memory.
+
+        :param hull: ReagentHull
+        :param deltaV: volume spacing (ul) at finalVolume
+        :param finalVolume: total volume (ul)
+        :param blocksize: grid points tested at a time
+        :return: generator of (M x nonzero species) arrays of accepted concentrations, M <= blocksize
+        """
+        species_max = hull.vectors.max(axis=0)
+        nsteps = int(np.floor(finalVolume / deltaV + TOL))
+        axes = []
+        for top in species_max:
+            axis = top - top * (deltaV / finalVolume) * np.arange(nsteps + 1)
+            # Range stops at 0: a last step that only misses 0 by rounding is 0, one below it is not a point
+            axis[np.abs(axis) <= np.finfo(float).eps * nsteps * top] = 0.
+            axes.append(axis[(axis >= 0) & (axis <= hull.max_conc + TOL)])
+        shape = tuple(len(axis) for axis in axes)
+        total = int(np.prod(shape))
+        modlog.info('Enumerating %s grid points (%s) in blocks of %s'
+                    % (total, ' x '.join(str(n) for n in shape), blocksize))
+
+        naccepted = 0
+        for start in range(0, total, blocksize):
+            idx = np.unravel_index(np.arange(start, min(start + blocksize, total)), shape)
+            points = np.column_stack([axis[i] for axis, i in zip(axes, idx)])
+            points = points[hull.contains(points)]
+            if len(points):
+                naccepted += len(points)
+                yield points
+        self.acceptance = naccepted / float(total) if total else None
+        modlog.info('%s of %s grid points inside the allowed region' % (naccepted, total))
@@ -0,0 +1,68 @@
+"""Run independent per-experiment jobs of a run side by side
+
+Experiments of a tray only share read-only inputs (rdict, climits, ...) so each one can be built in its
+own worker.  Random streams are derived from a single run seed and the experiment number, which keeps
+the output identical for any number of workers.
+"""
+import concurrent.futures
+import logging
+import os
+
+import numpy as np
+
+import capture.devconfig as config
+from log import trace
+
+modlog = logging.getLogger('capture.generate.parallel')
+
+
+def run_seed(seed=None):
+    """Seed of the whole run: the specified one, or fresh entropy (logged so that the run can be repeated)"""
+    if seed is None:
+        seed = np.random.RandomState().randint(2 ** 31 - 1)
+        modlog.info('No sampling_seed specified, using sampling_seed=%s' % seed)
+    return int(seed)
+
+
+def experiment_rng(seed, experiment):
+    """Independent RandomState for one experiment of the run seeded with seed"""
+    return np.random.RandomState([int(seed), int(experiment)])
+
+
+def worker_count(njobs):
+    """Number of workers to use for njobs jobs, config.sampling_workers (None: one per core) capped at njobs"""
+    workers = config.sampling_workers or os.cpu_count() or 1
+    if config.sampler == 'wolfram':
+        # every worker needs its own kernel
+        workers = min(workers, config.wolfram_pool_size)
+    return max(1, min(int(workers), njobs))
+
+
+def map_experiments(func, jobs):
+    """Call func(*job) for every job and return the results in the order of jobs
+
+    Runs in the calling process for a single worker.  Wolfram jobs are run in threads as the work
+    happens in the (pooled) kernel processes; everything else goes to a process pool, from which the
+    trace spans of the jobs are brought back with their results.
+
+    :param func: module level function (must be picklable for the process pool)
+    :param jobs: list of argument tuples
+    """
+    workers = worker_count(len(jobs))
+    if workers == 1:
+        return [func(*job) for job in jobs]
+
+    modlog.info('Running %s experiments on %s workers' % (len(jobs), workers))
+    if config.sampler == 'wolfram':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(func, *job) for job in jobs]
+            return [future.result() for future in futures]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(trace.collected, func, *job) for job in jobs]
+        results = []
+        for future in futures:
+            result, spans = future.result()
+            trace.merge(spans)
+            results.append(result)
+        return results
@@ -0,0 +1,325 @@
+"""Geometry of the allowed experiment region in species concentration space
+
+Python counterpart of `allowedExperiments` / `dropZeroColumns` in randomSampling.wls.
+The region is the convex hull of the reagent vectors intersected with the [0, max_conc] cuboid.
+It is stored as a half-space (H) representation in the coordinates of the affine span of the
+reagent vectors so that membership and line intersections are a single matrix product.
+"""
+import itertools
+import logging
+from math import factorial
+
+import numpy as np
+
+modlog = logging.getLogger('capture.generate.polytope')
+
+# Numerical tolerance for rank decisions and facet membership (molar units)
+TOL = 1e-9
+# largest number of subsets the brute force vertex and volume enumerations go through
+MAX_SUBSETS = 10 ** 5
+
+
+def drop_zero_columns(reagent_vectors, species_names=None):
+    """Drop species that are absent (zero) in every reagent, mirrors dropZeroColumns in the .wls scripts
+
+    :param reagent_vectors: dict {'Reagent<i> (ul)': [conc species 1, conc species 2, ...]}
+    :param species_names: optional list of names for the columns of the reagent vectors
+    :return: (reagent names, (reagents x nonzero species) array, nonzero column mask, nonzero species names)
+    """
+    reagent_names = list(reagent_vectors.keys())
+    vectors = np.array([reagent_vectors[name] for name in reagent_names], dtype=float)
+    if vectors.ndim != 2 or vectors.shape[0] == 0:
+        raise ValueError('reagent vectors must be a non-empty dict of equal length lists')
+    nonzero_mask = vectors.max(axis=0) > 0
+    if species_names is not None:
+        species_names = [name for name, keep in zip(species_names, nonzero_mask) if keep]
+    return reagent_names, vectors[:, nonzero_mask], nonzero_mask, species_names
+
+
+def affine_basis(vectors):
+    """Orthonormal basis of the affine span of a set of vectors
+
+    :param vectors: (n x d) array
+    :return: (center (d,), basis (d x k) with orthonormal columns, k = dimension of the affine span)
+    """
+    center = vectors.mean(axis=0)
+    _, singular, vt = np.linalg.svd(vectors - center)
+    scale = max(np.abs(vectors).max(), 1.0)
+    dim = int(np.sum(singular > TOL * scale * len(vectors)))
+    return center, vt[:dim].T
+
+
+def _hull_facets(points):
+    """Enumerate the facets of the convex hull of points which span their space
+
+    Brute force over all k-subsets of the points; reagent counts are small (<= max_reagents)
+    so this is cheaper and more robust than a general purpose hull algorithm.
+
+    :param points: (n x k) array of points whose affine span is all of R^k
+    :return: (A, b) such that the hull is {y : A y <= b}
+    """
+    npoints, dim = points.shape
+    if dim == 1:
+        return np.array([[1.], [-1.]]), np.array([points.max(), -points.min()])
+
+    scale = max(np.abs(points).max(), 1.0)
+    normals = []
+    offsets = []
+    for subset in itertools.combinations(range(npoints), dim):
+        base = points[subset[0]]
+        edges = points[list(subset[1:])] - base
+        _, singular, vt = np.linalg.svd(edges)
+        if singular[-1] < TOL * scale:
+            continue  # points in the subset are not affinely independent
+        normal = vt[-1]
+        offset = normal.dot(base)
+        side = points.dot(normal) - offset
+        if np.all(side <= TOL * scale):
+            normals.append(normal)
+            offsets.append(offset)
+        elif np.all(side >= -TOL * scale):
+            normals.append(-normal)
+            offsets.append(-offset)
+
+    A = np.array(normals)
+    b = np.array(offsets)
+    # several subsets of coplanar points describe the same facet
+    _, unique_idx = np.unique(np.round(np.column_stack([A, b]) / scale, 8), axis=0, return_index=True)
+    unique_idx = np.sort(unique_idx)
+    return A[unique_idx], b[unique_idx]
+
+
+def _subset_count(n, k):
+    """Number of k-subsets of n items"""
+    if k > n:
+        return 0
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+
+def _unit_rows(A, b):
+    """Rows of A y <= b scaled to unit normals, zero rows dropped and repeated rows kept once"""
+    norms = np.linalg.norm(A, axis=1)
+    keep = norms > TOL
+    A = A[keep] / norms[keep, None]
+    b = b[keep] / norms[keep]
+    _, unique_idx = np.unique(np.round(np.column_stack([A, b]), 8), axis=0, return_index=True)
+    unique_idx = np.sort(unique_idx)
+    return A[unique_idx], b[unique_idx]
+
+
+def polytope_vertices(A, b, scale=1.0):
+    """Vertices of the bounded polytope {y : A y <= b}
+
+    Brute force over every dim-subset of the inequalities (solve the equalities as one batch, keep the
+    feasible points), fine for the handful of facets a reagent hull has.
+
+    :return: (N x dim) array of distinct vertices, None when there are more than MAX_SUBSETS subsets
+    """
+    dim = A.shape[1]
+    A, b = _unit_rows(A, b)
+    if _subset_count(len(A), dim) > MAX_SUBSETS:
+        return None
+    subsets = np.array(list(itertools.combinations(range(len(A)), dim)), dtype=int).reshape(-1, dim)
+    systems = A[subsets]
+    regular = np.abs(np.linalg.det(systems)) > TOL
+    points = np.linalg.solve(systems[regular], b[subsets[regular]][..., None])[..., 0]
+    vertices = points[np.all(points.dot(A.T) <= b + TOL * 100 * scale, axis=1)]
+    if not len(vertices):
+        return np.zeros((0, dim))
+    _, unique_idx = np.unique(np.round(vertices / scale, 7), axis=0, return_index=True)
+    return vertices[np.sort(unique_idx)]
+
+
+def polytope_volume(points, A=None, b=None):
+    """Volume of the convex hull of points that span their space (cone decomposition over the facets)
+
+    :param points: (n x k) array
+    :param A, b: inequalities whose facets bound the hull (redundant rows are fine), found from points if None
+    :return: volume, None when a facet enumeration would go through more than MAX_SUBSETS subsets
+    """
+    npoints, dim = points.shape
+    if dim == 1:
+        return float(points.max() - points.min())
+    scale = max(np.abs(points).max(), 1.0)
+    if A is None:
+        if _subset_count(npoints, dim) > MAX_SUBSETS:
+            return None
+        A, b = _hull_facets(points)
+    else:
+        A, b = _unit_rows(A, b)
+    center = points.mean(axis=0)
+    volume = 0.0
+    for normal, offset in zip(A, b):
+        facet_points = points[np.abs(points.dot(normal) - offset) <= TOL * 100 * scale]
+        if len(facet_points) < dim:
+            continue
+        facet_center, facet_basis = affine_basis(facet_points)
+        if facet_basis.shape[1] < dim - 1:
+            continue
+        area = polytope_volume((facet_points - facet_center).dot(facet_basis))
+        if area is None:
+            return None
+        volume += (offset - normal.dot(center)) * area / dim
+    return float(volume)
+
+
+def linear_exceedance(values, threshold):
+    """P(w.values > threshold) for reagent fractions w uniform on the simplex (Dirichlet(1, ..., 1))
+
+    Closed form for a linear function of a uniform simplex point:
+    sum_i (values_i - threshold)_+^(n-1) / prod_{j != i} (values_i - values_j).
+    Tied values are separated by a tiny offset, the formula needs them distinct.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 1:
+        return float(values[0] > threshold)
+    if values.max() <= threshold:
+        return 0.0
+    if values.min() > threshold:
+        return 1.0
+    scale = max(np.abs(values).max(), 1.0)
+    values = values + np.arange(n) * 1e-7 * scale
+    gaps = values[:, None] - values[None, :]
+    np.fill_diagonal(gaps, 1.0)
+    probability = np.sum(np.maximum(values - threshold, 0) ** (n - 1) / gaps.prod(axis=1))
+    return float(np.clip(probability, 0, 1))
+
+
+def simplex_acceptance(vertices, max_conc):
+    """Analytic estimate of the fraction of a simplex of reagent vectors inside the [0, max_conc] cuboid
+
+    Concentrations are never negative so only the max_conc faces cut the simplex.  The estimate is the
+    union bound 1 - sum_species P(species > max_conc), exact when at most one species can exceed max_conc
+    and a lower bound otherwise.
+
+    :param vertices: (reagents x species) reagent vectors, the vertices of the simplex
+    """
+    exceedance = [linear_exceedance(vertices[:, species], max_conc) for species in range(vertices.shape[1])]
+    return max(0.0, 1.0 - sum(exceedance))
+
+
+class ReagentHull:
+    """H-representation of (convex hull of reagent vectors) intersected with the [0, max_conc] cuboid
+
+    Points are handled either in species concentration space (x, dimension = nonzero species)
+    or in reduced coordinates (y, dimension = dimension of the hull) with x = center + y.basis^T
+    """
+
+    def __init__(self, reagent_vectors, max_conc, geometry=None):
+        """
+        :param reagent_vectors: dict {'Reagent<i> (ul)': [concentrations]} as made by qrandom.build_reagent_vectors
+        :param max_conc: scalar maximum molarity of any species in the final experiment
+        :param geometry: dict with center, basis, hull_A and hull_b computed earlier for the same reagent vectors
+                         (see hullcache), skips the facet enumeration
+        """
+        self.reagent_names, self.vectors, self.nonzero_mask, _ = drop_zero_columns(reagent_vectors)
+        self.max_conc = float(max_conc)
+        self.cached = None  # hull cache entry, set by hullcache.cached_hull
+
+        if geometry is None:
+            self.center, self.basis = affine_basis(self.vectors)  # basis: (species x dim) orthonormal columns
+        else:
+            self.center, self.basis = geometry['center'], geometry['basis']
+        self.dim = self.basis.shape[1]
+        if self.dim == 0:
+            raise ValueError('Reagent vectors all describe the same composition, nothing to sample')
+        self.reduced_vertices = (self.vectors - self.center).dot(self.basis)
+
+        if geometry is None:
+            hull_A, hull_b = _hull_facets(self.reduced_vertices)
+        else:
+            hull_A, hull_b = geometry['hull_A'], geometry['hull_b']
+        self.hull_A = hull_A
+        self.hull_b = hull_b
+        # 0 <= center + basis.y <= max_conc
+        box_A = np.vstack([-self.basis, self.basis])
+        box_b = np.concatenate([self.center, self.max_conc - self.center])
+        self.A = np.vstack([hull_A, box_A])
+        self.b = np.concatenate([hull_b, box_b])
+
+    @property
+    def nspecies(self):
+        return self.vectors.shape[1]
+
+    @property
+    def is_simplex(self):
+        """True when every reagent vector is a vertex of a dim-simplex (no redundant reagents)"""
+        return len(self.vectors) == self.dim + 1
+
+    def vertices(self):
+        """Vertices of the allowed region in reduced coordinates, None when too many to enumerate"""
+        return polytope_vertices(self.A, self.b, max(self.max_conc, 1.0))
+
+    def volume(self, vertices=None):
+        """dim-dimensional volume of the allowed region (in the reduced coordinates, molar^dim)
+
+        :return: volume, None when the region has too many vertices or facets to enumerate (see MAX_SUBSETS)
+        """
+        vertices = self.vertices() if vertices is None else vertices
+        if vertices is None:
+            return None
+        if len(vertices) <= self.dim:
+            return 0.0
+        return polytope_volume(vertices, self.A, self.b)
+
+    def redundant_reagents(self):
+        """Names of the reagents inside the convex hull of the other reagents (not vertices of the hull)"""
+        scale = max(np.abs(self.reduced_vertices).max(), 1.0)
+        on_facets = np.abs(self.reduced_vertices.dot(self.hull_A.T) - self.hull_b) <= TOL * 100 * scale
+        redundant = []
+        for position, (name, tight) in enumerate(zip(self.reagent_names, on_facets)):
+            # a vertex lies on dim facets with linearly independent normals, repeated vectors count once
+            repeated = np.any(np.all(np.abs(self.vectors[:position] - self.vectors[position]) <= TOL * scale, axis=1))
+            if repeated or tight.sum() < self.dim or np.linalg.matrix_rank(self.hull_A[tight]) < self.dim:
+                redundant.append(name)
+        return redundant
+
+    def to_concentrations(self, y):
+        """Map reduced coordinates (N x dim) to species concentrations (N x nonzero species)"""
+        return self.center + np.atleast_2d(y).dot(self.basis.T)
+
+    def to_reduced(self, x):
+        """Map species concentrations (N x nonzero species) to reduced coordinates (N x dim)"""
+        return (np.atleast_2d(x) - self.center).dot(self.basis)
+
+    def contains_reduced(self, y, tol=TOL):
+        """Boolean mask of the rows of y (reduced coordinates) inside the allowed region"""
+        return np.all(np.atleast_2d(y).dot(self.A.T) <= self.b + tol, axis=1)
+
+    def contains(self, x, tol=TOL):
+        """Boolean mask of the rows of x (nonzero species concentrations) inside the allowed region"""
+        x = np.atleast_2d(x)
+        y = self.to_reduced(x)
+        in_span = np.all(np.abs(self.to_concentrations(y) - x) <= tol * max(self.max_conc, 1.0), axis=1)
+        return in_span & self.contains_reduced(y, tol)
+
+    def chord(self, y, direction):
+        """Line intersection with the region for each row of y along the matching row of direction
+
+        :return: (tmin, tmax) arrays such that y + t*direction is inside for tmin <= t <= tmax
+        """
+        rates = direction.dot(self.A.T)
+        slack = np.maximum(self.b - y.dot(self.A.T), 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            steps = slack / rates
+        tmax = np.where(rates > TOL, steps, np.inf).min(axis=1)
+        tmin = np.where(rates < -TOL, steps, -np.inf).max(axis=1)
+        return tmin, tmax
+
+    def interior_point(self, rng, ncandidates=4096):
+        """Find a point strictly inside the region and a cloud of feasible points around it
+
+        Candidates are random convex combinations of the reagents (so always inside the hull),
+        those outside of the max_conc cuboid are discarded.
+
+        :return: (interior point in reduced coordinates, (M x dim) feasible candidates)
+        :raises ValueError: if no candidate falls inside the cuboid (empty or vanishingly small region)
+        """
+        weights = rng.dirichlet(np.ones(len(self.vectors)), size=ncandidates)
+        candidates = weights.dot(self.reduced_vertices)
+        feasible = candidates[self.contains_reduced(candidates, tol=0)]
+        if len(feasible) == 0:
+            raise ValueError('The convex hull of the reagents does not intersect the max_conc=%s cuboid '
+                             '(or the intersection is too small to sample)' % self.max_conc)
+        return feasible.mean(axis=0), feasible
@@ -1,45 +1,36 @@
 import logging
-import optunity
 import pandas as pd
 import numpy as np
-import random
 import sys
 
-from capture.generate.wolframsampler import WolframSampler
+from capture.generate.wolframsampler import kernel_pool
+from capture.generate.nativesampler import NativeSampler
 from capture.testing import inputvalidation
-from capture.models import chemical
 from capture.generate import calcs
+from capture.models.reagent import CompactReagent, ReagentSet
+from capture.generate import lowdiscrepancy
+from capture.generate import parallel
+from capture.generate import quantize
+from capture.generate import schema
 import capture.devconfig as config
-from utils.data_handling import get_explicit_experiments, get_reagent_number_as_string
+from log import trace
+from utils.data_handling import get_explicit_experiments
 from utils import globals
 
 modlog = logging.getLogger('capture.generate.qrandom')
 
 
-def rdfbuilder(rvolmaxdf, rvolmindf, reagent, wellnum):
-    count = 0 
-    reagentname = "Reagent%s (ul)" %reagent
-    reagentlist = []
-    while count < wellnum:
-        volmax = rvolmaxdf[count]
-        volmin = rvolmindf[count]
-        reagentitem = random.randint(volmin,volmax)
-        reagentlist.append(reagentitem)
-        count+=1
-    rdf = pd.DataFrame({reagentname:reagentlist}).astype(int)
-    return(rdf)
-
-def f(x1):
-    return 0.0
-
-def initialrdf(volmax, volmin, reagent, wellnum):
-    _, info_random, _ = optunity.minimize(f, num_evals=wellnum, x1=[volmin, volmax], solver_name='random search')
-    ##Create quasi-random data spread
-    reagentlist=info_random.call_log['args']['x1'] #Create reagent amounts (mmol), change x variable to change range, each generated from unique sobol index
-    reagentname = "Reagent%s (ul)" %reagent
-    rdf = pd.DataFrame({reagentname:reagentlist}).astype(int)
-    return(rdf)
-    #Generate a range of Amine concentrations dependent upon the range possible due to the presence of amine in Stock solution A \
+def drawvolumes(rvolmax, rvolmin, unitdraws):
+    """Map one unit interval draw per well to an integer volume between the per-well bounds (inclusive)
+
+    :param rvolmax: array of maximum volumes for each well
+    :param rvolmin: array of minimum volumes for each well
+    :param unitdraws: array of draws in [0, 1) for each well (quasi-random or random)
+    :return: int array of volumes
+    """
+    span = rvolmax - rvolmin + 1
+    draws = rvolmin + np.floor(unitdraws * span)
+    return np.minimum(draws, rvolmax).astype(int)
 
 #very similar to vollimtcont
 def calcvollimit(userlimits, rdict, volmax, volmin, experiment, reagentlist, reagent, wellnum): 
@@ -62,26 +53,29 @@ def calcvollimit(userlimits, rdict, volmax, volmin, experiment, reagentlist, rea
 #    testing.reagenttesting(volmax,volmin)
     return(volmax, volmin)
 
-def totalmmolchemicals(chemicals, usedchems, mmoldf):
-    finalsummedmmols = pd.DataFrame()
-    for chemical in chemicals:
-        headerlist = []
-        cfullname = 'chemical%s' %chemical
-        for header in usedchems:
-            if cfullname in header:
-                headerlist.append(header)
-        tempdf = pd.DataFrame()
-        for header in headerlist:
-            tempdf = pd.concat([tempdf, mmoldf[header]], axis=1)
-        summedmmols = pd.DataFrame(tempdf.sum(axis=1))
-        summedmmols.columns = ['mmol_%s' %cfullname]
-        finalsummedmmols = pd.concat([finalsummedmmols, summedmmols], axis=1)
-    finalsummedmmols.fillna(value=0, inplace=True) # Total mmmols added of each chemical in previous reagent additions
-    return(finalsummedmmols)
-
-def calcvollimitdf(rdf, mmoldf, userlimits, rdict, volmax, volmin, experiment, reagentlist, reagent, wellnum, rxndict): 
-    # Create dataframes which will hold the final comparisons for the max and min
-    finalvolmaxdf = pd.DataFrame()
+def reagentchemicalconcs(rdata):
+    """Return [(chemical name, concentration [M])] for every chemical with a concentration in the reagent
+
+    :param rdata: CompactReagent (a perovskitereagent is converted)
+    """
+    if not isinstance(rdata, CompactReagent):
+        rdata = CompactReagent(rdata)
+    return [(chemical, chemconc) for chemical, chemconc in zip(rdata.chemicals, rdata.concentrations) if chemconc]
+
+def calcvollimitarray(prevvolumes, prevmmols, userlimits, rdict, volmax, volmin, experiment, reagentlist, reagent, wellnum, rxndict):
+    """Per-well volume bounds for a reagent given the reagents already added in the portion
+
+    Vectorized replacement of the old calcvollimitdf.  The maximum is limited by the remaining well volume
+    and the user constraints.  With molar limits enabled (see calcs.molar_limits_enabled) both bounds are also
+    limited by the molarity limits of the rxndict (calcs.molar_limits) for every chemical in
+    the reagent; calcvollimitdf never found the reagent concentrations it looked them up with, so by
+    default they are left out as they were in v2.7.
+
+    :param prevvolumes: array of the volume of all previous reagents in the portion for each well
+    :param rdict: ReagentSet or {reagent number: perovskitereagent}
+    :param prevmmols: dict {chemical name: array of mmol of that chemical already added to each well}
+    :return: (int array of maximum volumes, int array of minimum volumes)
+    """
     # Get the maximum volumes possible for this particular reagent based on user constraints
     rvolmax, rvolmin = calcvollimit(userlimits,
                                     rdict,
@@ -93,89 +87,61 @@ def calcvollimitdf(rdf, mmoldf, userlimits, rdict, volmax, volmin, experiment, r
                                     wellnum)
     # get maximum values based on experimental constraints (well volume primarily)
     inputvalidation.reagenttesting(volmax,volmin)
-    # Generate an upward limit for the chemical in dataframe based on the maximum user specified well volume and all previously used reagents
-    volmaxdf = volmax - rdf.sum(axis=1)
-    finalvolmaxdf = pd.concat([finalvolmaxdf, volmaxdf], axis=1)
-    #replace values of experimental constraints with values of the reagent constraints (tighter) if experiment is looser 
-    volmaxdf[volmaxdf > rvolmax] = rvolmax
-    finalvolmaxdf = pd.concat([finalvolmaxdf, volmaxdf], axis=1)
-    #remove reagent volume to adjust for constraints set by user for final concentration limits
-    rdata = rdict['%s'%reagent]
-    chemicals = rdata.chemicals
-    usedchemsobj = mmoldf.columns
-    usedchems = []
-    # Blank dataframe of minimums of appropriate length
-    blanklist = [0]*wellnum
-    finalvolmindf = pd.DataFrame(blanklist)
-    # build a list of headers of chemicals used previously
-    for chem in usedchemsobj:
-        usedchems.append(chem)
-    #pile chemicals (and how much) from past reaction into a single frame to ensure constraints are met
-    finalsummedmmols = totalmmolchemicals(chemicals, usedchems, mmoldf)
-    # This function is to ensure that a user set constraints in the execution script (molar max and min for achemical ) are met for each well
-    # The first draw that we are matching against calculated this information for the first reagent, now we have ensure that the remaining volume doesn't push
-    #   the experiment beyond the user set limits of the system.
-    # Look at each chemical in the chemical list of the reagent
-    for chemical in chemicals:
-        try: #Potentially could be an if statement, but the search for the chem#_molarmax or chem#_molarmin will fail if no value is set a workaround could be to set hard coded far limits and flag errors
-            header = 'mmol_%s' %chemical
-            chemconc = rdata.concs['conc_chem%s' %chemical]
-            # calculate the remaining mmols of the chemical  based on the user set limits
-            volmaxdf = ((rxndict['chem%s_molarmax' %chemical]*rvolmax/1000)-finalsummedmmols[header]) / chemconc * 1000
-            finalvolmaxdf = pd.concat([finalvolmaxdf, volmaxdf], axis=1)
-        except Exception:
-            pass
-    # do it all again for the minimums, ensure that the user set minimums are met if this is the final reagent with a particular chemical
-        try:
-            header = 'mmol_%s' %chemical
-            chemconc = rdata.concs['conc_chem%s' %chemical]
-            volmindf = ((rxndict['chem%s_molarmin' %chemical]*rvolmax/1000)-finalsummedmmols[header]) / chemconc * 1000
-            volmindf[volmindf < 0] = 0
-            finalvolmindf = pd.concat([finalvolmindf, volmindf], axis=1)
-        except Exception:
-            pass
-    # Take the minimum of the maximums for the volumes calculated throughout this process
-    outvolmaxdf = finalvolmaxdf.min(axis=1)
-    # Take the maximum minimum ... 
-    outvolmindf =  finalvolmindf.max(axis=1) 
+    # upward limit from the maximum well volume and all previously used reagents, tightened by the reagent constraints
+    outvolmax = np.minimum(volmax - prevvolumes, rvolmax).astype(float)
+    outvolmin = np.zeros(wellnum)
+    if not calcs.molar_limits_enabled(rxndict):
+        return outvolmax.astype(int), outvolmin.astype(int)
+    # ensure that the user set constraints (molar max and min for a chemical) are met for each well given
+    # the mmols of the chemical already added by the previous reagents
+    chemicalconcs = reagentchemicalconcs(rdict['%s' % reagent])
+    limits = calcs.molar_limits(rxndict, [chemical for chemical, _ in chemicalconcs])
+    for chemical, chemconc in chemicalconcs:
+        if chemical not in limits:
+            continue
+        chemmmols = prevmmols.get(chemical, 0)
+        molarmin, molarmax = limits[chemical]
+        if np.isfinite(molarmax):
+            outvolmax = np.minimum(outvolmax, (molarmax * rvolmax / 1000 - chemmmols) / chemconc * 1000)
+        if molarmin > 0:
+            outvolmin = np.maximum(outvolmin, (molarmin * rvolmax / 1000 - chemmmols) / chemconc * 1000)
     # Return the relevant datasets as int values (robot can't dispense anything smaller so lose the unsignificant figures /s)
-    return(outvolmaxdf.astype(int), outvolmindf.astype(int))
+    return outvolmax.astype(int), outvolmin.astype(int)
 
 
-def default_sampling(expoverview, rdict, vollimits, rxndict, wellnum, userlimits, experiment, portion_start_idx=0):
+@trace.traced(category='sampler')
+def default_sampling(expoverview, rdict, vollimits, rxndict, wellnum, userlimits, experiment, portion_start_idx=0, rng=None):
     """Ian's original sampling implementation.
 
     Performs samplings within portions of the expoverview, starting from portion_start_idx
+    All wells of a reagent are drawn at once from their per-well volume bounds.  Each well takes one
+    point of a low-discrepancy sequence with one dimension per reagent of the portion
+    (rxndict['sampling_sequence'], devconfig.sampling_sequence by default).
 
+    :param rng: numpy RandomState used to scramble / draw the sequence, a fresh one is made if None
     :return: (experiment volume df, experiment mmol df, version number of this sampler)
     """
-    version = 2.7 # random sampling >3 chemicals (non-zero), maintains random sampling on secondary portions
-    prdf = pd.DataFrame()
-    prmmoldf = pd.DataFrame()
-
-    portionnum = portion_start_idx
-    while portionnum < len(expoverview):
-        # need the volume minimum and maximum and well count
-        reagentcount = 1
-        reagenttotal = len(expoverview[portionnum])
-
-        # Determine from the chemicals and the remaining volume the maximum and
-        # minimum volume possible for the sobol method
-
+    version = 2.9 # scrambled sobol/halton draws for every reagent, replaces optunity random search
+    if rng is None:
+        rng = np.random.RandomState()
+    reagents = ReagentSet(rdict)
+    sequence = rxndict.get('sampling_sequence', config.sampling_sequence)
+    prdfs = []
+
+    for portionnum in range(portion_start_idx, len(expoverview)):
+        portion = expoverview[portionnum]
+        finalvolmin = vollimits[portionnum][0]
         volmax = vollimits[portionnum][1]
 
-        # unoptimized code that ensure that the previous reagents are considered and that the final reagent accurately
-        # fills to the minimum volume set by the users "fill to" requirement
+        # volumes of each reagent in the portion (wells x reagents) and running total of each chemical (mmol)
+        portionvolumes = np.zeros((wellnum, len(portion)), dtype=int)
+        portionmmols = {}
+        unitdraws = lowdiscrepancy.unit_hypercube(wellnum, len(portion), sequence, rng)
 
-        rdf = pd.DataFrame()
-        mmoldf = pd.DataFrame()
-        finalrdf = pd.DataFrame()
-        finalmmoldf = pd.DataFrame()
-
-        for reagent in expoverview[portionnum]:
-            finalvolmin = vollimits[portionnum][0]
-            if reagentcount == 1:
-                if len(expoverview[portionnum]) == 1:
+        for position, reagent in enumerate(portion):
+            prevvolumes = portionvolumes[:, :position].sum(axis=1)
+            if position == 0:
+                if len(portion) == 1:
                     volmin = vollimits[portionnum][0]
                     volmax = vollimits[portionnum][1] + 0.00001
                 else:
@@ -184,91 +150,56 @@ def default_sampling(expoverview, rdict, vollimits, rxndict, wellnum, userlimits
                 # since all of the volume limits for the first draw are the same these can be
                 # treated as a bounded search sequence
                 rvolmax, rvolmin = calcvollimit(userlimits,
-                                                rdict,
+                                                reagents,
                                                 volmax,
                                                 volmin,
                                                 experiment,
-                                                expoverview[portionnum],
+                                                portion,
                                                 reagent,
                                                 wellnum)
-
-                # Returns datafram of volumes of each reagent added to each experiment
-                rdf = initialrdf(rvolmax, rvolmin, reagent, wellnum)
-
-                # Returns mmol specified dataframe for each experiment, reagent, and
-                # chemical (<-- values are in the header) have been generated for this portion of the experiment
-
-                mmoldf = calcs.mmolextension((rdf['Reagent%s (ul)' %reagent]), rdict, experiment, reagent)
-                reagentcount += 1
-            # operate within the available ranges taken from the previous constraints
-            elif reagentcount < reagenttotal:
-                # The constraints on the middle draws are more complicated and are dependent upon the first,
-                # a different sampling strategy must be used
-                # (i.e. this is not going to use sobol as the ranges are different for each)
-                # Constrain the range based on volume, reagent-chemical concentrations and user constraints
-
-                rvolmaxdf, rvolmindf = calcvollimitdf(finalrdf,
-                                                      mmoldf,
-                                                      userlimits,
-                                                      rdict,
-                                                      volmax,
-                                                      volmin,
-                                                      experiment,
-                                                      expoverview[portionnum],
-                                                      reagent,
-                                                      wellnum,
-                                                      rxndict)
-                # Since each volume maximum is different, need to sample the remaining reagents independently
-                # (thus different sampling)
-                rdf = rdfbuilder(rvolmaxdf, rvolmindf, reagent, wellnum)
-                mmoldf = calcs.mmolextension((rdf['Reagent%s (ul)' %reagent]), rdict, experiment, reagent)
-                reagentcount += 1
-
-            # Ensure that the final round meets the lower bounds and upper bound total
-            # fill volume requirements of the user
-            elif reagentcount == reagenttotal:
-                if vollimits[portionnum][0] == vollimits[portionnum][1]:
-                    # print(finalrdf.sum(axis=1))
-                    rvolmaxdf, rvolmindf = calcvollimitdf(finalrdf,
-                                                          mmoldf,
-                                                          userlimits,
-                                                          rdict,
-                                                          volmax,
-                                                          volmin,
-                                                          experiment,
-                                                          expoverview[portionnum],
-                                                          reagent,
-                                                          wellnum,
-                                                          rxndict)
-                    reagentname = "Reagent%s (ul)" % reagent
-                    rdf = pd.DataFrame(rvolmaxdf, columns=[reagentname])
-                    mmoldf = calcs.mmolextension((rdf['Reagent%s (ul)' % reagent]), rdict, experiment, reagent)
-                else:
-                    rvolmaxdf, rvolmindf = calcvollimitdf(finalrdf, mmoldf, userlimits, rdict, volmax, volmin,
-                                                          experiment, expoverview[portionnum], reagent, wellnum, rxndict)
-                    rvolmindf = ensuremin(rvolmindf, finalrdf, finalvolmin)
-                    rdf = rdfbuilder(rvolmaxdf, rvolmindf, reagent, wellnum)
-                    mmoldf = calcs.mmolextension(rdf['Reagent%s (ul)' % reagent], rdict, experiment, reagent)
-                reagentcount += 1
+                reagentvolumes = (rvolmin + unitdraws[:, position] * (rvolmax - rvolmin)).astype(int)
             else:
-                modlog.error("Fatal error.  Unable to effectively parse reagent%s in portion %s.  \
-                Please make sure that the selected values make chemical sense!" % (reagent, expoverview[portionnum]))
-            finalrdf = pd.concat([finalrdf, rdf], axis=1)
-            finalmmoldf = pd.concat([finalmmoldf, mmoldf], axis=1)
-
-        prdf = pd.concat([prdf, finalrdf], axis=1)
-        prmmoldf = pd.concat([prmmoldf, finalmmoldf], axis=1)
-        portionnum += 1
-
+                # The constraints on the later draws are dependent upon the previous draws (different for each well)
+                # Constrain the range based on volume, reagent-chemical concentrations and user constraints
+                rvolmax, rvolmin = calcvollimitarray(prevvolumes,
+                                                     portionmmols,
+                                                     userlimits,
+                                                     reagents,
+                                                     volmax,
+                                                     volmin,
+                                                     experiment,
+                                                     portion,
+                                                     reagent,
+                                                     wellnum,
+                                                     rxndict)
+                if position == len(portion) - 1:
+                    # Ensure that the final round meets the lower bounds and upper bound total
+                    # fill volume requirements of the user
+                    if vollimits[portionnum][0] == vollimits[portionnum][1]:
+                        rvolmin = rvolmax
+                    else:
+                        rvolmin = ensuremin(rvolmin, prevvolumes, finalvolmin)
+                overconstrained = rvolmin > rvolmax
+                if overconstrained.any():
+                    modlog.warning("Chemical limits cannot be met in %s wells of experiment %s for reagent %s, using the largest allowed volume"
+                                   % (overconstrained.sum(), experiment, reagent))
+                    rvolmin = np.minimum(rvolmin, rvolmax)
+                reagentvolumes = drawvolumes(rvolmax, rvolmin, unitdraws[:, position])
+
+            portionvolumes[:, position] = reagentvolumes
+            for chemical, chemconc in reagentchemicalconcs(reagents[reagent]):
+                portionmmols[chemical] = portionmmols.get(chemical, 0) + reagentvolumes * chemconc / 1000
+
+        prdfs.append(pd.DataFrame(portionvolumes, columns=["Reagent%s (ul)" % reagent for reagent in portion]))
+
+    prdf = pd.concat(prdfs, axis=1) if prdfs else pd.DataFrame()
+    prmmoldf = calcs.ConcentrationMatrix(rdict).mmol_breakout(prdf, experiment)
     return prdf, prmmoldf, version
 
-def ensuremin(rvolmindf, finalrdf, finalvolmin):
+def ensuremin(rvolmin, currvol, finalvolmin):
     """Its a clamp! -- https://upload.wikimedia.org/wikipedia/en/6/6e/AckbarStanding.jpg
     """
-    currvoldf = finalrdf.sum(axis=1)
-    trumindf = finalvolmin - currvoldf
-    rvolmindf[rvolmindf < trumindf] = trumindf
-    return rvolmindf
+    return np.maximum(rvolmin, finalvolmin - currvol)
 
 def get_unique_chemical_names(reagents):
     """Get the unique chemical species names in a list of reagents.
@@ -300,44 +231,68 @@ def build_reagent_vectors(portion_reagents, portion_chemicals):
     """
 
     # find the vector representation of the reagents in concentration space
-    reagent_vectors = {}
-    if isinstance(portion_reagents, dict):
-        portion_reagents = [v for v in portion_reagents.values()]
-
-    for reagent in portion_reagents:
-        name = 'Reagent{} (ul)'.format(reagent.name)
-        comp_dict = reagent.component_dict
-        vec = [comp_dict.get(elem, 0) for elem in portion_chemicals]
-        reagent_vectors[name] = vec
-
-    return reagent_vectors
+    return ReagentSet(portion_reagents).reagent_vectors(portion_chemicals)
 
 def volume_to_mmol_wrapper(vol_df, rdict, experiment):
-    portion_mmol_df = pd.DataFrame()
-    for columnname in vol_df.columns:
-        reagent = int(get_reagent_number_as_string(columnname))  # 'Reagent2 (ul)' to give '2'
-        mmol_df = calcs.mmolextension((vol_df[columnname]), rdict, experiment, reagent)
-        portion_mmol_df = pd.concat([portion_mmol_df, mmol_df], axis=1)
+    """mmol breakout (wide ermmoldf layout) of the reagent volumes in vol_df"""
+    return calcs.ConcentrationMatrix(rdict).mmol_breakout(vol_df, experiment)
 
-    return portion_mmol_df
-
-def wolfram_sampling(expoverview, rdict, old_reagents, vollimits, rxndict, vardict, wellnum, userlimits, experiment):
+@trace.traced(category='sampler')
+def wolfram_sampling(expoverview, rdict, old_reagents, vollimits, rxndict, vardict, wellnum, userlimits, experiment, rng=None):
     """Sample from the convex hull defined in species concentration space with uniform probability
 
     Any portions defined in the experiment overview beyond the first will be sampled by the default_sampler
 
     :param old_reagents:
     :param vardict:
+    :param rng: numpy RandomState, seeds the kernel (SeedRandom) and the default_sampler portions
 
     :return: (experiment volume df, experiment mmol df, version number of this sampler)
     """
+    version = 1.2 # original "expert sampling"
+
+    # kernels are kept running between experiments (and runs in the same process), see devconfig
+    with kernel_pool().lease() as ws:
+        if rng is not None:
+            ws.session.evaluate('SeedRandom[%s]' % rng.randint(2 ** 31 - 1))
+        ws.rng = rng
+        experiment_df, experiment_mmol_df = hull_sampling(ws, expoverview, rdict, old_reagents, vollimits,
+                                                          rxndict, wellnum, userlimits, experiment, rng=rng)
+    return experiment_df, experiment_mmol_df, version
+
+@trace.traced(category='sampler')
+def native_sampling(expoverview, rdict, old_reagents, vollimits, rxndict, vardict, wellnum, userlimits, experiment, rng=None):
+    """Same sampling as wolfram_sampling using the NumPy hit-and-run sampler, no Wolfram kernel required
+
+    :param rng: numpy RandomState driving the sampler, a fresh one is made if None
+
+    :return: (experiment volume df, experiment mmol df, version number of this sampler)
+    """
+    version = 1.0 # hit-and-run in the reduced hull coordinates
+
+    ns = NativeSampler(seed=rng)
+    experiment_df, experiment_mmol_df = hull_sampling(ns, expoverview, rdict, old_reagents, vollimits,
+                                                      rxndict, wellnum, userlimits, experiment, rng=rng)
+    return experiment_df, experiment_mmol_df, version
+
+def splits_reagent7(rxndict):
+    """LBL hotfix of workflows <= 1.1: the hull samplers dispense reagent 7 as two halves, reagents 6 and 7"""
+    return rxndict['ExpWorkflowVer'] <= 1.1 and rxndict['lab'] == 'LBL'
+
+def hull_sampling(sampler, expoverview, rdict, old_reagents, vollimits, rxndict, wellnum, userlimits, experiment, rng=None):
+    """Sample the first portion with a convex hull sampler (WolframSampler or NativeSampler)
+
+    Any portions defined in the experiment overview beyond the first will be sampled by the default_sampler
+
+    :param sampler: object exposing randomlySample(reagentVectors, oldReagents, nExpt, maxMolarity, finalVolume)
+    :param rng: numpy RandomState passed on to the default_sampler
+    :return: (experiment volume df, experiment mmol df)
+    """
     experiment_mmol_df = pd.DataFrame()
     experiment_df = pd.DataFrame()
 
-    version = 1.2 # original "expert sampling"
-
     if len(expoverview) > 1:
-        modlog.warning('only first portion will use mathematica sampler')
+        modlog.warning('only first portion will use the convex hull sampler')
     portionnum = 0
     portion = expoverview[portionnum]
 
@@ -349,24 +304,21 @@ def wolfram_sampling(expoverview, rdict, old_reagents, vollimits, rxndict, vardi
     reagent_vectors = build_reagent_vectors(portion_reagents, portion_species_names)
 
     if rxndict.get('multi_stock_sampling'):
-        old_reagent_species_names = get_unique_chemical_names(old_reagents)
         ## todo: move to validation
-        #if old_reagent_species_names != portion_species_names:
-        #    modlog.error(("Old and new reagents must be made out of the same chemicals." +
-        #                  f"\nNew reagent chemicals: {portion_species_names}" +
-        #                  f"\nOld reagent chemicals: {old_reagent_species_names}"))
-        #    sys.exit(1)
-        old_reagent_vectors = build_reagent_vectors(old_reagents, old_reagent_species_names)
+        # old reagent vectors have to live in the basis of the new ones
+        missing = sorted(set(get_unique_chemical_names(old_reagents)) - set(portion_species_names))
+        if missing:
+            raise ValueError('Old reagents contain chemicals absent from the new reagents: %s'
+                             '\nNew reagent chemicals: %s' % (missing, portion_species_names))
+        old_reagent_vectors = build_reagent_vectors(old_reagents, portion_species_names)
     else:
         old_reagent_vectors = None
 
-    ws = WolframSampler()
-    experiments = ws.randomlySample(reagent_vectors,
-                                    old_reagent_vectors,
-                                    int(wellnum),
-                                    float(maxconc),
-                                    float(volmax))
-    ws.terminate()
+    experiments = sampler.randomlySample(reagent_vectors,
+                                         old_reagent_vectors,
+                                         int(wellnum),
+                                         float(maxconc),
+                                         float(volmax))
     #TODO: the randomly sample returns bogus entires (doesn't error) if the run is not properly constructure
     # Validation should be done prior to feeding into mathematica
     try:
@@ -377,26 +329,29 @@ def wolfram_sampling(expoverview, rdict, old_reagents, vollimits, rxndict, vardi
         print(f'User information and FAQs can be found at: https://docs.google.com/document/d/1RQJvAlDVIfu19Tea23dLUSymLabGfwJtDnZwANtU05s/edit#bookmark=id.8sg0qwagd7yw')
         import sys
         sys.exit()
+    # every well of the hull portion makes up volmax, whatever rounding the sampler applied
+    portion_df = pd.DataFrame(quantize.largest_remainder(portion_df.values, volmax, config.volume_resolution),
+                              columns=portion_df.columns)
     # todo How long can this reagent 6/7 hotfix remain like this?
-    if rxndict['ExpWorkflowVer'] <= 1.1:
-        if rxndict['lab'] == 'LBL':
-            portion_df['Reagent6 (ul)'] = np.floor(portion_df['Reagent7 (ul)'] / 2).astype(int)
-            portion_df['Reagent7 (ul)'] = np.ceil(portion_df['Reagent7 (ul)'] / 2).astype(int)
-            rdict['6'] = rdict['7']
+    if splits_reagent7(rxndict):
+        # split reagent 7 in two halves at the pipette resolution, the larger half stays reagent 7
+        reagent7 = portion_df['Reagent7 (ul)'].values
+        halves = quantize.largest_remainder(np.column_stack([reagent7, reagent7]) / 2, reagent7,
+                                            config.volume_resolution)
+        portion_df['Reagent6 (ul)'] = halves[:, 1]
+        portion_df['Reagent7 (ul)'] = halves[:, 0]
+        # only reaches the caller's rdict in the same process, see preprocess_and_sample
+        rdict['6'] = rdict['7']
 
 
-    portion_mmol_df = pd.DataFrame()
-    for col in portion_df.columns:
-        reagent = int(col.split('t')[1].split('(')[0])  # 'Reagent2 (ul)' to give '2'
-        mmol_df = calcs.mmolextension((portion_df[col]), rdict, experiment, reagent)
-        portion_mmol_df = pd.concat([portion_mmol_df, mmol_df], axis=1)
+    portion_mmol_df = calcs.ConcentrationMatrix(rdict).mmol_breakout(portion_df, experiment)
 
     experiment_mmol_df = pd.concat([experiment_mmol_df, portion_mmol_df], axis=1)
     experiment_df = pd.concat([experiment_df, portion_df], axis=1)
 
     portionnum +=1
     if portionnum < len(expoverview):
-        modlog.warn("Using default sampler for portion 2, mathematica sampling not supported for greater than first portion")
+        modlog.warn("Using default sampler for portion 2, convex hull sampling not supported for greater than first portion")
         # version2 variable doesn't get used in this case, toss to a garbage variable and retain the mathematica version
         prdf, prmmoldf, version2 = default_sampling(expoverview,
                                            rdict,
@@ -405,11 +360,74 @@ def wolfram_sampling(expoverview, rdict, old_reagents, vollimits, rxndict, vardi
                                            wellnum,
                                            userlimits,
                                            experiment,
-                                           portion_start_idx=portionnum)
+                                           portion_start_idx=portionnum,
+                                           rng=rng)
         experiment_mmol_df = pd.concat([experiment_mmol_df, prmmoldf], axis=1)
         experiment_df = pd.concat([experiment_df, prdf], axis=1)
 
-    return experiment_df, experiment_mmol_df, version
+    return experiment_df, experiment_mmol_df
+
+@trace.traced(category='sampler')
+def sample_experiment(experiment, expoverview, rdict, old_reagents, vollimits, rxndict, vardict, num_wells, climits, seed):
+    """Sample the wells of one experiment of the tray with the sampler selected in devconfig
+
+    Module level so it can be shipped to a worker process, see parallel.map_experiments
+
+    :param seed: run seed, the experiment draws from its own stream parallel.experiment_rng(seed, experiment)
+    :return: (experiment volume df, experiment mmol df, sampler name, sampler version)
+    """
+    modlog.info('Building reagent constraints for experiment %s using reagents %s for a total of %s wells'
+                % (experiment, expoverview, num_wells))
+    rng = parallel.experiment_rng(seed, experiment)
+
+    # DO THE SAMPLING
+    if config.sampler == 'wolfram':
+        prdf, prmmoldf, version = wolfram_sampling(expoverview,
+                                          rdict,
+                                          old_reagents,
+                                          vollimits,
+                                          rxndict,
+                                          vardict,
+                                          num_wells,
+                                          climits,
+                                          experiment,
+                                          rng=rng)
+        if rxndict.get('multi_stock_sampling'):
+            sampler_name = 'MathematicaMultiStock'
+        else:
+            sampler_name = 'MathematicaUniformRandom'
+    elif config.sampler == 'native':
+        prdf, prmmoldf, version = native_sampling(expoverview,
+                                          rdict,
+                                          old_reagents,
+                                          vollimits,
+                                          rxndict,
+                                          vardict,
+                                          num_wells,
+                                          climits,
+                                          experiment,
+                                          rng=rng)
+        if rxndict.get('multi_stock_sampling'):
+            sampler_name = 'NativeMultiStock'
+        else:
+            sampler_name = 'NativeUniformRandom'
+    else:
+        prdf, prmmoldf, version = default_sampling(expoverview,
+                                          rdict,
+                                          vollimits,
+                                          rxndict,
+                                          num_wells,
+                                          climits,
+                                          experiment,
+                                          rng=rng)
+        sampler_name = 'ExpertQuasiRandom'
+
+    # snap all wells to the pipette resolution at once and check the chemical limits in one pass
+    prdf = quantize.quantize_wells(prdf, rdict, rxndict)
+    prmmoldf = calcs.ConcentrationMatrix(rdict).mmol_breakout(prdf, experiment)
+
+    modlog.info('Succesfully built experiment %s which returned.... ' %(experiment))
+    return prdf, prmmoldf, sampler_name, version
 
 def preprocess_and_sample(chemdf, vardict, rxndict, edict, rdict, old_reagents, climits):
 
@@ -418,14 +436,25 @@ def preprocess_and_sample(chemdf, vardict, rxndict, edict, rdict, old_reagents,
     requires the chemical dataframe, rxndict (with user inputs), experiment dictionary, 
     reagent dictionary and chemical limits (climits) -- update should enable easier
     inspection of these elements
+
+    Experiments are independent of each other and are sampled in parallel (devconfig.sampling_workers),
+    each from its own random stream derived from the run's sampling_seed
     """
     experiment = 1
     modlog.info('Making a total of %s unique experiments on the tray' % rxndict['totalexperiments'])
-    erdf = pd.DataFrame() 
-    ermmoldf = pd.DataFrame()
+    if config.sampler not in ['wolfram', 'native', 'default']:
+        modlog.error('Encountered unexpected sampler in devconfig: {}. Exiting.'.format(config.sampler))
+        sys.exit(1)
+    seed = parallel.run_seed(rxndict.get('sampling_seed'))
     exportable_model_df = pd.DataFrame()
 
+    if config.sampler in ['wolfram', 'native'] and splits_reagent7(rxndict):
+        # the workers only change their own copy of rdict, reagent 6 has to be known here for the
+        # molarities and the reagent interface
+        rdict['6'] = rdict['7']
+
     # outer loop over experiments in Template
+    jobs = []
     while experiment < rxndict['totalexperiments']+1:
         modlog.info('Initializing dataframe construction for experiment %s' %experiment)
         experimentname = 'exp%s' % experiment
@@ -443,51 +472,24 @@ def preprocess_and_sample(chemdf, vardict, rxndict, edict, rdict, old_reagents,
             experiment += 1
             continue
 
-        modlog.info('Building reagent constraints for experiment %s using reagents %s for a total of %s wells'
-                    % (experiment, edict[experimentname], num_wells))
-
-        # DO THE SAMPLING
-        if config.sampler == 'wolfram':
-            prdf, prmmoldf, version = wolfram_sampling(edict[experimentname],
-                                              rdict,
-                                              old_reagents,
-                                              vollimits,
-                                              rxndict,
-                                              vardict,
-                                              num_wells,
-                                              climits,
-                                              experiment)
-            if rxndict.get('multi_stock_sampling'):
-                sampler_name = 'MathematicaMultiStock'
-            else:
-                sampler_name = 'MathematicaUniformRandom'
-            globals.set_sampler(sampler_name, version)
-        elif config.sampler == 'default':
-            
-            prdf, prmmoldf, version = default_sampling(edict[experimentname],
-                                              rdict,
-                                              vollimits,
-                                              rxndict,
-                                              num_wells,
-                                              climits,
-                                              experiment)
-            sampler_name = 'ExpertQuasiRandom'
-            globals.set_sampler(sampler_name, version)
-        else:
-            modlog.error('Encountered unexpected sampler in devconfig: {}. Exiting.'.format(config.sampler))
-            sys.exit(1)
+        jobs.append((experiment, edict[experimentname], rdict, old_reagents, vollimits,
+                     rxndict, vardict, num_wells, climits, seed))
+        experiment += 1
 
-        erdf = pd.concat([erdf, prdf], axis=0, ignore_index=True, sort=True)
-        ermmoldf = pd.concat([ermmoldf, prmmoldf], axis=0, ignore_index=True, sort=True)
+    results = parallel.map_experiments(sample_experiment, jobs)
 
+    erdf = pd.concat([prdf for prdf, _, _, _ in results], axis=0, ignore_index=True, sort=True) \
+        if results else pd.DataFrame()
+    ermmoldf = pd.concat([prmmoldf for _, prmmoldf, _, _ in results], axis=0, ignore_index=True, sort=True) \
+        if results else pd.DataFrame()
+    if results:
+        # every experiment of a run uses the same sampler
+        _, _, sampler_name, version = results[-1]
+        globals.set_sampler(sampler_name, version)
         model_info_dict = {'modelname': [globals.get_sampler_uid()],'participantname':['escalate']}
         model_info_df =  pd.DataFrame.from_dict(model_info_dict)
         exportable_model_df = pd.concat([model_info_df]*erdf.shape[0], ignore_index=True)
 
-        # Return the reagent data frame with the volumes for that particular portion of the plate
-        modlog.info('Succesfully built experiment %s which returned.... ' %(experiment))
-        experiment += 1
-
     if not rxndict['manual_wells'] == 0:
 
         manual_model_info_dict = {'modelname': [globals.get_manualruns_uid()],'participantname':[globals.get_manualruns_author()]}
@@ -509,11 +511,14 @@ def preprocess_and_sample(chemdf, vardict, rxndict, edict, rdict, old_reagents,
         
     # Final reagent mmol dataframe broken down by experiment, protion, reagent, and chemical
     ermmoldf.fillna(value=0, inplace=True)
-    clist = chemical.exp_chem_list(rdict)
 
-    # Final nominal molarity for each reagent in each well
-    emsumdf = calcs.finalmmolsums(clist, ermmoldf) # Returns incorrectly labeled columns, we used these immediately and convert to the correct units
-    emsumdf = emsumdf.divide(erdf.sum(axis=1), axis='rows')*1000
+    # Final nominal molarity for each chemical in each well
+    emsumdf = calcs.ConcentrationMatrix(rdict).molarity(erdf)
+
+    erdf = schema.apply(erdf, 'volumes', 'sampling')
+    ermmoldf = schema.apply(ermmoldf, 'mmol', 'sampling')
+    emsumdf = schema.apply(emsumdf, 'molarity', 'sampling')
+    exportable_model_df = schema.apply(exportable_model_df, 'models', 'sampling')
 
     # plotter.plotme(ReagentmmList[0],ReagentmmList[1], hold.tolist())
     # combine the experiments for the tray into one full set of volumes for all the wells on the plate
@@ -0,0 +1,118 @@
+"""Quantization of sampled well volumes to the pipette resolution
+
+The samplers round reagent by reagent (Round in the .wls scripts, int casts in the default sampler), which
+lets the total of a well drift off its target and can push a well over a chemical's molarmax.  Here all
+wells are snapped at once: every volume is floored to the resolution and the units lost are handed back to
+the reagents with the largest remainders (largest remainder method), so each well keeps its exact total.
+The chemical limits are then checked for every well in one pass and the offending wells are re-quantized
+with the rounding steered away from the limit they cross.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from capture.generate import calcs
+import capture.devconfig as config
+from log import trace
+
+modlog = logging.getLogger('capture.generate.quantize')
+
+# volumes within this many units of a multiple of the resolution count as that multiple
+UNIT_TOL = 1e-9
+
+
+def _ranks(keys):
+    """Rank (0 first) of each entry of every row of keys in ascending order, ties keep the column order"""
+    return np.argsort(np.argsort(keys, axis=1, kind='mergesort'), axis=1, kind='mergesort')
+
+
+def largest_remainder(volumes, totals, resolution=1, priority=None):
+    """Snap (wells x reagents) volumes to multiples of resolution with every well summing to its total
+
+    Units missing after flooring go to the reagents with a remainder, highest priority first, then to the
+    reagents already present.  When the total is below the floored sum (volumes rounded up earlier) units
+    are taken from the reagents holding at least one, lowest priority first.
+
+    :param totals: scalar or per well target total (ul), snapped to the resolution
+    :param resolution: volume step (ul) of the pipettes
+    :param priority: (wells x reagents) order in which reagents get the units, the remainders by default
+    :return: (wells x reagents) array of volumes, int when the resolution is a whole number of ul
+    """
+    units = np.atleast_2d(np.asarray(volumes, dtype=float)) / resolution
+    nwells = len(units)
+    base = np.floor(units + UNIT_TOL)
+    remainder = np.clip(units - base, 0, None)
+    remainder[remainder <= UNIT_TOL] = 0
+    target = np.rint(np.broadcast_to(np.asarray(totals, dtype=float), (nwells,)) / resolution)
+    deficit = (target - base.sum(axis=1)).astype(int)
+    priority = remainder if priority is None else priority
+
+    # reagents with a remainder receive first, then (totals above the rounded up sum) those already present
+    gives = base >= 1
+    tier = np.where(remainder > 0, 0, np.where(gives, 1, 2))
+    spread = 2 * (np.abs(priority).max() + 1) if priority.size else 1
+    add = (tier < 2) & (_ranks(tier * spread - priority) < deficit[:, None])
+    take = gives & (_ranks(np.where(gives, priority, np.inf)) < -deficit[:, None])
+    quantized = base + add - take
+
+    missed = deficit - add.sum(axis=1) + take.sum(axis=1) != 0
+    if missed.any():
+        modlog.warning('%s wells cannot be brought to their total volume at a resolution of %s ul'
+                       % (missed.sum(), resolution))
+    if float(resolution).is_integer():
+        return quantized.astype(int) * int(resolution)
+    return quantized * resolution
+
+
+@trace.traced(category='sampler')
+def quantize_wells(voldf, rdict, rxndict, totals=None, resolution=None):
+    """Snap every well of voldf to the pipette resolution keeping its total, then re-check the chemical limits
+
+    With molar limits enabled (calcs.molar_limits_enabled), wells outside of a molarity limit of the rxndict
+    (calcs.molar_limits) after snapping are snapped again with the units going last to reagents carrying a
+    chemical above its maximum (first to those carrying a chemical below its minimum), and keep that version
+    when it meets the limits.
+
+    :param voldf: 'Reagent<i> (ul)' volumes of the wells
+    :param rdict: {reagent number: perovskitereagent} or a models.reagent.ReagentSet
+    :param totals: per well target totals (ul), the current totals of the wells by default
+    :param resolution: volume step (ul), devconfig.volume_resolution by default
+    :return: DataFrame with the index and columns of voldf
+    """
+    resolution = resolution or config.volume_resolution
+    volumes = voldf.values.astype(float)
+    if totals is None:
+        totals = volumes.sum(axis=1)
+    totals = np.broadcast_to(np.asarray(totals, dtype=float), (len(volumes),))
+    quantized = largest_remainder(volumes, totals, resolution)
+
+    concentrations = calcs.ConcentrationMatrix(rdict)
+    limits = {}
+    if calcs.molar_limits_enabled(rxndict):
+        limits = calcs.molar_limits(rxndict, concentrations.chemicals)
+    if limits and len(volumes):
+        reagents = [column.split('t')[1].split(' ')[0] for column in voldf.columns]
+        concs = concentrations.reagents.vectors(reagents, list(limits))
+        lower = np.array([low for low, _ in limits.values()])
+        upper = np.array([high for _, high in limits.values()])
+        molarity = calcs.well_molarity(quantized.dot(concs) / 1000, quantized.sum(axis=1))
+        over = molarity > upper
+        under = molarity < lower
+        offending = np.flatnonzero((over | under).any(axis=1))
+        if len(offending):
+            carries = (concs > 0).astype(float)
+            steer = under[offending].dot(carries.T) - over[offending].dot(carries.T)
+            units = volumes[offending] / resolution
+            priority = units - np.floor(units + UNIT_TOL) + steer
+            retried = largest_remainder(volumes[offending], totals[offending], resolution, priority)
+            repaired = calcs.within_molar_limits(retried.dot(concs) / 1000, retried.sum(axis=1),
+                                                 list(limits.values()))
+            quantized[offending[repaired]] = retried[repaired]
+            modlog.info('%s of %s wells outside of the chemical limits after quantization were repaired'
+                        % (repaired.sum(), len(offending)))
+            if not repaired.all():
+                modlog.warning('%s wells remain outside of the chemical limits at a resolution of %s ul'
+                               % ((~repaired).sum(), resolution))
+
+    return pd.DataFrame(quantized, index=voldf.index, columns=voldf.columns)
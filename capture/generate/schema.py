@@ -0,0 +1,91 @@
+"""Column dtypes of the experiment tables and the checks applied where they are handed between stages
+
+    volumes (erdf): 'Reagent<i> (ul)' columns, uint16 microliters
+    mmol (ermmoldf): mmol breakout (or concentrations of the hull enumerations), float32
+    molarity (emsumdf): '<chemical> [M]' nominal molarities, float32
+    models (model info): modelname / participantname ids, categorical
+
+Producers (qrandom.preprocess_and_sample, statespace.preprocess_and_enumerate, statespace.enumerate_chunks)
+apply the schema to what they return, consumers check it, so every stage sees the same dtypes regardless of
+the sampler, the concatenations and the fill-ins that built the table.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+modlog = logging.getLogger('capture.generate.schema')
+
+VOLUME_DTYPE = np.dtype(np.uint16)
+AMOUNT_DTYPE = np.dtype(np.float32)
+ID_DTYPE = 'category'
+
+# largest relative change allowed when narrowing an amount column to AMOUNT_DTYPE, columns that would
+# lose more (values beyond the float32 range or so small they underflow) stay float64
+AMOUNT_RTOL = 1e-6
+
+TABLES = ('volumes', 'mmol', 'molarity', 'models')
+
+
+def _amount_column(values):
+    """values as AMOUNT_DTYPE when that keeps them within AMOUNT_RTOL, as float64 otherwise"""
+    values = np.asarray(values, dtype=np.float64)
+    narrow = values.astype(AMOUNT_DTYPE)
+    with np.errstate(over='ignore', invalid='ignore'):
+        error = np.abs(narrow.astype(np.float64) - values)
+    finite = np.isfinite(values)
+    if np.all(error[finite] <= AMOUNT_RTOL * np.abs(values[finite])) and np.array_equal(np.isfinite(narrow), finite):
+        return narrow
+    return values
+
+
+def _volume_column(values, name, stage):
+    """values as VOLUME_DTYPE, missing volumes (reagent absent from the row) are 0
+
+    :raises ValueError: if a volume is negative, fractional or does not fit VOLUME_DTYPE
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = np.where(np.isnan(values), 0., values)
+    limit = np.iinfo(VOLUME_DTYPE).max
+    if values.size and (values.min() < 0 or values.max() > limit or np.any(values != np.rint(values))):
+        raise ValueError('%s: %s must hold whole volumes within [0, %s] ul' % (stage, name, limit))
+    return values.astype(VOLUME_DTYPE)
+
+
+def apply(df, table, stage):
+    """Return a copy of df with the dtypes of table
+
+    :param table: one of TABLES
+    :param stage: name of the producing stage, used in errors and logs
+    :raises ValueError: if the values cannot be represented, see _volume_column
+    """
+    if table not in TABLES:
+        raise ValueError('Unknown table {}, expected one of {}'.format(table, TABLES))
+    columns = {}
+    for name in df.columns:
+        if table == 'volumes':
+            columns[name] = _volume_column(df[name].values, name, stage)
+        elif table == 'models':
+            columns[name] = pd.Categorical(df[name].values)
+        else:
+            columns[name] = _amount_column(df[name].values)
+    typed = pd.DataFrame(columns, index=df.index, columns=df.columns)
+    modlog.debug('%s: %s table of %s rows uses %s bytes' % (stage, table, len(typed),
+                                                            typed.memory_usage(index=False).sum()))
+    return typed
+
+
+def check(df, table, stage):
+    """Make sure df follows the schema of table
+
+    :raises TypeError: naming the columns with a dtype other than the schema's
+    """
+    if table == 'volumes':
+        wrong = [name for name in df.columns if df[name].dtype != VOLUME_DTYPE]
+    elif table == 'models':
+        wrong = [name for name in df.columns if not isinstance(df[name].dtype, pd.CategoricalDtype)]
+    else:
+        wrong = [name for name in df.columns if df[name].dtype not in (AMOUNT_DTYPE, np.dtype(np.float64))]
+    if wrong:
+        raise TypeError('%s: columns %s of the %s table do not follow the schema' % (stage, wrong, table))
+    return df
@@ -1,19 +1,155 @@
 import logging
-import itertools
 import sys
 
 import pandas as pd
 import numpy as np
 
 from capture.generate import calcs
-from capture.models import chemical
-from capture.generate.wolframsampler import WolframSampler
+from capture.generate import parallel
+from capture.generate import schema
+from capture.generate.lattice import StateLattice
+from capture.generate.wolframsampler import kernel_pool
+from capture.generate.nativesampler import NativeSampler
 from capture.generate.qrandom import get_unique_chemical_names, build_reagent_vectors
 import capture.devconfig as config
+from log import trace
 
 modlog = logging.getLogger('capture.generate.statespace')
 
 
+def bounded_compositions(nparts, summin, summax, caps):
+    """All integer vectors x with 0 <= x_i <= caps_i and summin <= sum(x) <= summax, in lexicographic order
+
+    Built one column at a time: every prefix is extended only by the values that keep the sum reachable
+    (at most summax, and summin still attainable with the caps of the remaining columns), so no invalid
+    combination is ever generated and each intermediate array is no larger than the result.
+
+    :param caps: scalar or per part upper bound
+    :return: (N x nparts) int array
+    """
+    caps = np.broadcast_to(np.asarray(caps, dtype=np.int64), (nparts,))
+    rest = np.concatenate([np.cumsum(caps[::-1])[::-1][1:], [0]])  # capacity of the columns after each one
+    prefixes = np.zeros((1, 0), dtype=np.int64)
+    sums = np.zeros(1, dtype=np.int64)
+    for column in range(nparts):
+        lo = np.maximum(0, summin - sums - rest[column])
+        hi = np.minimum(caps[column], summax - sums)
+        counts = np.maximum(hi - lo + 1, 0)
+        parent = np.repeat(np.arange(len(sums)), counts)
+        firsts = np.cumsum(counts) - counts
+        values = lo[parent] + np.arange(counts.sum()) - firsts[parent]
+        prefixes = np.column_stack([prefixes[parent], values])
+        sums = sums[parent] + values
+    return prefixes
+
+
+def portion_volume_rows(nreagents, volmin, volmax, volspacing, caps=None):
+    """Volume combinations of one portion whose sum lies within [volmin, volmax]
+
+    Same rows, in the same order, as filtering itertools.product over range(0, volmax+1, volspacing)
+    for every reagent, generated directly as compositions (see bounded_compositions).
+
+    :param caps: optional per reagent maximum volume (ul)
+    :return: (N x nreagents) int array
+    """
+    volcaps = np.full(nreagents, int(volmax))
+    if caps is not None:
+        volcaps = np.minimum(volcaps, caps).astype(np.int64)
+    steps = bounded_compositions(nreagents,
+                                 -(-int(volmin) // volspacing),
+                                 int(volmax) // volspacing,
+                                 np.maximum(volcaps, 0) // volspacing)
+    return steps * volspacing
+
+
+def default_statedataframe_chunks(rxndict, expoverview, vollimits, rdict, experiment, chunksize=None):
+    """Generate the state set of default_statedataframe as a stream of chunks
+
+    Each portion's volume combinations are enumerated directly (portion_volume_rows), the product across
+    portions is generated chunksize rows at a time.  With molar limits enabled (calcs.molar_limits_enabled)
+    the molarity limits of the rxndict (calcs.molar_limits) are applied to the state set, and used to prune
+    early: reagent volumes are capped by the most dilute well possible, and portion rows are dropped when
+    no combination with the other portions can meet the limits.
+
+    :param chunksize: rows per chunk, defaults to config.stateset_chunksize
+    :return: generator of (volume df, mmol df) with at most chunksize rows each, indexed from 0 within the chunk
+    """
+    chunksize = chunksize or config.stateset_chunksize or 100000
+    concentrations = calcs.ConcentrationMatrix(rdict)
+    reagents = concentrations.reagents
+    expreagents = [reagent for portion in expoverview for reagent in portion]
+    usedchems = reagents.vectors(expreagents).any(axis=0)
+    limits = {}
+    if calcs.molar_limits_enabled(rxndict):
+        limits = calcs.molar_limits(rxndict, [chem for chem, used in zip(reagents.chemicals, usedchems) if used])
+    limitchems = list(limits.keys())
+    maxwellvolume = sum(int(vollimits[portionnum][1]) for portionnum in range(len(expoverview)))
+
+    fullreagentnamelist = []
+    portionrows = []
+    portionmmols = []
+    for portionnum, portion in enumerate(expoverview):
+        fullreagentnamelist.extend(['Reagent%s (ul)' % reagent for reagent in portion])
+        # (reagents x limited chemicals) concentrations
+        concs = reagents.vectors(portion, limitchems)
+        caps = np.full(len(portion), np.inf)
+        for column, chem in enumerate(limitchems):
+            # v * conc / maxwellvolume is the lowest molarity a volume v of the reagent can end up at
+            with np.errstate(divide='ignore'):
+                caps = np.minimum(caps, np.where(concs[:, column] > 0,
+                                                 np.floor(limits[chem][1] * maxwellvolume / concs[:, column]),
+                                                 np.inf))
+        # Select only those which meet the volume critera specified by the portion of the experiment
+        rows = portion_volume_rows(len(portion),
+                                   vollimits[portionnum][0],
+                                   vollimits[portionnum][1],
+                                   config.volspacing,
+                                   caps)
+        portionrows.append(rows)
+        portionmmols.append(rows.dot(concs) / 1000)
+
+    if limits and len(portionrows) > 1 and all(len(rows) for rows in portionrows):
+        # best case completion of each portion row by the other portions: the bound on the molarity of the
+        # combination uses the extremes of every other portion's mmols and volumes independently
+        volsums = [rows.sum(axis=1) for rows in portionrows]
+        bounds = [(mmols.min(axis=0), mmols.max(axis=0), vols.min(), vols.max())
+                  for mmols, vols in zip(portionmmols, volsums)]
+        lower = np.array([low for low, _ in limits.values()])
+        upper = np.array([high for _, high in limits.values()])
+        for portionnum in range(len(portionrows)):
+            others = [bound for i, bound in enumerate(bounds) if i != portionnum]
+            minmmol = sum(bound[0] for bound in others)
+            maxmmol = sum(bound[1] for bound in others)
+            minvol = sum(bound[2] for bound in others)
+            maxvol = sum(bound[3] for bound in others)
+            mmols, vols = portionmmols[portionnum], volsums[portionnum]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                highest = (mmols + maxmmol) / (vols + minvol)[:, None] * 1000
+                lowest = (mmols + minmmol) / (vols + maxvol)[:, None] * 1000
+            # 0/0 only when every portion can be empty: keep the row
+            highest = np.where(np.isnan(highest), np.inf, highest)
+            lowest = np.where(np.isnan(lowest), 0., lowest)
+            keep = np.all((highest >= lower) & (lowest <= upper), axis=1)
+            portionrows[portionnum] = portionrows[portionnum][keep]
+            portionmmols[portionnum] = portionmmols[portionnum][keep]
+
+    # permute all combinations of the portions that meet the requirements set by the user
+    # rows of a portion are distinct so every combination is too, no duplicates to drop
+    shape = tuple(len(rows) for rows in portionrows)
+    total = int(np.prod(shape))
+    for start in range(0, total, chunksize):
+        idx = np.unravel_index(np.arange(start, min(start + chunksize, total)), shape)
+        chunk = np.hstack([rows[i] for rows, i in zip(portionrows, idx)])
+        if limits:
+            mmols = sum(mmols[i] for mmols, i in zip(portionmmols, idx))
+            chunk = chunk[calcs.within_molar_limits(mmols, chunk.sum(axis=1), list(limits.values()))]
+            if len(chunk) == 0:
+                continue
+        prdf = pd.DataFrame(chunk, columns=fullreagentnamelist)
+        yield prdf, concentrations.mmol_breakout(prdf, experiment)
+
+
+@trace.traced(category='sampler')
 def default_statedataframe(rxndict, expoverview, vollimits, rdict, experiment):
     """Generate a state set from the volume constraints of the experimental system ensuring that the limits are met.
 
@@ -27,65 +163,42 @@ def default_statedataframe(rxndict, expoverview, vollimits, rdict, experiment):
     :param volspacing:
     :return:
     """
-    portionnum = 0
-
-    # TODO these two vars actually dont get used, just overwritten
-    prdf = pd.DataFrame()
-    prmmoldf = pd.DataFrame()
-
-    fullreagentnamelist = []
-    fullvollist = []
-
-    for portion in expoverview:
-        reagentnamelist = []
-        reagentvols = []
-
-        for reagent in portion:
-            # generate the list of possible volumes for each reagent
-            # and the associated mmol calculated values (for parsing later)
-
-            # Take the maximum volume limit and generate a list of all possible volumes from 0 to the max
-            reagentnamelist.append('Reagent%s (ul)' % reagent)
-            reagentvols.append(list(range(0, vollimits[portionnum][1]+1, config.volspacing)))
-            fullreagentnamelist.append('Reagent%s (ul)' % reagent)
-
-        # generate permutation of all of the volumes
-        testdf = pd.DataFrame(list(itertools.product(*reagentvols)))
-        testdf.astype(int)
+    chunks = list(default_statedataframe_chunks(rxndict, expoverview, vollimits, rdict, experiment))
+    if not chunks:
+        prdf = pd.DataFrame(columns=['Reagent%s (ul)' % reagent for portion in expoverview for reagent in portion])
+        return prdf, calcs.ConcentrationMatrix(rdict).mmol_breakout(prdf, experiment)
+    prdf = pd.concat([prdf for prdf, _ in chunks], axis=0, ignore_index=True)
+    finalmmoldf = pd.concat([mmoldf for _, mmoldf in chunks], axis=0, ignore_index=True)
+    return prdf, finalmmoldf
 
-        # organize dataframe with the sums of the generated numbers
-        sumdf = testdf.sum(axis=1)
-        sumname = 'portion%s_volsum' % portionnum
-        reagentnamelist.append(sumname)
-        rdf = pd.concat([testdf, sumdf], axis=1, ignore_index=True)
-        rdf.columns = reagentnamelist
 
-        # Select only those which meet the volume critera specified by the portion of the experiment
-        finalrdf = rdf.loc[(rdf[sumname] >= int(vollimits[portionnum][0])) & (rdf[sumname] <= int(vollimits[portionnum][1]))]
-        finalrdf = finalrdf.drop(labels=sumname, axis=1)
-        fullvollist.append(finalrdf.values.tolist())
-        portionnum += 1
+def hull_enumeration_inputs(rxndict, expoverview, vollimits, rdict):
+    """Arguments of the convex hull enumerations (wolfram and native) for one experiment
 
-    # permute all combinations of the portions that meet the requirements set by the user
-    fullpermlist = list(itertools.product(*fullvollist))
-    # combine the list of list for each rxn into a single list for import into pandas
-    finalfulllist = [list(itertools.chain.from_iterable(multivol)) for multivol in fullpermlist]
-
-    prdf = pd.DataFrame(finalfulllist)
-    prdf = prdf.drop_duplicates()
-    prdf.columns = fullreagentnamelist
-    prdf.astype(float)
-
-    finalmmoldf = pd.DataFrame()
-    for reagentname in fullreagentnamelist:
-        if "Reagent" in reagentname:
-            reagentnum = reagentname.split('t')[1].split(' ')[0]
-            mmoldf = calcs.mmolextension(prdf[reagentname], rdict, experiment, reagentnum)
-            finalmmoldf = pd.concat([finalmmoldf, mmoldf], axis=1)
+    :return: dict of the keyword arguments of enumerativelySample
+    """
+    if len(expoverview) > 1:
+        raise ValueError('When using {} sampling, expoverview must have length 1, got {}'.format(config.sampler,
+                                                                                               len(expoverview)))
+    else:
+        # portions don't make sense when using wolfram sampling
+        # as a holdover we assume we have one an only one poriton and we hard code it here
+        portionnum = 0
+        portion = expoverview[portionnum]
 
-    return prdf, finalmmoldf
+    maxconc = rxndict.get('max_conc', 15)
+    portion_reagents = [rdict[str(i)] for i in portion]
+    volmax = vollimits[portionnum][1]
+    portion_species_names = get_unique_chemical_names(portion_reagents)
+    reagent_vectors = build_reagent_vectors(portion_reagents, portion_species_names)
+    return dict(reagentVectors=reagent_vectors,
+                uniqueChemNames=portion_species_names,
+                deltaV=float(config.volspacing),
+                maxMolarity=float(maxconc),
+                finalVolume=float(volmax))
 
 
+@trace.traced(category='sampler')
 def wolfram_statedataframe(rxndict, expoverview, vollimits, rdict, experiment):
     """Exhaustively sample a regularly spaced grid in the concentration space of this experiment.
 
@@ -98,32 +211,38 @@ def wolfram_statedataframe(rxndict, expoverview, vollimits, rdict, experiment):
     :param experiment: WE'RE LOOPING OVER THIS?! todo: talk with Ian.
     :return: voldf, concdf   todo ensure these are good names
     """
-    ws = WolframSampler()
+    with kernel_pool().lease() as ws:
+        experiments = ws.enumerativelySample(**hull_enumeration_inputs(rxndict, expoverview, vollimits, rdict))
 
-    if len(expoverview) > 1:
-        raise ValueError('When using wolfram sampling, expoverview must have length 1, got {}'.format(len(expoverview)))
-    else:
-        # portions don't make sense when using wolfram sampling
-        # as a holdover we assume we have one an only one poriton and we hard code it here
-        portionnum = 0
-        portion = expoverview[portionnum]
+    voldf = pd.DataFrame.from_dict(experiments['volumes'])
+    concdf = pd.DataFrame.from_dict(experiments['concentrations'])
 
-    maxconc = rxndict.get('max_conc', 15)
-    portion_reagents = [rdict[str(i)] for i in portion]
-    volmax = vollimits[portionnum][1]
-    portion_species_names = get_unique_chemical_names(portion_reagents)
-    reagent_vectors = build_reagent_vectors(portion_reagents, portion_species_names)
+    return voldf, concdf
+
+
+def native_statedataframe_chunks(rxndict, expoverview, vollimits, rdict, experiment, chunksize=None):
+    """Same grid as wolfram_statedataframe enumerated in numpy (nativesampler.NativeSampler), streamed in chunks
+
+    :param chunksize: grid points tested at a time, defaults to config.stateset_chunksize
+    :return: generator of (voldf, concdf) with at most chunksize rows each, indexed from 0 within the chunk
+    """
+    chunksize = chunksize or config.stateset_chunksize or 100000
+    blocks = NativeSampler().enumerativeBlocks(blocksize=chunksize,
+                                               **hull_enumeration_inputs(rxndict, expoverview, vollimits, rdict))
+    for block in blocks:
+        yield pd.DataFrame.from_dict(block['volumes']), pd.DataFrame.from_dict(block['concentrations'])
 
-    experiments = ws.enumerativelySample(reagentVectors=reagent_vectors,
-                                         uniqueChemNames=portion_species_names,
-                                         deltaV=float(config.volspacing),
-                                         maxMolarity=float(maxconc),
-                                         finalVolume=float(volmax))
 
+@trace.traced(category='sampler')
+def native_statedataframe(rxndict, expoverview, vollimits, rdict, experiment):
+    """Exhaustively sample a regularly spaced grid in the concentration space of this experiment, without Wolfram
+
+    :return: voldf, concdf as wolfram_statedataframe
+    """
+    experiments = NativeSampler().enumerativelySample(**hull_enumeration_inputs(rxndict, expoverview, vollimits,
+                                                                                rdict))
     voldf = pd.DataFrame.from_dict(experiments['volumes'])
     concdf = pd.DataFrame.from_dict(experiments['concentrations'])
-
-    ws.terminate()
     return voldf, concdf
 
 
@@ -136,9 +255,45 @@ def chemicallist(rxndict):
             chemicallist.append(name)
     return chemicallist
 
+@trace.traced(category='sampler')
+def enumerate_experiment(experiment, expoverview, vollimits, rxndict, rdict):
+    """State space of one experiment of the tray with the sampler selected in devconfig
+
+    Module level so it can be shipped to a worker process, see parallel.map_experiments.  The volumes are
+    handed back as lattice indices, a quarter of the size of the volume df.
+
+    :return: (volumes as a lattice.StateLattice, mmol df)
+    """
+    modlog.info('Building reagent state space for experiment %s using reagents %s' %(experiment, expoverview))
+    modlog.warning('Well count will be ignored for state space creation!  Please disable CP run if this incorrect')
+
+    # DO THE ENUMERATION
+    if config.sampler == 'default':
+        prdf, prmmoldf = default_statedataframe(rxndict, expoverview, vollimits, rdict, experiment)
+    elif config.sampler == 'native':
+        prdf, prmmoldf = native_statedataframe(rxndict, expoverview, vollimits, rdict, experiment)
+    else:
+        prdf, prmmoldf = wolfram_statedataframe(rxndict, expoverview, vollimits, rdict, experiment)
+    modlog.info('Succesfully built experiment %s stateset' %(experiment))
+    return StateLattice.from_volumes(prdf, lattice_spacing()), prmmoldf
+
+def lattice_spacing():
+    """Volume step (ul) of the enumerated state sets of the configured sampler
+
+    The default enumeration steps by volspacing.  The native enumeration snaps its volumes to
+    volume_resolution, the wolfram one rounds them to whole microliters (Round in the .wls).
+    """
+    if config.sampler == 'default':
+        return config.volspacing
+    if config.sampler == 'native':
+        return config.volume_resolution
+    return 1
+
 def preprocess_and_enumerate(chemdf, rxndict, edict, rdict, volspacing):
     """
 
+    Experiments are enumerated in parallel (devconfig.sampling_workers) and combined once at the end
+
     :param chemdf:
     :param rxndict:
     :param edict:
@@ -148,13 +303,12 @@ def preprocess_and_enumerate(chemdf, rxndict, edict, rdict, volspacing):
     """
     experiment = 1
     modlog.info('Making a total of %s unique experiments on the tray' %rxndict['totalexperiments'])
-
-    # Experiment Reagent dataframes
-    # store volumes and concentrations of statespace, respectively
-    erdf = pd.DataFrame()
-    ermmoldf = pd.DataFrame()
+    if config.sampler not in ['default', 'wolfram', 'native']:
+        modlog.error('Unexpected sampler in devconfig: {}. Quitting.'.format(config.sampler))
+        sys.exit(1)
 
     # outer loop: runs state-space enumeration for all experiments specified in Template
+    jobs = []
     while experiment < rxndict['totalexperiments'] + 1:
         modlog.info('Initializing dataframe construction for experiment %s' %experiment)
         experimentname = 'exp%s' % experiment
@@ -167,37 +321,26 @@ def preprocess_and_enumerate(chemdf, rxndict, edict, rdict, volspacing):
                 if 'vols' in k:
                     vollimits = v
 
-        modlog.info('Building reagent state space for experiment %s using reagents %s' %(experiment, edict[experimentname]))
-        modlog.warning('Well count will be ignored for state space creation!  Please disable CP run if this incorrect')
-
-        # DO THE ENUMERATION
-        if config.sampler == 'default':
-            prdf, prmmoldf = default_statedataframe(rxndict, edict[experimentname], vollimits, rdict, experiment)
-        elif config.sampler == 'wolfram':
-            prdf, prmmoldf = wolfram_statedataframe(rxndict, edict[experimentname], vollimits, rdict, experiment)
-        else:
-            modlog.error('Unexpected sampler in devconfig: {}. Quitting.'.format(config.sampler))
-            sys.exit(1)
-
-        # accumulate state spaces for experiments
-        erdf = pd.concat([erdf, prdf], axis=0, ignore_index=True, sort=True)
-        ermmoldf = pd.concat([ermmoldf, prmmoldf], axis=0, ignore_index=True, sort=True)
-        # Return the reagent data frame with the volumes for that particular portion of the plate
-        modlog.info('Succesfully built experiment %s stateset' %(experiment))
+        jobs.append((experiment, edict[experimentname], vollimits, rxndict, rdict))
         experiment += 1
 
-    #Final reagent volumes dataframe
-    erdf.fillna(value=0, inplace=True)
+    results = parallel.map_experiments(enumerate_experiment, jobs)
+
+    # Experiment Reagent dataframes
+    # store volumes and concentrations of statespace, respectively
+    # volumes are combined on their integer lattice, reagents absent from an experiment are index 0 rather
+    # than a float NaN filled in afterwards
+    lattice = StateLattice.concat([prlattice for prlattice, _ in results])
+    modlog.info('State set of %s rows held in %s bytes of lattice indices' % (len(lattice), lattice.nbytes))
+    erdf = lattice.volumes()
+    ermmoldf = pd.concat([prmmoldf for _, prmmoldf in results], axis=0, ignore_index=True, sort=True)
 
     #Final reagent mmol dataframe broken down by experiment, protion, reagent, and chemical
     ermmoldf.fillna(value=0, inplace=True)
-    clist = chemical.exp_chem_list(rdict)
-
-    # Final nominal molarity for each reagent in each well
-    emsumdf = calcs.finalmmolsums(clist, ermmoldf) # Returns incorrectly labeled columns, we used these immediately and convert to the correct units
-
-    if config.sampler == 'default':
-        emsumdf = emsumdf.divide(erdf.sum(axis=1), axis='rows')*1000
+    emsumdf = nominal_molarity(erdf, ermmoldf, rdict)
+    erdf = schema.apply(erdf, 'volumes', 'enumeration')
+    ermmoldf = schema.apply(ermmoldf, 'mmol', 'enumeration')
+    emsumdf = schema.apply(emsumdf, 'molarity', 'enumeration')
 
     # plotter.plotme(ReagentmmList[0],ReagentmmList[1], hold.tolist())
 
@@ -206,3 +349,85 @@ def preprocess_and_enumerate(chemdf, rxndict, edict, rdict, volspacing):
     # for chemical in rdict['2'].chemicals:
     #     print(rxndict['chem%s_abbreviation' %chemical])
     return erdf, ermmoldf, emsumdf
+
+
+def nominal_molarity(erdf, ermmoldf, rdict):
+    """Final nominal molarity of each chemical in each well
+
+    The wolfram and native enumerations return concentrations in place of mmols, those are used as they are
+    """
+    concentrations = calcs.ConcentrationMatrix(rdict)
+    if config.sampler == 'default':
+        return concentrations.molarity(erdf)
+    emsumdf = ermmoldf.reindex(columns=concentrations.chemicals, fill_value=0)
+    emsumdf.columns = ['%s [M]' % chemical for chemical in emsumdf.columns]
+    return emsumdf
+
+
+def stateset_columns(rxndict, edict, rdict):
+    """Columns of the volume and mmol dataframes of the whole tray, as produced by preprocess_and_enumerate
+
+    :return: (sorted volume columns, sorted mmol columns)
+    """
+    volcolumns = set()
+    mmolcolumns = set()
+    breakout = calcs.ConcentrationMatrix(rdict).breakout
+    for experiment in range(1, rxndict['totalexperiments'] + 1):
+        expoverview = edict['exp%s' % experiment]
+        for portionnum, portion in enumerate(expoverview):
+            volcolumns.update('Reagent%s (ul)' % reagent for reagent in portion)
+            if config.sampler in ('wolfram', 'native'):
+                if portionnum == 0:
+                    mmolcolumns.update(get_unique_chemical_names([rdict[str(i)] for i in portion]))
+                continue
+            for reagent in portion:
+                for truechemname, _ in breakout['%s' % reagent]:
+                    mmolcolumns.add('mmol_experiment%s_reagent%s_%s' % (experiment, reagent, truechemname))
+    return sorted(volcolumns), sorted(mmolcolumns)
+
+
+def enumerate_chunks(chemdf, rxndict, edict, rdict, volspacing, chunksize=None):
+    """Streaming counterpart of preprocess_and_enumerate
+
+    Experiments are enumerated one after the other and handed out chunksize rows at a time, every chunk
+    with the columns of the whole tray so they can be appended to the same files.  Memory use is bounded
+    by the chunk size (and the accepted rows of single portions) rather than by the size of the state set.
+    The native enumeration is streamed block by block, the wolfram one comes back from the kernel in one
+    piece and is only split up.
+
+    :param chunksize: rows per chunk, defaults to config.stateset_chunksize
+    :return: generator of (erdf, ermmoldf, emsumdf) chunks, indexed from 0 within the chunk
+    """
+    chunksize = chunksize or config.stateset_chunksize or 100000
+    modlog.info('Making a total of %s unique experiments on the tray' %rxndict['totalexperiments'])
+    if config.sampler not in ['default', 'wolfram', 'native']:
+        modlog.error('Unexpected sampler in devconfig: {}. Quitting.'.format(config.sampler))
+        sys.exit(1)
+    volcolumns, mmolcolumns = stateset_columns(rxndict, edict, rdict)
+
+    for experiment in range(1, rxndict['totalexperiments'] + 1):
+        experimentname = 'exp%s' % experiment
+        for k, v in edict.items():
+            if experimentname in k and 'vols' in k:
+                vollimits = v
+        expoverview = edict[experimentname]
+        modlog.info('Building reagent state space for experiment %s using reagents %s' %(experiment, expoverview))
+
+        if config.sampler == 'default':
+            chunks = default_statedataframe_chunks(rxndict, expoverview, vollimits, rdict, experiment, chunksize)
+        elif config.sampler == 'native':
+            chunks = native_statedataframe_chunks(rxndict, expoverview, vollimits, rdict, experiment, chunksize)
+        else:
+            prdf, prmmoldf = wolfram_statedataframe(rxndict, expoverview, vollimits, rdict, experiment)
+            chunks = ((prdf.iloc[start:start + chunksize].reset_index(drop=True),
+                       prmmoldf.iloc[start:start + chunksize].reset_index(drop=True))
+                      for start in range(0, len(prdf), chunksize))
+
+        for prdf, prmmoldf in chunks:
+            erdf = prdf.reindex(columns=volcolumns, fill_value=0)
+            ermmoldf = prmmoldf.reindex(columns=mmolcolumns, fill_value=0)
+            emsumdf = nominal_molarity(erdf, ermmoldf, rdict)
+            yield (schema.apply(erdf, 'volumes', 'enumeration'),
+                   schema.apply(ermmoldf, 'mmol', 'enumeration'),
+                   schema.apply(emsumdf, 'molarity', 'enumeration'))
+        modlog.info('Succesfully built experiment %s stateset' %(experiment))
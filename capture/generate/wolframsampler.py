@@ -1,31 +1,216 @@
+import atexit
+import contextlib
+import hashlib
+import logging
+import os
+import queue
+import threading
+
 from wolframclient.evaluation import WolframLanguageSession
 
+import capture.devconfig as config
 from capture.devconfig import wolfram_kernel_path
+from capture.generate.conversion import VolumeConverter
+from capture.generate.nativesampler import NativeSampler
+from capture.generate.hullcache import cached_hull
+from capture.generate.polytope import drop_zero_columns
+
+modlog = logging.getLogger('capture.generate.wolframsampler')
+
+SAMPLING_SCRIPTS = ['./capture/generate/randomSampling.wls',
+                    './capture/generate/enumerativeSampling.wls']
+
+
+def load_sampling_scripts(session, precompile=False, mxdir='./localfiles'):
+    """Load the sampling .wls scripts into a running session
+
+    With precompile the definitions are dumped to a .mx file after the first load and later
+    sessions Get[] that file instead of parsing the scripts.  The file name carries a hash of the
+    scripts and the kernel $SystemID/$VersionNumber (.mx files are not portable), so stale files
+    are never loaded.
+    """
+    if not precompile:
+        for script in SAMPLING_SCRIPTS:
+            session.evaluate('<<%s' % script)
+        return
+
+    digest = hashlib.md5()
+    for script in SAMPLING_SCRIPTS:
+        with open(script, 'rb') as f:
+            digest.update(f.read())
+    kernel_id = session.evaluate('StringJoin[$SystemID, "_", ToString[$VersionNumber]]')
+    mxfile = os.path.join(mxdir, 'sampling_%s_%s.mx' % (kernel_id, digest.hexdigest()[:10]))
+    mxpath = os.path.abspath(mxfile).replace('\\', '/')
+
+    if os.path.exists(mxfile):
+        session.evaluate('Get["%s"]' % mxpath)
+        return
+    for script in SAMPLING_SCRIPTS:
+        session.evaluate('<<%s' % script)
+    if os.path.isdir(mxdir):
+        session.evaluate('DumpSave["%s", "Global`"]' % mxpath)
+        modlog.info('Precompiled sampling scripts to %s' % mxfile)
+
+
+class WolframKernelPool:
+    """Pool of running Wolfram kernels with the sampling scripts already loaded
+
+    Sessions are leased to callers and returned when they are done with them, so kernel startup and
+    script loading is paid once per process instead of once per experiment.  Kernels are started on
+    demand up to `size` (all of them up front with warmup) and checked with a trivial evaluation
+    before each lease; an unhealthy kernel is replaced.  Separate leases can be used from separate
+    threads at the same time.
+
+    :param size: maximum number of kernels
+    :param warmup: start all kernels at construction time
+    :param precompile: load the scripts from a .mx dump (see load_sampling_scripts)
+    :param healthcheck: evaluate 1+1 on a kernel before leasing it
+    """
+
+    def __init__(self, size=1, warmup=False, precompile=True, healthcheck=True, kernel_path=None):
+        self.size = max(1, int(size))
+        self.precompile = precompile
+        self.healthcheck = healthcheck
+        self.kernel_path = kernel_path or wolfram_kernel_path
+        self._idle = queue.Queue()
+        self._started = 0
+        self._sessions = []
+        self._lock = threading.Lock()
+        if warmup:
+            while self._reserve_slot():
+                self._idle.put(self._start_session())
+
+    def _reserve_slot(self):
+        """Count a kernel about to be started, False if the pool is full"""
+        with self._lock:
+            if self._started >= self.size:
+                return False
+            self._started += 1
+            return True
+
+    def _start_session(self):
+        """Start a kernel in a reserved slot and load the scripts, the slot is given back if either fails"""
+        session = None
+        try:
+            session = WolframLanguageSession(kernel=self.kernel_path)
+            session.start()
+            load_sampling_scripts(session, precompile=self.precompile)
+        except Exception:
+            with self._lock:
+                self._started -= 1
+            if session is not None:
+                self._terminate(session)
+            raise
+        with self._lock:
+            self._sessions.append(session)
+        modlog.info('Started Wolfram kernel %s of %s' % (self._started, self.size))
+        return session
+
+    def _terminate(self, session):
+        try:
+            session.terminate()
+        except Exception:
+            modlog.warning('Unable to terminate a Wolfram kernel')
+
+    def _is_healthy(self, session):
+        try:
+            return session.evaluate('1+1') == 2
+        except Exception:
+            return False
+
+    def _acquire(self):
+        session = None
+        while session is None:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve_slot():
+                    return self._start_session()
+                # wait for a lease to come back, or for a slot freed by a failed start
+                try:
+                    session = self._idle.get(timeout=1.)
+                except queue.Empty:
+                    pass
+        if self.healthcheck and not self._is_healthy(session):
+            modlog.warning('Wolfram kernel failed its health check, restarting it')
+            with self._lock:
+                if session in self._sessions:
+                    self._sessions.remove(session)
+            self._terminate(session)
+            # the replacement takes over the slot, which is given back if it fails to start
+            session = self._start_session()
+        return session
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Lease a WolframSampler on a pooled kernel for the duration of a with block"""
+        session = self._acquire()
+        try:
+            yield WolframSampler(session=session)
+        finally:
+            self._idle.put(session)
+
+    def terminate(self):
+        """Kill every kernel started by the pool"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+            self._started = 0
+        self._idle = queue.Queue()
+        for session in sessions:
+            session.terminate()
+
+
+_KERNEL_POOL = None
+
+
+def kernel_pool():
+    """Process wide WolframKernelPool configured from devconfig, created on first use"""
+    global _KERNEL_POOL
+    if _KERNEL_POOL is None:
+        _KERNEL_POOL = WolframKernelPool(size=config.wolfram_pool_size,
+                                         warmup=config.wolfram_pool_warmup,
+                                         precompile=config.wolfram_precompile)
+        atexit.register(_KERNEL_POOL.terminate)
+    return _KERNEL_POOL
+
 
 class WolframSampler:
 
-    def __init__(self):
+    def __init__(self, session=None):
         """A wrapper to generateExperiments.wls
 
         Written as a class so the Wolfram session is only once at __init__ time.
+        Pass a running session with the scripts loaded (see WolframKernelPool.lease) to reuse a kernel.
         """
-        self.session = WolframLanguageSession(kernel=wolfram_kernel_path)
-        self.session.evaluate('<<./capture/generate/randomSampling.wls')
-        self.session.evaluate('<<./capture/generate/enumerativeSampling.wls')
+        self._owns_session = session is None
+        if session is None:
+            session = WolframLanguageSession(kernel=wolfram_kernel_path)
+            load_sampling_scripts(session)
+        self.session = session
+        self.rng = None  # numpy RandomState for the draws made in python, a fresh one is used if None
         self._randomlySample = self.session.function('generateExperiments')
         self._enumerativelySample = self.session.function('generateEnumerations')
+        self._sampleConcentrations = self.session.function('generateConcentrations')
+        self._enumerateConcentrations = self.session.function('generateEnumerationConcentrations')
 
-    def randomlySample(self, reagentVectors, oldReagents=None, nExpt=96, maxMolarity=9., finalVolume=500.):
+    def randomlySample(self, reagentVectors, oldReagents=None, nExpt=96, maxMolarity=9., finalVolume=500.,
+                       pythonConversion=True):
         """Randomly sample possible experiments in the convex hull of concentration space defined by the reagentVectors
 
         Runs Josh's Mathematica function called `generateExperiments` defined in `randomSampling.wls`
         Shadows default arguments set at Wolfram level.
         Currently does not expose processVaules argument.
 
+        With pythonConversion (and no old reagents) a simplex hull is sampled without the kernel (see sampleSimplex).
+        Otherwise, for <= 3 nonzero species, only the concentration points are sampled in Mathematica
+        (`generateConcentrations`) and the volumes are solved for in one batch by conversion.VolumeConverter
+        instead of one FindInstance per point.
+
         :param reagentVectors: a dictionary of vector representations of reagents living in species-concentration space
         :param nExpt: the number of samples to draw
         :param maxMolarity: the maximum concentration of any species: defines a hypercube bounding the convex hull
         :param finalVolume: a scalar to act on the concentrations to convert to desired volume
+        :param pythonConversion: convert concentrations to volumes in python where possible
         :return: a dictionary mapping: {reagents => list(volumes)} where list(volumes) has length nExpt
         :raises TypeError: since Mathematica will fail silently on incorrect types
         """
@@ -49,22 +234,48 @@ class WolframSampler:
             if "Volume of remaining space is zero" in result:
                 raise ValueError('New reagents define a convex hull that is covered by that of old reagents.')
         else:
-            result = self._randomlySample(reagentVectors, nExpt, maxMolarity, finalVolume)
+            concentrations = self.sampleSimplex(reagentVectors, nExpt, maxMolarity) if pythonConversion else None
+            if concentrations is None and pythonConversion and drop_zero_columns(reagentVectors)[1].shape[1] <= 3:
+                concentrations = self._sampleConcentrations(reagentVectors, nExpt, maxMolarity)
+            if concentrations is not None:
+                result = VolumeConverter(reagentVectors).volume_dict(concentrations, finalVolume)
+            else:
+                result = self._randomlySample(reagentVectors, nExpt, maxMolarity, finalVolume)
 
         return result
 
-    def enumerativelySample(self, reagentVectors, uniqueChemNames, deltaV=10., maxMolarity=9., finalVolume=500.):
+    def sampleSimplex(self, reagentVectors, nExpt, maxMolarity):
+        """Concentrations drawn by NativeSampler.sampleSimplex when the reagents span a simplex
+
+        Rejection in the bounding cuboid (generateHitAndRunExperiments) accepts almost nothing when the hull
+        is lower dimensional than the species space, drawing the reagent fractions does not depend on that.
+
+        :return: (nExpt x nonzero species) array, or None when the hull is not a simplex (or is mostly cut off)
+        """
+        try:
+            hull = cached_hull(reagentVectors, maxMolarity)
+        except ValueError:
+            return None
+        if not hull.is_simplex:
+            return None
+        return NativeSampler(seed=self.rng).sampleSimplex(hull, nExpt)
+
+    def enumerativelySample(self, reagentVectors, uniqueChemNames, deltaV=10., maxMolarity=9., finalVolume=500.,
+                            pythonConversion=True):
         """Enumeratively sample possible experiments in the convex hull of concentration space defined by the reagentVectors
 
         Runs Josh's Mathematica function called `achievableGrid` defined in `enumerativeSampling.wls`
         Shadows default arguments set at Wolfram level.
+        With pythonConversion the grid volumes are solved for in one batch by conversion.VolumeConverter
+        instead of one FindInstance per grid point.
 
         :param reagentVectors: a dictionary of vector representations of reagents living in species-concentration space
         :param uniqueChemNames: list of chemicals making up the reagents
         :param maxMolarity: the maximum concentration of any species: defines a hypercube bounding the convex hull
         :param deltaV: the spacing of reagent volumes that define the spacing of the grid in concentration space
         :param finalVolume: a scalar to act on the concentration points to convert to desired volume
-        :return:  a dictionary mapping: {reagents => list(volumes)}
+        :param pythonConversion: convert concentrations to volumes in python
+        :return:  a dictionary {'concentrations': {species => list(concentrations)}, 'volumes': {reagents => list(volumes)}}
         :raises TypeError: since Mathematica will fail silently on incorrect types
         """
 
@@ -79,8 +290,16 @@ class WolframSampler:
         if not isinstance(finalVolume, float):
             raise TypeError('finalVolume must be float, got {}'.format(type(finalVolume)))
 
+        if pythonConversion:
+            concentrations = self._enumerateConcentrations(reagentVectors, uniqueChemNames, deltaV, maxMolarity, finalVolume)
+            concentrations = {name: list(values) for name, values in concentrations.items()}
+            points = list(zip(*concentrations.values()))
+            volumes = VolumeConverter(reagentVectors).volume_dict(points, finalVolume)
+            return {'concentrations': concentrations, 'volumes': volumes}
+
         return self._enumerativelySample(reagentVectors, uniqueChemNames, deltaV, maxMolarity, finalVolume)
 
     def terminate(self):
-        """Kill the session thread"""
-        self.session.terminate()
+        """Kill the session thread, sessions leased from a WolframKernelPool are left to the pool"""
+        if self._owns_session:
+            self.session.terminate()
@@ -0,0 +1,106 @@
+"""Process wide Google Drive and Sheets clients
+
+Authenticating costs several requests (and a credentials file round trip for Drive), so the clients are
+built once per process and handed to every caller: googleio.get_drive_auth and googleio.get_gdrive_client
+return the shared ones, which keep their tokens and HTTP connections between calls.  Expired tokens are
+refreshed when a client is handed out.  With devconfig.storage_backend = 'local' the clients of the local
+stand-in are handed out instead (see localstore).
+"""
+import logging
+import os
+import threading
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+from pydrive.auth import GoogleAuth
+from pydrive.drive import GoogleDrive
+
+import capture.devconfig as config
+from capture.googleapi import localstore
+from log import trace
+
+modlog = logging.getLogger('capture.googleapi.clients')
+
+# TODO put this in a config
+GOOGLE_CRED_FILE = "./mycred.txt"
+DRIVE_SETTINGS_FILE = 'settings.yaml'
+SERVICE_ACCOUNT_FILE = 'creds.json'
+SHEETS_SCOPE = ['https://spreadsheets.google.com/feeds']
+
+
+class GoogleClients:
+    """Lazily authenticated Drive (PyDrive) and Sheets (gspread) clients"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._gauth = None
+        self._drive = None
+        self._credentials = None
+        self._sheets = None
+
+    def drive(self):
+        """GoogleDrive authorized with the user credentials of GOOGLE_CRED_FILE"""
+        with self._lock:
+            if self._drive is None:
+                with trace.span('drive authentication', 'google'):
+                    self._gauth = self._authorize_drive()
+                self._drive = GoogleDrive(self._gauth)
+            elif self._gauth.access_token_expired:
+                with trace.span('drive token refresh', 'google'):
+                    self._gauth.Refresh()
+                    self._gauth.SaveCredentialsFile(GOOGLE_CRED_FILE)
+            return self._drive
+
+    def sheets(self):
+        """gspread client authorized with the service account of SERVICE_ACCOUNT_FILE"""
+        with self._lock:
+            if self._sheets is None:
+                with trace.span('sheets authentication', 'google'):
+                    self._credentials = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE,
+                                                                                         SHEETS_SCOPE)
+                    self._sheets = gspread.authorize(self._credentials)
+            elif self._credentials.access_token_expired:
+                with trace.span('sheets token refresh', 'google'):
+                    self._sheets.login()
+            return self._sheets
+
+    @staticmethod
+    def _authorize_drive():
+        gauth = GoogleAuth(settings_file=DRIVE_SETTINGS_FILE)
+
+        # We have to check this path here, rather than in runme.py, if this is global because
+        # global code gets executed when a module is imported
+        if not os.path.exists(GOOGLE_CRED_FILE):
+            open(GOOGLE_CRED_FILE, 'w+').close()
+
+        gauth.LoadCredentialsFile(GOOGLE_CRED_FILE)
+        if gauth.credentials is None or gauth.access_token_expired:
+            gauth.LocalWebserverAuth()  # Creates local webserver and auto handles authentication.
+        else:
+            gauth.Authorize()  # Just run because everything is loaded properly
+        gauth.SaveCredentialsFile(GOOGLE_CRED_FILE)
+        modlog.info('Authenticated with Google Drive')
+        return gauth
+
+
+_CLIENTS = GoogleClients()
+
+
+def drive():
+    """Shared Drive client of the configured storage backend"""
+    if config.storage_backend == 'local':
+        return localstore.store().drive()
+    return _CLIENTS.drive()
+
+
+def sheets():
+    """Shared Sheets client of the configured storage backend"""
+    if config.storage_backend == 'local':
+        return localstore.store().sheets()
+    return _CLIENTS.sheets()
+
+
+def reset():
+    """Forget the shared clients, the next call authenticates again"""
+    global _CLIENTS
+    _CLIENTS = GoogleClients()
@@ -5,42 +5,69 @@
 ### https://github.com/gsuitedevs/PyDrive
 ### https://stackoverflow.com/questions/24419188/automating-pydrive-verification-process
 
+import concurrent.futures
 import logging
 import os
 import re
-import time
 
+from googleapiclient.http import MediaFileUpload
+from retry.api import retry_call
 
-import gspread
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
-from oauth2client.service_account import ServiceAccountCredentials
+from capture.googleapi import clients
 from capture.googleapi import googleio
 import capture.devconfig as config
+from log import trace
 from utils import globals
 from utils.globals import lab_safeget
 
 modlog = logging.getLogger('initialize.googleio')
 
 def get_drive_auth():
-    gauth = GoogleAuth(settings_file='settings.yaml')
+    """Drive client shared by the whole run, see clients.GoogleClients.drive"""
+    return clients.drive()
 
-    # We have to check this path here, rather than in runme.py, if this is global because
-    # global code gets executed when a module is imported
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
 
-    # TODO put this in a config
-    GOOGLE_CRED_FILE = "./mycred.txt"
-    if not os.path.exists(GOOGLE_CRED_FILE):
-        open(GOOGLE_CRED_FILE, 'w+').close()
 
-    gauth.LoadCredentialsFile(GOOGLE_CRED_FILE)
-    if gauth.credentials is None or gauth.access_token_expired:
-        gauth.LocalWebserverAuth()  # Creates local webserver and auto handles authentication.
-    else:
-        gauth.Authorize()  # Just run because everything is loaded properly
-    gauth.SaveCredentialsFile(GOOGLE_CRED_FILE)
-    drive = GoogleDrive(gauth)
-    return(drive)
+def _folder_metadata(title, tgt_folder_id):
+    return {
+        'title': title,
+        "parents": [{"kind": "drive#fileLink", "id": tgt_folder_id}],
+        'mimeType': FOLDER_MIMETYPE  # mimeType here specifies that the new file will be a folder
+    }
+
+
+def execute_batch(drive, requests):
+    """Send Drive API requests in one batch HTTP request
+
+    The requests may run in any order, none of them can depend on another.
+
+    :param requests: list of (name, request) pairs, e.g. drive.auth.service.files().insert(...)
+    :return: list of the responses (file resources) in the order of requests
+    :raises: the error of the first failed request
+    """
+    if not requests:
+        return []
+    responses = {}
+    errors = []
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            errors.append((int(request_id), exception))
+        responses[int(request_id)] = response
+
+    batch = drive.auth.service.new_batch_http_request(callback=collect)
+    for position, (name, request) in enumerate(requests):
+        batch.add(request, request_id=str(position))
+    with trace.span('drive batch', 'google', requests=len(requests)):
+        batch.execute()
+    if errors:
+        position, exception = min(errors, key=lambda error: error[0])
+        modlog.error('%s of %s batched Drive requests failed, first: %s' % (len(errors), len(requests),
+                                                                          requests[position][0]))
+        raise exception
+    return [responses[position] for position in range(len(requests))]
+
 
 def create_drive_folder(title, tgt_folder_id):
     """Create template directory for later copying of relevant files
@@ -50,23 +77,31 @@ def create_drive_folder(title, tgt_folder_id):
     """
     drive = get_drive_auth()
 
-    file_metadata = {
-        'title': title,
-        "parents": [{"kind": "drive#fileLink", "id": tgt_folder_id}],
-        'mimeType': 'application/vnd.google-apps.folder'  # mimeType here specifies that the new file will be a folder
-    }
-
-    file = drive.CreateFile(file_metadata)
-    file.Upload()
-    time.sleep(2)
+    file = drive.CreateFile(_folder_metadata(title, tgt_folder_id))
+    with trace.span('drive folder create', 'google', title=title):
+        file.Upload()
     print("Directory Created: " + "%s" % title)
+    # the id comes back with the created folder
+    return file['id']
+
+
+def template_files(includedfiles):
+    """Files of the lab's template folder whose titles are in includedfiles"""
+    if not includedfiles:
+        return []
+    drive = get_drive_auth()
+    template_folder = lab_safeget(config.lab_vars, globals.get_lab(), 'template_folder')
+    with trace.span('drive list', 'google', folder=template_folder):
+        file_template_list = drive.ListFile({'q': "'%s' in parents and trashed=false" % template_folder}).GetList()
+    return [templatefile for templatefile in file_template_list if templatefile['title'] in includedfiles]
 
-    file_list = drive.ListFile({'q': "'%s' in parents and trashed=false" % tgt_folder_id}).GetList()
-    for file in file_list:
-        if file['title'] == title:
-            return file['id']
 
-    raise ValueError('Run folder not found in GDrive. Possible server error: try again.')
+def _template_copy_requests(drive, templates, opdir, RunID):
+    return [('%s_%s' % (RunID, templatefile['title']),
+             drive.auth.service.files().copy(fileId=templatefile['id'],
+                                             body={"parents": [{"kind": "drive#fileLink", "id": opdir}],
+                                                   'title': '%s_%s' % (RunID, templatefile['title'])}))
+            for templatefile in templates]
 
 
 def copy_drive_templates(opdir, RunID, includedfiles):
@@ -78,25 +113,97 @@ def copy_drive_templates(opdir, RunID, includedfiles):
     :return: a referenced dictionary of files (title, Gdrive ID)
     """
     drive = get_drive_auth()
-    template_folder = lab_safeget(config.lab_vars, globals.get_lab(), 'template_folder')
-    file_template_list = drive.ListFile({'q': "'%s' in parents and trashed=false" % template_folder}).GetList()
-    for templatefile in file_template_list:
-            basename = templatefile['title']
-            if basename in includedfiles:
-                drive.auth.service.files().copy(fileId=templatefile['id'],
-                                                body={"parents": [{"kind": "drive#fileLink", "id": opdir}],
-                                                      'title': '%s_%s' % (RunID, basename)}).execute()
+    requests = _template_copy_requests(drive, template_files(includedfiles), opdir, RunID)
+    copies = execute_batch(drive, requests)
+    return {title: copy['id'] for (title, _), copy in zip(requests, copies)}
+
+
+def create_run_directories(RunID, targetfolder, includedfiles):
+    """Create the run folder in targetfolder, then its subfolders and template copies in one batch
 
-    newdir_list = drive.ListFile({'q': "'%s' in parents and trashed=false" % opdir}).GetList()
-    new_dict = {}
-    for file1 in newdir_list:
-        new_dict[file1['title']] = file1['id']
-    return new_dict
+    Subfolders are "<RunID>_subdata" and the lab's required_folders.
+
+    :return: a triple: (primary directory, secondary directory, dictionary of template files)
+    """
+    drive = get_drive_auth()
+    templates = template_files(includedfiles)
+    PriDir = create_drive_folder(RunID, targetfolder)
+
+    secfold_name = "%s_subdata" % RunID
+    folders = [secfold_name] + list(lab_safeget(config.lab_vars, globals.get_lab(), 'required_folders') or [])
+    requests = [(folder, drive.auth.service.files().insert(body=_folder_metadata(folder, PriDir)))
+                for folder in folders]
+    copy_requests = _template_copy_requests(drive, templates, PriDir, RunID)
+    responses = execute_batch(drive, requests + copy_requests)
+    for folder in folders:
+        print("Directory Created: " + "%s" % folder)
+
+    file_dict = {title: copy['id'] for (title, _), copy in zip(copy_requests, responses[len(folders):])}
+    return PriDir, responses[0]['id'], file_dict
+
+
+def _retry(func, *args, **kwargs):
+    """func(*args, **kwargs), called again (with backoff) on failure up to config.upload_retries attempts"""
+    return retry_call(func, fargs=args, fkwargs=kwargs, tries=max(1, config.upload_retries), delay=1, backoff=2,
+                      logger=modlog)
+
+
+def find_file(drive, title, parent, http=None):
+    """id of the file titled title in the Drive folder parent, None if there is none"""
+    query = "'%s' in parents and title = '%s' and trashed = false" % (parent, title.replace("'", "\\'"))
+    found = drive.auth.service.files().list(q=query, fields='items(id)').execute(http=http)
+    items = found.get('items', [])
+    return items[0]['id'] if items else None
+
+
+def upload_file(drive, path, parent, title=None):
+    """Upload the local file path into the Drive folder parent
+
+    Thread safe (every call uses its own HTTP connection).  Files above config.upload_chunksize are sent
+    as resumable uploads: a failed chunk is retried and the upload resumes from the last chunk received.
+    Smaller files are uploaded again after a failure unless a file of that title has appeared in parent
+    meanwhile (the failed attempt went through, its response did not).
+
+    :param title: title of the Drive file, the file name by default
+    :return: id of the new file
+    """
+    title = title or os.path.basename(path)
+    metadata = {'title': title, "parents": [{"kind": "drive#fileLink", "id": parent}]}
+    http = drive.auth.Get_Http_Object()
+    with trace.span('drive upload', 'google', title=title):
+        if os.path.getsize(path) <= config.upload_chunksize:
+            outfile = drive.CreateFile(metadata)
+            outfile.SetContentFile(path)
+            attempts = []
+
+            def upload():
+                # an attempt whose response was lost may still have created the file
+                if attempts:
+                    existing = find_file(drive, title, parent, http)
+                    if existing is not None:
+                        return existing
+                attempts.append(1)
+                # Upload takes the http out of param, every attempt needs its own dict
+                outfile.Upload(param={'http': http})
+                return outfile['id']
+            return _retry(upload)
+
+        media = MediaFileUpload(path, chunksize=config.upload_chunksize, resumable=True)
+        request = drive.auth.service.files().insert(body=metadata, media_body=media)
+        response = None
+        while response is None:
+            status, response = _retry(request.next_chunk, http=http)
+            if status is not None:
+                modlog.debug('%s: %d%% uploaded' % (title, status.progress() * 100))
+        return response['id']
 
 
 def upload_files_to_gdrive(opdir, secdir, secfilelist, filelist, runID, eclogfile):
     """Upload files to Google Drive
 
+    Files are uploaded side by side (config.upload_workers at once), the log file goes last once
+    everything else is in.  The folders must exist, see create_run_directories.
+
     :param opdir: main google drive directory to upload to
     :param secdir: subdirectory in opdir in which logfiles and executables are written
     :param secfilelist: files to be written to secdir
@@ -107,36 +214,25 @@ def upload_files_to_gdrive(opdir, secdir, secfilelist, filelist, runID, eclogfil
     """
     drive = get_drive_auth()
 
-    for file in filelist:
-        outfile = drive.CreateFile({"parents": [{"kind": "drive#fileLink", "id": opdir}]})
-        outfile.SetContentFile(file)
-        outfile['title'] = file.split('/')[1]
-        outfile.Upload()
-
-    #  Data files that need to be stored but are not crucial for performers
-    for secfile in secfilelist:
-        outfile = drive.CreateFile({"parents": [{"kind": "drive#fileLink", "id": secdir}]})
-        outfile.SetContentFile(secfile)
-        outfile['title'] = secfile.split('/')[1]
-        outfile.Upload()
-
-    requested_folders = lab_safeget(config.lab_vars, globals.get_lab(), 'required_folders')
-    if requested_folders:
-        for folder in requested_folders:
-            create_drive_folder(folder, opdir)
-
-    logfile = drive.CreateFile({"parents": [{"kind": "drive#fileLink", "id": opdir}]})
-    logfile.SetContentFile(eclogfile)
-    logfile['title'] = '%s.log' % runID
-    logfile.Upload()
+    #  secondary files: data files that need to be stored but are not crucial for performers
+    uploads = [(file, opdir) for file in filelist] + [(secfile, secdir) for secfile in secfilelist]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, config.upload_workers)) as executor:
+        futures = [executor.submit(upload_file, drive, file, parent, file.split('/')[1])
+                   for file, parent in uploads]
+        # every file must be in before the log is
+        for future in futures:
+            future.result()
+
     wdir = drive.CreateFile({'id': opdir})
     swdir = drive.CreateFile({'id': secdir})
-    modlog.info('%s successfully uploaded to %s' % (logfile['title'], swdir['title']))
-
     for item in filelist:
         modlog.info('%s successfully uploaded to %s' % (item, wdir['title']))
     for item in secfilelist:
         modlog.info('%s successfully uploaded to %s' % (item, swdir['title']))
+
+    logtitle = '%s.log' % runID
+    modlog.info('%s uploading to %s' % (logtitle, wdir['title']))
+    upload_file(drive, eclogfile, opdir, logtitle)
     print('File Upload Complete')
 
 
@@ -148,12 +244,7 @@ def create_drive_directories(rxndict, targetfolder, includedfiles):
     :param includedfiles: gdrive template files to copy from grdive template directory
     :return: a triple: (primary directory, secondary directory, dictionary of template files)
     """
-    tgt_folder_id = targetfolder
-    PriDir = googleio.create_drive_folder(rxndict['RunID'], tgt_folder_id)
-    file_dict = googleio.copy_drive_templates(PriDir, rxndict['RunID'], includedfiles)
-    secfold_name = "%s_subdata" % rxndict['RunID']
-    secdir = googleio.create_drive_folder(secfold_name, PriDir)
-    return PriDir, secdir, file_dict
+    return googleio.create_run_directories(rxndict['RunID'], targetfolder, includedfiles)
 
 
 def get_uid_by_name(file_dict, name_pat):
@@ -174,16 +265,11 @@ def get_uid_by_name(file_dict, name_pat):
     raise ValueError('Could not find {} in file_dict.keys'.format(name_pat))
 
 def get_gdrive_client():
-    scope = ['https://spreadsheets.google.com/feeds']
-    credentials = ServiceAccountCredentials.from_json_keyfile_name('creds.json', scope)
-    gc = gspread.authorize(credentials)
-    return gc
+    """Sheets client shared by the whole run, see clients.GoogleClients.sheets"""
+    return clients.sheets()
 
 
 def upload_cp_files_to_drive(uploadlist, secfilelist, runID, logfile, targetfolder):
     tgt_folder_id = targetfolder
-    PriDir = googleio.create_drive_folder(runID, tgt_folder_id)
-    googleio.copy_drive_templates(PriDir, runID, []) # copies metadata from current template (leaves the rest)
-    secfold_name = "%s_subdata" %runID
-    secdir = googleio.create_drive_folder(secfold_name, PriDir)
+    PriDir, secdir, _ = googleio.create_run_directories(runID, tgt_folder_id, [])
     googleio.upload_files_to_gdrive(PriDir, secdir, secfilelist, uploadlist, runID, logfile)
\ No newline at end of file
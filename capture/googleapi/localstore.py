@@ -0,0 +1,485 @@
+"""Local stand-in for Google Drive and Google Sheets
+
+LocalStore keeps Drive folders, files and spreadsheets in memory and answers the subset of the PyDrive
+(GoogleDrive, GoogleDriveFile) and gspread (Client, Spreadsheet, Worksheet) calls the pipeline makes.
+Every call that would be an HTTP request to Google counts as one round trip in LocalStore.calls and waits
+LocalStore.latency seconds, so the upload paths of specify.datapipeline (--debug 0 and 1) can be run,
+timed and their requests counted without credentials or quota.
+
+Select it with devconfig.storage_backend = 'local': the shared clients (googleapi.clients, behind
+googleio.get_drive_auth and googleio.get_gdrive_client) are then the drive and sheets client of the
+process wide store().  Uploaded files are copied below
+devconfig.local_storage_dir (mirroring the Drive folder titles) when it is set.  The chemical and reagent
+inventories still come from the chemdf.csv / reagentdf.csv copies a --debug 1 run leaves behind.
+"""
+import collections
+import itertools
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from gspread.utils import a1_to_rowcol
+
+import capture.devconfig as config
+from utils import globals
+from utils.globals import lab_safeget
+
+modlog = logging.getLogger('capture.googleapi.localstore')
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+SPREADSHEET_MIMETYPE = 'application/vnd.google-apps.spreadsheet'
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+class LocalStore:
+    """In-memory Drive and Sheets
+
+    :param root: directory the uploaded files are copied to, None keeps only their metadata
+    :param latency: seconds every round trip takes
+    """
+
+    def __init__(self, root=None, latency=0.):
+        self.root = root
+        self.latency = latency
+        self.files = {}
+        self.spreadsheets = {}
+        self.calls = collections.Counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def request(self, operation):
+        """Count one round trip of operation (e.g. 'drive.files.list') and wait out the latency"""
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def report(self):
+        """Round trips per operation as text"""
+        lines = ['%s round trips to the local storage backend' % self.round_trips]
+        lines.extend('  %-32s %6d' % (operation, count) for operation, count in sorted(self.calls.items()))
+        return '\n'.join(lines)
+
+    def new_id(self):
+        with self._lock:
+            return 'local-%06d' % next(self._ids)
+
+    def add_file(self, title, parent=None, mimeType=None, id=None, content=None, data=None):
+        """Register a file (no round trip) and return its metadata
+
+        :param content: local path of the file content, copied below root
+        :param data: content of the file as bytes, written below root
+        """
+        id = id or self.new_id()
+        metadata = {'id': id, 'title': title, 'mimeType': mimeType or 'application/octet-stream',
+                    'parents': [{'kind': 'drive#fileLink', 'id': parent}] if parent else [],
+                    'labels': {'trashed': False}}
+        if parent and parent not in self.files:
+            # folders created elsewhere (the lab's remote folders) exist as soon as they are used
+            self.add_file(parent, mimeType=FOLDER_MIMETYPE, id=parent)
+        if content is not None:
+            metadata['fileSize'] = str(os.path.getsize(content))
+            metadata['localPath'] = self._keep(content, metadata)
+        if data is not None:
+            metadata['fileSize'] = str(len(data))
+            metadata['localPath'] = self._keep(None, metadata, data)
+        if metadata['mimeType'] == SPREADSHEET_MIMETYPE:
+            self.spreadsheets.setdefault(id, LocalSpreadsheet(self, id, title))
+        self.files[id] = metadata
+        return metadata
+
+    def add_folder(self, title, parent=None, id=None):
+        return self.add_file(title, parent, FOLDER_MIMETYPE, id)
+
+    def children(self, folder_id):
+        return [metadata for metadata in self.files.values()
+                if any(parent['id'] == folder_id for parent in metadata['parents'])
+                and not metadata['labels']['trashed']]
+
+    def path(self, file_id):
+        """Titles of the folders leading to file_id and its own title"""
+        titles = []
+        while file_id in self.files:
+            metadata = self.files[file_id]
+            titles.append(metadata['title'])
+            file_id = metadata['parents'][0]['id'] if metadata['parents'] else None
+        return list(reversed(titles))
+
+    def _keep(self, content, metadata, data=None):
+        if self.root is None:
+            return content
+        parents = self.path(metadata['parents'][0]['id']) if metadata['parents'] else []
+        target = os.path.join(self.root, *(parents + [metadata['title']]))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if data is None:
+            shutil.copyfile(content, target)
+        else:
+            with open(target, 'wb') as f:
+                f.write(data)
+        return target
+
+    def copy(self, file_id, title, parent):
+        """Copy of a file (and of its cells for a spreadsheet) into parent"""
+        source = self.files[file_id]
+        metadata = self.add_file(title, parent, source['mimeType'])
+        if file_id in self.spreadsheets:
+            self.spreadsheets[metadata['id']] = self.spreadsheets[file_id].copy(metadata['id'], title)
+        return metadata
+
+    def seed_templates(self, folder_id, titles):
+        """Template folder holding titles, spreadsheets for the titles without an extension"""
+        self.add_folder('templates', id=folder_id)
+        present = set(metadata['title'] for metadata in self.children(folder_id))
+        for title in titles:
+            if title not in present:
+                self.add_file(title, folder_id, None if os.path.splitext(title)[1] else SPREADSHEET_MIMETYPE)
+
+    def drive(self):
+        return LocalDrive(self)
+
+    def sheets(self):
+        return LocalSheetsClient(self)
+
+
+class LocalDrive:
+    """PyDrive GoogleDrive lookalike"""
+
+    def __init__(self, store):
+        self.store = store
+        self.auth = _LocalAuth(store)
+
+    def CreateFile(self, metadata=None):
+        return LocalDriveFile(self.store, metadata)
+
+    def ListFile(self, param=None):
+        return _LocalFileList(self.store, (param or {}).get('q', ''))
+
+
+class LocalDriveFile(dict):
+    """PyDrive GoogleDriveFile lookalike, metadata of files with an id is fetched on first access"""
+
+    def __init__(self, store, metadata=None):
+        dict.__init__(self, metadata or {})
+        self.store = store
+        self.content_path = None
+
+    def SetContentFile(self, filename):
+        self.content_path = filename
+
+    def Upload(self, param=None):
+        if 'id' in self and self['id'] in self.store.files:
+            self.store.request('drive.files.update')
+            self.store.files[self['id']].update((key, value) for key, value in self.items() if key != 'id')
+        else:
+            self.store.request('drive.files.insert')
+            parent = self['parents'][0]['id'] if self.get('parents') else None
+            metadata = self.store.add_file(self.get('title', 'Untitled'), parent, self.get('mimeType'),
+                                           content=self.content_path)
+            self.update(metadata)
+
+    def FetchMetadata(self):
+        self.store.request('drive.files.get')
+        self.update(self.store.files[dict.__getitem__(self, 'id')])
+
+    def __missing__(self, key):
+        if 'id' in self and dict.__getitem__(self, 'id') in self.store.files:
+            self.FetchMetadata()
+            if key in self:
+                return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+
+class _LocalFileList:
+    """Result of LocalDrive.ListFile, understands "'<folder id>' in parents" queries"""
+
+    def __init__(self, store, query):
+        self.store = store
+        self.query = query
+
+    def GetList(self):
+        self.store.request('drive.files.list')
+        match = re.search(r"'([^']+)' in parents", self.query)
+        found = self.store.children(match.group(1)) if match else list(self.store.files.values())
+        return [LocalDriveFile(self.store, metadata) for metadata in found]
+
+
+class _LocalAuth:
+    """drive.auth.service as used for copies, batches and resumable uploads"""
+
+    def __init__(self, store):
+        self.service = self
+        self.store = store
+
+    def files(self):
+        return _LocalFilesResource(self.store)
+
+    def new_batch_http_request(self, callback=None):
+        return _LocalBatch(self.store, callback)
+
+    def Get_Http_Object(self):
+        """No connections to keep apart, every thread shares the store"""
+        return None
+
+
+class _LocalFilesResource:
+
+    def __init__(self, store):
+        self.store = store
+
+    def copy(self, fileId, body):
+        return _LocalRequest(self.store, 'drive.files.copy',
+                             lambda: self.store.copy(fileId, body.get('title'), body['parents'][0]['id']))
+
+    def list(self, q='', fields=None):
+        store = self.store
+
+        def run():
+            parent = re.search(r"'([^']+)' in parents", q)
+            title = re.search(r"title = '((?:[^'\\]|\\.)*)'", q)
+            found = store.children(parent.group(1)) if parent else list(store.files.values())
+            if title:
+                found = [metadata for metadata in found if metadata['title'] == title.group(1).replace("\\'", "'")]
+            return {'items': [dict(metadata) for metadata in found]}
+        return _LocalRequest(store, 'drive.files.list', run)
+
+    def insert(self, body, media_body=None):
+        if media_body is not None:
+            return _LocalResumableRequest(self.store, body, media_body)
+        parent = body['parents'][0]['id'] if body.get('parents') else None
+        return _LocalRequest(self.store, 'drive.files.insert',
+                             lambda: dict(self.store.add_file(body.get('title', 'Untitled'), parent,
+                                                              body.get('mimeType'))))
+
+
+class _LocalResumableRequest:
+    """Resumable upload of a googleapiclient MediaUpload, one round trip per chunk like HttpRequest.next_chunk"""
+
+    def __init__(self, store, body, media):
+        self.store = store
+        self.body = body
+        self.media = media
+        self.received = b''
+
+    def next_chunk(self, http=None, num_retries=0):
+        self.store.request('drive.files.insert.chunk')
+        total = self.media.size()
+        self.received += self.media.getbytes(len(self.received), self.media.chunksize())
+        if len(self.received) < total:
+            return _LocalUploadProgress(len(self.received), total), None
+        parent = self.body['parents'][0]['id'] if self.body.get('parents') else None
+        return None, dict(self.store.add_file(self.body.get('title', 'Untitled'), parent, self.body.get('mimeType'),
+                                              data=self.received))
+
+
+class _LocalUploadProgress:
+
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return float(self.resumable_progress) / self.total_size
+
+
+class _LocalRequest:
+    """googleapiclient HttpRequest lookalike, run answers it without counting a round trip"""
+
+    def __init__(self, store, operation, run):
+        self.store = store
+        self.operation = operation
+        self.run = run
+
+    def execute(self, http=None, num_retries=0):
+        self.store.request(self.operation)
+        return self.run()
+
+
+class _LocalBatch:
+    """googleapiclient BatchHttpRequest lookalike, all requests added cost one round trip"""
+
+    def __init__(self, store, callback=None):
+        self.store = store
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((str(len(self.requests)) if request_id is None else request_id, request, callback))
+
+    def execute(self, http=None):
+        self.store.request('drive.batch')
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = request.run(), None
+            except Exception as error:
+                response, exception = None, error
+            for notify in (callback, self.callback):
+                if notify is not None:
+                    notify(request_id, response, exception)
+
+
+class LocalSheetsClient:
+    """gspread Client lookalike"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_by_key(self, key):
+        self.store.request('sheets.spreadsheets.get')
+        if key not in self.store.spreadsheets:
+            raise KeyError('No spreadsheet with id %s in the local store' % key)
+        return self.store.spreadsheets[key]
+
+
+class LocalCell:
+    """gspread Cell lookalike"""
+
+    def __init__(self, row, col, value=''):
+        self.row = row
+        self.col = col
+        self.value = value
+
+    def __repr__(self):
+        return '<LocalCell R%sC%s %r>' % (self.row, self.col, self.value)
+
+
+class LocalSpreadsheet:
+    """gspread Spreadsheet lookalike"""
+
+    def __init__(self, store, id, title, nsheets=2):
+        self.store = store
+        self.id = id
+        self.title = title
+        self._worksheets = [LocalWorksheet(self, 'Sheet%s' % (i + 1)) for i in range(nsheets)]
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def get_worksheet(self, index):
+        return self._worksheets[index]
+
+    def worksheets(self):
+        return list(self._worksheets)
+
+    def _locate(self, name):
+        """(worksheet, A1 range) of a range name, the first worksheet when it has no sheet title"""
+        if '!' not in name:
+            return self.sheet1, name
+        title, a1 = name.rsplit('!', 1)
+        title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+        return next(worksheet for worksheet in self._worksheets if worksheet.title == title), a1
+
+    def values_batch_get(self, ranges, params=None):
+        self.store.request('sheets.values.batchGet')
+        valueranges = []
+        for name in ranges:
+            worksheet, a1 = self._locate(name)
+            (startrow, startcol), (stoprow, stopcol) = worksheet.bounds(a1)
+            rows = [[worksheet._value(row, col) for col in range(startcol, stopcol + 1)]
+                    for row in range(startrow, stoprow + 1)]
+            # like the API, trailing empty cells and rows are left out
+            rows = [row[:max([i + 1 for i, value in enumerate(row) if value != ''] + [0])] for row in rows]
+            while rows and not rows[-1]:
+                rows.pop()
+            valueranges.append({'range': name, 'majorDimension': 'ROWS', 'values': rows} if rows
+                               else {'range': name, 'majorDimension': 'ROWS'})
+        return {'spreadsheetId': self.id, 'valueRanges': valueranges}
+
+    def values_batch_update(self, body):
+        self.store.request('sheets.values.batchUpdate')
+        for data in body['data']:
+            worksheet, a1 = self._locate(data['range'])
+            (startrow, startcol), _ = worksheet.bounds(a1)
+            for i, values in enumerate(data['values']):
+                for j, value in enumerate(values):
+                    worksheet._set(startrow + i, startcol + j, value)
+        return {'spreadsheetId': self.id, 'totalUpdatedCells': sum(len(data['values']) for data in body['data'])}
+
+    def copy(self, id, title):
+        duplicate = LocalSpreadsheet(self.store, id, title, len(self._worksheets))
+        for source, target in zip(self._worksheets, duplicate._worksheets):
+            target.cells = dict(source.cells)
+        return duplicate
+
+
+class LocalWorksheet:
+    """gspread Worksheet lookalike, values are kept as the strings Sheets would return"""
+
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.store = spreadsheet.store
+        self.title = title
+        self.cells = {}
+
+    def _value(self, row, col):
+        return self.cells.get((row, col), '')
+
+    def _set(self, row, col, value):
+        self.cells[(row, col)] = '' if value is None else str(value)
+
+    def cell(self, row, col):
+        self.store.request('sheets.values.get')
+        return LocalCell(row, col, self._value(row, col))
+
+    def acell(self, label):
+        return self.cell(*a1_to_rowcol(label))
+
+    def update_cell(self, row, col, value):
+        self.store.request('sheets.values.update')
+        self._set(row, col, value)
+
+    def update_acell(self, label, value):
+        self.update_cell(*(a1_to_rowcol(label) + (value,)))
+
+    def bounds(self, name):
+        """((first row, first column), (last row, last column)) of an A1 range or cell"""
+        labels = name.split(':')
+        return a1_to_rowcol(labels[0]), a1_to_rowcol(labels[-1])
+
+    def range(self, name):
+        self.store.request('sheets.values.get')
+        (startrow, startcol), (stoprow, stopcol) = self.bounds(name)
+        return [LocalCell(row, col, self._value(row, col))
+                for row in range(startrow, stoprow + 1) for col in range(startcol, stopcol + 1)]
+
+    def update_cells(self, cell_list, value_input_option='RAW'):
+        self.store.request('sheets.values.update')
+        for cell in cell_list:
+            self._set(cell.row, cell.col, cell.value)
+
+    def get_all_values(self):
+        self.store.request('sheets.values.get')
+        if not self.cells:
+            return []
+        nrows = max(row for row, _ in self.cells)
+        ncols = max(col for _, col in self.cells)
+        return [[self._value(row, col) for col in range(1, ncols + 1)] for row in range(1, nrows + 1)]
+
+
+def store():
+    """Process wide LocalStore set up from devconfig, with the template folder of the lab in it"""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = LocalStore(config.local_storage_dir, config.local_storage_latency)
+            lab = globals.get_lab()
+            _STORE.seed_templates(lab_safeget(config.lab_vars, lab, 'template_folder'),
+                                  lab_safeget(config.lab_vars, lab, 'required_files'))
+            modlog.info('Using the local storage backend (latency %ss per round trip)' % _STORE.latency)
+        return _STORE
+
+
+def reset():
+    """Drop the process wide store, the next store() starts empty"""
+    global _STORE
+    with _STORE_LOCK:
+        _STORE = None
@@ -0,0 +1,127 @@
+"""Batched reads and writes of a Google Sheets worksheet
+
+gspread's acell / update_acell / range / update_cells each cost an HTTP round trip.  SheetBatch reads any
+number of cells with a single values:batchGet request and collects writes until flush sends them all with a
+single values:batchUpdate request:
+
+    batch = SheetBatch(sheet)
+    title, = batch.read(['C1'])
+    batch.set('C1', title.replace('<Reagent>', 'Precursor'))
+    batch.set_block('D3', [[80, 450, 3600], [70, 400, 1800]])
+    batch.flush()
+
+Writes use the batch's value input option: USER_ENTERED (the default) parses the values as if typed into
+the sheet, as update_acell does; RAW stores them as given, as update_cells does.  A write can carry its own
+option, flush then sends one request per option used.  ROUND_TRIPS counts the requests made by every batch
+of the process.
+"""
+import collections
+import logging
+import math
+
+import numpy as np
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+from log import trace
+
+modlog = logging.getLogger('capture.googleapi.sheetbatch')
+
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets/%s'
+
+ROUND_TRIPS = collections.Counter()
+
+
+def _json_value(value):
+    """Cell value as something the Sheets API accepts: numpy scalars as python ones, missing values blank"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return value
+
+
+def values_batch_get(spreadsheet, ranges):
+    """values:batchGet of ranges (A1 notation with sheet title), the API response as a dict"""
+    ROUND_TRIPS['values.batchGet'] += 1
+    with trace.span('sheets values.batchGet', 'google', ranges=len(ranges)):
+        if hasattr(spreadsheet, 'values_batch_get'):
+            return spreadsheet.values_batch_get(ranges)
+        response = spreadsheet.client.request('get', SHEETS_API_URL % spreadsheet.id + '/values:batchGet',
+                                              params={'ranges': ranges, 'majorDimension': 'ROWS'})
+        return response.json()
+
+
+def values_batch_update(spreadsheet, body):
+    """values:batchUpdate with body ({'valueInputOption': ..., 'data': [{'range': ..., 'values': ...}]})"""
+    ROUND_TRIPS['values.batchUpdate'] += 1
+    with trace.span('sheets values.batchUpdate', 'google', ranges=len(body['data'])):
+        if hasattr(spreadsheet, 'values_batch_update'):
+            return spreadsheet.values_batch_update(body)
+        response = spreadsheet.client.request('post', SHEETS_API_URL % spreadsheet.id + '/values:batchUpdate',
+                                              json=body)
+        return response.json()
+
+
+class SheetBatch:
+    """Reads and pending writes of one worksheet
+
+    :param worksheet: gspread Worksheet (or googleapi.localstore.LocalWorksheet)
+    :param value_input_option: 'USER_ENTERED' or 'RAW', for the writes that do not name one
+    """
+
+    def __init__(self, worksheet, value_input_option='USER_ENTERED'):
+        self.worksheet = worksheet
+        self.spreadsheet = worksheet.spreadsheet
+        self.value_input_option = value_input_option
+        self.pending = []
+        self.round_trips = 0
+
+    def _range(self, name):
+        return "'%s'!%s" % (self.worksheet.title.replace("'", "''"), name)
+
+    def read(self, labels):
+        """Current values ('' when empty) of the cells labels (A1 notation), in one request"""
+        if not labels:
+            return []
+        response = values_batch_get(self.spreadsheet, [self._range(label) for label in labels])
+        self.round_trips += 1
+        values = []
+        for valuerange in response.get('valueRanges', []):
+            rows = valuerange.get('values', [])
+            values.append(rows[0][0] if rows and rows[0] else '')
+        return values
+
+    def set(self, label, value, value_input_option=None):
+        """Write value to the cell label on flush"""
+        self.set_block(label, [[value]], value_input_option)
+
+    def set_block(self, label, rows, value_input_option=None):
+        """Write the 2-D list rows with its top left value at label on flush"""
+        rows = [[_json_value(value) for value in row] for row in rows]
+        if not rows or not rows[0]:
+            return
+        row, col = a1_to_rowcol(label)
+        end = rowcol_to_a1(row + len(rows) - 1, col + max(len(values) for values in rows) - 1)
+        self.pending.append((value_input_option or self.value_input_option,
+                             {'range': self._range('%s:%s' % (label, end)), 'values': rows}))
+
+    def set_column(self, col, start_row, values, value_input_option=None):
+        """Write values down column col (letters) from start_row on flush"""
+        self.set_block('%s%s' % (col, start_row), [[value] for value in values], value_input_option)
+
+    def flush(self):
+        """Send the pending writes, one request per value input option"""
+        if not self.pending:
+            return
+        options = []
+        for option, _ in self.pending:
+            if option not in options:
+                options.append(option)
+        for option in options:
+            data = [write for writeoption, write in self.pending if writeoption == option]
+            ncells = sum(len(values) for write in data for values in write['values'])
+            values_batch_update(self.spreadsheet, {'valueInputOption': option, 'data': data})
+            self.round_trips += 1
+            modlog.info('%s ranges (%s cells, %s) written to %s in one request, %s round trips for this sheet'
+                        % (len(data), ncells, option, self.worksheet.title, self.round_trips))
+        self.pending = []
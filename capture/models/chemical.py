@@ -2,9 +2,8 @@ import pandas as pd
 import logging
 import os
 
-import gspread
 from capture.googleapi import googleio
-from oauth2client.service_account import ServiceAccountCredentials
+from log import trace
 
 
 modlog = logging.getLogger('capture.chemicalmodels')
@@ -24,13 +23,12 @@ def build_chemdf(chemsheetid, chemsheetworkbook, debug_bool):
     if not os.path.exists('chemdf.csv'):
         print('Obtaining chemical information from Google Drive... \n', end='')
         modlog.info('Obtaining chemical information from Google Drive...')
-        scope = ['https://spreadsheets.google.com/feeds']
-        credentials = ServiceAccountCredentials.from_json_keyfile_name('creds.json', scope) 
-        gc = gspread.authorize(credentials)
+        with trace.span('chemical inventory read', 'google'):
+            gc = googleio.get_gdrive_client()
 
-        ChemicalBook = gc.open_by_key(chemsheetid)
-        chemicalsheet = ChemicalBook.get_worksheet(chemsheetworkbook)
-        chemical_list = chemicalsheet.get_all_values()
+            ChemicalBook = gc.open_by_key(chemsheetid)
+            chemicalsheet = ChemicalBook.get_worksheet(chemsheetworkbook)
+            chemical_list = chemicalsheet.get_all_values()
 
         chemdf = pd.DataFrame(chemical_list, columns=chemical_list[0])
         chemdf = chemdf.iloc[1:]
@@ -1,11 +1,11 @@
 import logging
+import numpy as np
 import pandas as pd
 import os
 import re
 
-import gspread
 from capture.googleapi import googleio
-from oauth2client.service_account import ServiceAccountCredentials
+from log import trace
 
 from utils.data_handling import get_used_reagent_nums
 
@@ -24,14 +24,13 @@ def build_reagentdf(reagsheetid, reagsheetworkbook, debug_bool):
         print('Obtaining reagent information from Google Drive... \n', end='')
         modlog.info('Obtaining reagent information from Google Drive...')
 
-        scope = ['https://spreadsheets.google.com/feeds']
-        credentials = ServiceAccountCredentials.from_json_keyfile_name('creds.json', scope) 
-        gc = gspread.authorize(credentials)
+        with trace.span('reagent inventory read', 'google'):
+            gc = googleio.get_gdrive_client()
 
-        # open sheet, or book? todo notice the inconsistencies in nomenclature here
-        ReagentBook = gc.open_by_key(reagsheetid)
-        reagentsheet = ReagentBook.get_worksheet(reagsheetworkbook)
-        reagent_list = reagentsheet.get_all_values()
+            # open sheet, or book? todo notice the inconsistencies in nomenclature here
+            ReagentBook = gc.open_by_key(reagsheetid)
+            reagentsheet = ReagentBook.get_worksheet(reagsheetworkbook)
+            reagent_list = reagentsheet.get_all_values()
 
         # Parse sheet to df
         reagdf = pd.DataFrame(reagent_list, columns=reagent_list[0])
@@ -355,3 +354,124 @@ class perovskitereagent:
                 except Exception:
                     pass
         return(concdict)
+
+
+class CompactReagent:
+    """Array backed, read-only view of a perovskitereagent
+
+    Concentrations are held as an array aligned with self.chemicals (0 for chemicals without a concentration)
+    instead of the 'conc_item<i>' keyed dict, the dict style attributes are rebuilt on access for the code
+    that still expects them.
+
+    :param reagent: perovskitereagent
+    """
+    __slots__ = ('name', 'chemicals', 'concentrations', 'hasconc', 'solvent_list', 'solventnum', 'ispurebool')
+
+    def __init__(self, reagent):
+        self.name = reagent.name
+        self.chemicals = list(reagent.chemicals)
+        self.concentrations = np.zeros(len(self.chemicals))
+        self.hasconc = np.zeros(len(self.chemicals), dtype=bool)
+        for item_i, conc in reagent.concs.items():
+            position = int(item_i.split('m')[1]) - 1
+            self.concentrations[position] = conc
+            self.hasconc[position] = True
+        self.solvent_list = reagent.solvent_list
+        self.solventnum = reagent.solventnum
+        self.ispurebool = reagent.ispurebool
+
+    @property
+    def concs(self):
+        """{conc_item<i>: concentration}, as perovskitereagent.concs"""
+        return {'conc_item%s' % (position + 1): conc
+                for position, (conc, present) in enumerate(zip(self.concentrations, self.hasconc)) if present}
+
+    @property
+    def component_dict(self):
+        """{chemical name: concentration} of the chemicals that are not solvents, as perovskitereagent.component_dict"""
+        return {chemical: conc for chemical, conc, present in zip(self.chemicals, self.concentrations, self.hasconc)
+                if present and chemical not in self.solvent_list}
+
+    def __repr__(self):
+        return 'CompactReagent(%s, %s)' % (self.name, dict(zip(self.chemicals, self.concentrations.tolist())))
+
+
+class ReagentSet:
+    """All reagents of a run with one chemical index and a contiguous (reagents x chemicals) concentration matrix
+
+    Gives samplers and calcs concentration vectors without going through the 'conc_item<i>' keys.
+    Rows follow the order of the reagents given, columns the order in which chemicals first appear
+    (as chemical.exp_chem_list).
+
+    :param reagents: {reagent number: perovskitereagent} (rdict) or a list of perovskitereagent
+    """
+
+    def __init__(self, reagents):
+        if isinstance(reagents, dict):
+            # rdict keys name the reagents, one reagent may stand in for another (the LBL reagent 6/7 hotfix)
+            names = [str(name) for name in reagents]
+            reagents = list(reagents.values())
+        else:
+            names = [str(reagent.name) for reagent in reagents]
+        self.reagents = [reagent if isinstance(reagent, CompactReagent) else CompactReagent(reagent)
+                         for reagent in reagents]
+        self.names = names
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.chemicals = []
+        for reagent in self.reagents:
+            for chemical in reagent.chemicals:
+                if chemical not in self.chemicals:
+                    self.chemicals.append(chemical)
+        self.index = {chemical: column for column, chemical in enumerate(self.chemicals)}
+        self.matrix = np.zeros((len(self.reagents), len(self.chemicals)))
+        solvents = set()
+        for row, reagent in enumerate(self.reagents):
+            columns = [self.index[chemical] for chemical in reagent.chemicals]
+            np.add.at(self.matrix[row], columns, reagent.concentrations)
+            solvents.update(reagent.solvent_list)
+        self.solvent_mask = np.array([chemical in solvents for chemical in self.chemicals], dtype=bool)
+
+    def __len__(self):
+        return len(self.reagents)
+
+    def __getitem__(self, name):
+        return self.reagents[self.rows[str(name)]]
+
+    def columns(self, chemicals):
+        """Column indices of chemicals in the matrix"""
+        return [self.index[chemical] for chemical in chemicals]
+
+    def vector(self, name, chemicals=None):
+        """Concentrations of one reagent, over all chemicals of the set or over the given chemicals"""
+        row = self.matrix[self.rows[str(name)]]
+        return row if chemicals is None else row[self.columns(chemicals)]
+
+    def vectors(self, names=None, chemicals=None, drop_solvents=False):
+        """(reagents x chemicals) concentrations of the given reagents (all by default)
+
+        :param chemicals: columns to return, all chemicals of the set by default
+        :param drop_solvents: leave out the solvent columns
+        """
+        matrix = self.matrix if names is None else self.matrix[[self.rows[str(name)] for name in names]]
+        if chemicals is not None:
+            return matrix[:, self.columns(chemicals)]
+        if drop_solvents:
+            return matrix[:, ~self.solvent_mask]
+        return matrix
+
+    @property
+    def solutes(self):
+        """Chemicals of the set that are not solvents"""
+        return [chemical for chemical, solvent in zip(self.chemicals, self.solvent_mask) if not solvent]
+
+    def reagent_vectors(self, chemicals):
+        """{'Reagent<i> (ul)': [concentration of each of chemicals]} with solvents counted as zero
+
+        Same as qrandom.build_reagent_vectors
+        """
+        solutes = np.where(self.solvent_mask, 0., self.matrix)
+        matrix = np.zeros((len(self.reagents), len(chemicals)))
+        for column, chemical in enumerate(chemicals):
+            if chemical in self.index:
+                matrix[:, column] = solutes[:, self.index[chemical]]
+        return {'Reagent{} (ul)'.format(name): matrix[row].tolist() for row, name in enumerate(self.names)}
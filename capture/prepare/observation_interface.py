@@ -1,106 +1,105 @@
-from utils.data_handling import build_experiment_names_df, update_sheet_column
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+from utils.data_handling import build_experiment_names_df
 from utils import globals
 import capture.devconfig as config
+from log import trace
+from capture.googleapi.sheetbatch import SheetBatch
 from capture.prepare.experiment_interface import MakeWellList, MakeWellList_WF3, MakeWellList_WF3_small
 from utils.globals import lab_safeget
 
-def upload_observation_interface_data(rxndict, vardict, gc, interface_uid):
-    """
 
-    :param gc:
-    :param interface_uid:
-    :return:
-    """
+def _column_index(letters):
+    return a1_to_rowcol('%s1' % letters)[1]
 
-    sheet = gc.open_by_key(interface_uid).sheet1
 
-    # todo: only build this once: we now read the manual spec sheet three times...
-    experiment_names = build_experiment_names_df(rxndict, vardict)
-#    experiment_index = range(1, len(experiment_names) + 1)
+def _column_letters(index):
+    return rowcol_to_a1(1, index)[:-1]
+
+
+def well_columns(rxndict):
+    """Well index, row letter, column number and well name columns of the observation interface
+
+    :return: {column letters: list of values from row 2}
+    """
     total_exp_entries = int(rxndict['wellcount'])
+    exp_counter = list(range(1, total_exp_entries+1)) # +1 to fix off by 1
     #TODO: organize code around workflow handling... at this moment moving to specify level seems appropriate
     # Maybe setting the variables for actions in dictionaries that can be created through some interface
     # TODO: This needs to be moved to a dict in the devconfig with clear configuration standards
-    uploadlist = []
     if rxndict['ExpWorkflowVer'] >= 3 and rxndict['ExpWorkflowVer'] < 4:
-        uploadtarget = sheet.range(f'A2:D{total_exp_entries+1}')
-
         df = MakeWellList_WF3_small("nothing", total_exp_entries)
+    elif globals.get_lab() == 'MIT_PVLab':
+        return {'A': exp_counter}
+    else:
+        df = MakeWellList("nothing", total_exp_entries)
 
-        exp_counter = list(range(1,total_exp_entries+1)) # +1 to fix off by 1
-        wellnamelist = df['Vial Site'].values.tolist()
-        letter_list = [x[:1] for x in wellnamelist]
-        number_list = [x[1:] for x in wellnamelist]
-
-        count = 0
-        while count < len(exp_counter):
-            uploadlist.append(exp_counter[count])
-            uploadlist.append(letter_list[count])
-            uploadlist.append(number_list[count])
-            uploadlist.append(wellnamelist[count])
-            count += 1
-
-        count = 0
-        for cell in uploadtarget:
-            try:
-                cell.value = uploadlist[count]
-                count += 1  
-            except:
-                count += 1
-        sheet.update_cells(uploadtarget)
+    wellnamelist = df['Vial Site'].values.tolist()[:total_exp_entries]
+    return {'A': exp_counter,
+            'B': [x[:1] for x in wellnamelist],
+            'C': [x[1:] for x in wellnamelist],
+            'D': wellnamelist}
 
-    else:
-        if globals.get_lab() == 'MIT_PVLab':
-            uploadtarget = sheet.range(f'A2:A{total_exp_entries+1}')
-            df = MakeWellList("nothing", total_exp_entries)
 
-            uploadlist = list(range(1,total_exp_entries+1)) # +1 to fix off by 1
+def model_columns(model_info_df):
+    """Model and participant uid columns of the observation interface, laid out per lab"""
+    observation_dict = lab_safeget(config.lab_vars, globals.get_lab(), 'observation_interface')
+    return {observation_dict['modeluid_col']: model_info_df['modelname'].values.tolist(),
+            observation_dict['participantuid_col']: model_info_df['participantname'].values.tolist()}
+
 
-            count = 0
-            for cell in uploadtarget:
-                try:
-                    cell.value = uploadlist[count]
-                    count += 1  
-                except:
-                    count += 1
-            sheet.update_cells(uploadtarget)
+def queue_columns(batch, columns, start_row=2):
+    """Queue a block of columns ({column letters: values}) in batch
 
+    Neighbouring columns of the same length go in one range, the columns in between (template content)
+    are left alone.
+    """
+    runs = []
+    for index in sorted(_column_index(letters) for letters in columns):
+        values = columns[_column_letters(index)]
+        if runs and runs[-1][0] + len(runs[-1][1]) == index and len(runs[-1][1][0]) == len(values):
+            runs[-1][1].append(values)
         else:
-            uploadtarget = sheet.range(f'A2:D{total_exp_entries+1}')
-
-            df = MakeWellList("nothing", total_exp_entries)
-
-            exp_counter = list(range(1,total_exp_entries+1)) # +1 to fix off by 1
-            wellnamelist = df['Vial Site'].values.tolist()
-            letter_list = [x[:1] for x in wellnamelist]
-            number_list = [x[1:] for x in wellnamelist]
-
-            count = 0
-            while count < len(exp_counter):
-                uploadlist.append(exp_counter[count])
-                uploadlist.append(letter_list[count])
-                uploadlist.append(number_list[count])
-                uploadlist.append(wellnamelist[count])
-                count += 1
-
-            count = 0
-            for cell in uploadtarget:
-                try:
-                    cell.value = uploadlist[count]
-                    count += 1  
-                except:
-                    count += 1
-            sheet.update_cells(uploadtarget)
+            runs.append((index, [values]))
+    for index, block in runs:
+        batch.set_block('%s%s' % (_column_letters(index), start_row), [list(row) for row in zip(*block)])
+
+
+@trace.traced(category='google')
+def upload_observation_interface_data(rxndict, vardict, gc, interface_uid, model_info_df=None):
+    """Write the well, experiment name (and model) columns of the observation interface in one request
+
+    :param gc: gspread client
+    :param interface_uid: google sheets observation UID
+    :param model_info_df: model information to write along, see upload_modelinfo_observation_interface
+    :return:
+    """
+
+    sheet = gc.open_by_key(interface_uid).sheet1
 
+    # todo: only build this once: we now read the manual spec sheet three times...
+    experiment_names = build_experiment_names_df(rxndict, vardict)
+
+    # later columns win where the lab layout places two in the same spot
     obs_columns = lab_safeget(config.lab_vars, globals.get_lab(), 'observation_interface')
-    update_sheet_column(sheet, data=experiment_names['Experiment Names'],
-                        col_index=obs_columns['uid_col'], start_row=2)
+    columns = well_columns(rxndict)
+    columns[obs_columns['uid_col']] = experiment_names['Experiment Names'].values.tolist()
+    if model_info_df is not None:
+        columns.update(model_columns(model_info_df))
+
+    # stored as given, as update_cells did: well numbers stay text, names are not parsed
+    batch = SheetBatch(sheet, value_input_option='RAW')
+    queue_columns(batch, columns)
+    batch.flush()
     return
 
 
+@trace.traced(category='google')
 def upload_modelinfo_observation_interface(model_info_df, gc, interface_uid):
     '''push the model information to the observation interface
 
+    Not needed when model_info_df was handed to upload_observation_interface_data
+
     :param model_info_df: 2xN data frame with 'modelname' and 'participantname' 
                           as columns and N being the total number of experiments
     :param interface_uid: google sheets observation UID 
@@ -108,13 +107,7 @@ def upload_modelinfo_observation_interface(model_info_df, gc, interface_uid):
     '''
     sheet = gc.open_by_key(interface_uid).sheet1
 
-    observation_dict = lab_safeget(config.lab_vars, globals.get_lab(), 'observation_interface')
-    modeluid_col = observation_dict['modeluid_col']
-    participantuid_col = observation_dict['participantuid_col']
-
-    update_sheet_column(sheet, data=model_info_df['modelname'],
-                        col_index=modeluid_col, start_row=2)
-    update_sheet_column(sheet, data=model_info_df['participantname'],
-                        col_index=participantuid_col, start_row=2)
+    batch = SheetBatch(sheet, value_input_option='RAW')
+    queue_columns(batch, model_columns(model_info_df))
+    batch.flush()
     return
-
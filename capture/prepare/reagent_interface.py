@@ -6,7 +6,8 @@ import logging
 import pandas as pd
 
 import capture.devconfig as config
-from utils.data_handling import update_sheet_column
+from capture.googleapi.sheetbatch import SheetBatch
+from log import trace
 from utils import globals
 from utils.globals import lab_safeget
 
@@ -235,16 +236,29 @@ def build_reagent_spec_df(rxndict, vardict, erdf, rdict, chemdf):
     return reagent_spec_df
 
 
+@trace.traced(category='google')
 def upload_reagent_interface(rxndict, vardict, rdict, finalexportdf, gc, uid):
+    """Fill in the reagent preparation interface of the run
+
+    Every cell is collected in one SheetBatch: a single request reads the aliased cells, and the values
+    go in two requests, one for the cells typed in (USER_ENTERED, as update_acell did) and one for the
+    prep and specification blocks stored as given (RAW, as update_cells did).
+    """
     sheet = gc.open_by_key(uid).sheet1
-    upload_aliased_cells(sheet)
-    upload_reagent_prep_info(rdict, sheet)
-    upload_run_information(rxndict, vardict, sheet)
-    upload_reagent_specifications(finalexportdf, sheet)
+    batch = SheetBatch(sheet)
+    upload_aliased_cells(batch)
+    upload_reagent_prep_info(rdict, batch)
+    upload_run_information(rxndict, vardict, batch)
+    upload_reagent_specifications(finalexportdf, batch)
+    batch.flush()
 
 
-def upload_aliased_cells(sheet):
-    """Upload cells containing reagent alias to the reagent interface"""
+def upload_aliased_cells(batch):
+    """Queue the cells containing reagent alias in the reagent interface
+
+    :param batch: googleapi.sheetbatch.SheetBatch of the reagent interface, the current values are read
+                  right away
+    """
 
     # Value used in googlesheet as placeholder for reagent alias
     cell_alias_pat = '<Reagent>'
@@ -256,35 +270,32 @@ def upload_aliased_cells(sheet):
     aliased_cells.extend(_get_reagent_header_cells('A'))
 
     reagent_alias = lab_safeget(config.lab_vars, globals.get_lab(), 'reagent_alias')
-    for cell in aliased_cells:
-        current_value = sheet.acell(cell).value
+    for cell, current_value in zip(aliased_cells, batch.read(aliased_cells)):
         new_value = current_value.replace(cell_alias_pat, reagent_alias)
-        sheet.update_acell(cell, new_value)
+        batch.set(cell, new_value)
 
     return
 
 
-def upload_run_information(rxndict, vardict, sheet):
-    sheet.update_acell('B2', rxndict['date']) #row, column, replacement in experimental data entry form
-    sheet.update_acell('B3', rxndict['time'])
-    sheet.update_acell('B4', rxndict['lab'])
-    sheet.update_acell('B6', rxndict['RunID'])
-    sheet.update_acell('B7', rxndict['ExpWorkflowVer'])
-    sheet.update_acell('B8', config.RoboVersion)
-    sheet.update_acell('B9', rxndict['challengeproblem'])
+def upload_run_information(rxndict, vardict, batch):
+    batch.set_column('B', 2, [rxndict['date'], #row, column, replacement in experimental data entry form
+                              rxndict['time'],
+                              rxndict['lab']])
+    batch.set_column('B', 6, [rxndict['RunID'],
+                              rxndict['ExpWorkflowVer'],
+                              config.RoboVersion,
+                              rxndict['challengeproblem']])
 
     # Notes section - blank values as default
-    sheet.update_acell('B12', 'null')
-    sheet.update_acell('B13', 'null')
-    sheet.update_acell('B14', 'null')
+    batch.set_column('B', 12, ['null', 'null', 'null'])
 
-def upload_reagent_specifications(finalexportdf, sheet):
-    """upload rxndict, finalexportdf to gc target, returns the used gsheets object
+def upload_reagent_specifications(finalexportdf, batch):
+    """queue finalexportdf for the reagent interface in batch
 
     :param finalexportdf: datframe containing pre-ordered and normalized abbreviations, nomial amounts and units \n
     :type finalexportdf: pandas dataframe object \n 
-    :param sheet: google sheet string indicating the target file for uploading the finalexport df \n
-    :type sheet: str \n
+    :param batch: SheetBatch of the reagent interface \n
+    :type batch: googleapi.sheetbatch.SheetBatch \n
 
     :return: NONE - creates online object in run directory
     """
@@ -293,48 +304,40 @@ def upload_reagent_specifications(finalexportdf, sheet):
     reagent_interface_amount_startrow = lab_safeget(config.lab_vars, globals.get_lab(), 'reagent_interface_amount_startrow')
     max_reagents = lab_safeget(config.lab_vars, globals.get_lab(), 'max_reagents')
 
-    update_sheet_column(sheet, finalexportdf['chemabbr'],
-                        col_index='B', start_row=reagent_interface_amount_startrow)
-    update_sheet_column(sheet, finalexportdf['nominal_amount'],
-                        col_index='C', start_row=reagent_interface_amount_startrow)
-    update_sheet_column(sheet, finalexportdf['Unit'],
-                        col_index='E', start_row=reagent_interface_amount_startrow)
-
     # add in actual amount column for specified reagents
     # only adds null to rows where there is no chemical
     nulls = finalexportdf['actualsnull'].values.tolist()
     nulls = [val if val == 'null' else '' for val in nulls]
-    update_sheet_column(sheet, nulls,
-                        col_index='D', start_row=reagent_interface_amount_startrow)
+
+    # columns B to E: abbreviation, nominal amount, actual amount (nulls), unit
+    rows = zip(finalexportdf['chemabbr'].values.tolist(),
+               finalexportdf['nominal_amount'].values.tolist(),
+               nulls,
+               finalexportdf['Unit'].values.tolist())
+    # RAW as the update_cells this replaces
+    batch.set_block('B%s' % reagent_interface_amount_startrow, [list(row) for row in rows], 'RAW')
 
     # add nulls to actual amount column for unspecified reagents
     null_start = reagent_interface_amount_startrow + len(finalexportdf)
     maxreagentchemicals = lab_safeget(config.lab_vars, globals.get_lab(), 'maxreagentchemicals')
     num_nulls = (max_reagents - len(finalexportdf.reagentnames.unique())) * (maxreagentchemicals + 1)
     nulls = ['null'] * num_nulls
-   # update_sheet_column(sheet, nulls, col_index='D', start_row=null_start)
+   # batch.set_column('D', null_start, nulls)
 
-def upload_reagent_prep_info(rdict, sheetobject):
-    uploadtarget = sheetobject.range('D3:F11')
+def upload_reagent_prep_info(rdict, batch):
     uploadlist = []
     reagentcount = 1
     for reagentnum, reagentobject in rdict.items():
         while int(reagentnum) > reagentcount:
-            uploadlist.extend(['null']*3) #3 setby number of steps in reagent prep (see if section below)
+            uploadlist.append(['null']*3) #3 setby number of steps in reagent prep (see if section below)
             reagentcount += 1
         if int(reagentnum) == reagentcount:
-            uploadlist.append(reagentobject.preptemperature)
-            uploadlist.append(reagentobject.prepstirrate)
-            uploadlist.append(reagentobject.prepduration)
+            uploadlist.append([reagentobject.preptemperature,
+                               reagentobject.prepstirrate,
+                               reagentobject.prepduration])
             reagentcount += 1
-    count = 0
-    for cell in uploadtarget:
-        try:
-            cell.value = uploadlist[count]
-            count += 1  
-        except:
-            count += 1
-    sheetobject.update_cells(uploadtarget)
+    # one row (D to F) per reagent in D3:F11
+    batch.set_block('D3', uploadlist[:9], 'RAW')
 
     # Upload prerxntemps
     prerxn_temp_cells = _get_reagent_header_cells(column='H')
@@ -345,5 +348,4 @@ def upload_reagent_prep_info(rdict, sheetobject):
         except KeyError:
             payload = 'null'
 
-        sheetobject.update_acell(prerxn_temp_cells[i-1], payload)
-
+        batch.set(prerxn_temp_cells[i-1], payload)
@@ -12,16 +12,17 @@ from pandas import ExcelWriter
 import capture.googleapi.googleio
 from capture.prepare import reagent_interface as interface
 from capture.prepare.observation_interface import upload_observation_interface_data
-from capture.prepare.observation_interface import upload_modelinfo_observation_interface
 from capture.testing import inputvalidation
 from capture.generate import generator
 from capture.models import reagent
 from capture.models import chemical
 from capture.templates import expbuild
 from capture.googleapi import googleio
+from capture.googleapi import localstore
 import capture.devconfig as config
 from utils import globals
 from utils.globals import lab_safeget
+from log import trace
 
 # create logger
 modlog = logging.getLogger('capture.specify')
@@ -36,18 +37,39 @@ def datapipeline(rxndict, vardict):
     Retrieves chemical info from google drive
     Sends Template to state-space generator or random sample generator as specified on command line.
     Saves experiments as csvs and uploads to google drive (if debug is not active)
-    """
 
+    Every stage runs in a trace span, the timeline is written next to the log file
+    (localfiles/<RunID>_Trace.json) and a summary table is printed when the pipeline ends
+    """
+    try:
+        with trace.span('datapipeline'):
+            _datapipeline(rxndict, vardict)
+    finally:
+        if 'logfile' in rxndict:
+            trace.write_trace(trace.trace_path(rxndict['logfile']))
+        table = trace.summary_table()
+        modlog.info('Time spent per stage:\n%s' % table)
+        print(table)
+        if config.storage_backend == 'local':
+            report = localstore.store().report()
+            modlog.info(report)
+            print(report)
+
+
+def _datapipeline(rxndict, vardict):
+    """Stages of datapipeline"""
     modlog = logging.getLogger('capture.specify.datapipeline')
-    inputvalidation.prebuildvalidation(rxndict, vardict)
+    with trace.span('validation'):
+        inputvalidation.prebuildvalidation(rxndict, vardict)
 
-    chemdf = chemical.build_chemdf(lab_safeget(config.lab_vars, globals.get_lab(), 'chemsheetid'),
-                                   lab_safeget(config.lab_vars, globals.get_lab(), 'chem_workbook_index'),
-                                   vardict['debug'])
+    with trace.span('inventory fetch'):
+        chemdf = chemical.build_chemdf(lab_safeget(config.lab_vars, globals.get_lab(), 'chemsheetid'),
+                                       lab_safeget(config.lab_vars, globals.get_lab(), 'chem_workbook_index'),
+                                       vardict['debug'])
 
-    reagentdf = reagent.build_reagentdf(lab_safeget(config.lab_vars, globals.get_lab(),'reagentsheetid'),
-                                        lab_safeget(config.lab_vars, globals.get_lab(),'reagent_workbook_index'),
-                                        vardict['debug'])
+        reagentdf = reagent.build_reagentdf(lab_safeget(config.lab_vars, globals.get_lab(),'reagentsheetid'),
+                                            lab_safeget(config.lab_vars, globals.get_lab(),'reagent_workbook_index'),
+                                            vardict['debug'])
 
     vardict['solventlist'] = chemdf.index[chemdf['Chemical Category'] == 'solvent'].values.tolist()
 
@@ -55,7 +77,8 @@ def datapipeline(rxndict, vardict):
     climits = chemical.chemicallimits(rxndict)
 
     # dictionary of perovskitereagent objects
-    rdict, old_reagents = reagent.buildreagents(rxndict, chemdf, reagentdf, vardict['solventlist'])
+    with trace.span('buildreagents'):
+        rdict, old_reagents = reagent.buildreagents(rxndict, chemdf, reagentdf, vardict['solventlist'])
     rxndict['totalexperiments'] = exptotal(rxndict, rdict)
 
     # dictionary of experiments
@@ -63,7 +86,8 @@ def datapipeline(rxndict, vardict):
 
     drive_target_folder = lab_safeget(config.lab_vars, globals.get_lab(), 'newrun_remote_folder')
 
-    inputvalidation.postbuildvalidation(rxndict, vardict, rdict, edict, chemdf)
+    with trace.span('validation'):
+        inputvalidation.postbuildvalidation(rxndict, vardict, rdict, edict, chemdf)
     #generate
     if vardict['challengeproblem'] == 1:
         if rxndict['totalexperiments'] > 1:
@@ -71,36 +95,40 @@ def datapipeline(rxndict, vardict):
                 user selected %s experiments.' % rxndict['totalexperiments'])
             sys.exit()
         else:
-            uploadlist, secfilelist = generator.generate_cp_files(vardict,
-                                                                  chemdf,
-                                                                  rxndict,
-                                                                  edict,
-                                                                  rdict,
-                                                                  climits)
+            with trace.span('stateset generation'):
+                uploadlist, secfilelist = generator.generate_cp_files(vardict,
+                                                                      chemdf,
+                                                                      rxndict,
+                                                                      edict,
+                                                                      rdict,
+                                                                      climits)
             if vardict['debug'] is False:
-                googleio.upload_cp_files_to_drive(uploadlist,
-                                                  secfilelist,
-                                                  rxndict['RunID'],
-                                                  rxndict['logfile'],
-                                                  drive_target_folder)
+                with trace.span('file upload'):
+                    googleio.upload_cp_files_to_drive(uploadlist,
+                                                      secfilelist,
+                                                      rxndict['RunID'],
+                                                      rxndict['logfile'],
+                                                      drive_target_folder)
 
     # generate
     if not vardict['challengeproblem']:
         # Create experiment file and relevant experiment associated data
-        erdf, robotfile, secfilelist, model_info_df = generator.generate_ESCALATE_run(vardict,
-                                                                                      chemdf,
-                                                                                      rxndict,
-                                                                                      edict,
-                                                                                      rdict,
-                                                                                      old_reagents,
-                                                                                      climits)
+        with trace.span('sampling and robot files'):
+            erdf, robotfile, secfilelist, model_info_df = generator.generate_ESCALATE_run(vardict,
+                                                                                          chemdf,
+                                                                                          rxndict,
+                                                                                          edict,
+                                                                                          rdict,
+                                                                                          old_reagents,
+                                                                                          climits)
         if vardict['debug'] < 2:
             modlog.info('Starting file preparation for upload')
             # Lab specific handling - different labs require different files for tracking
 
-            primary_dir, secondary_dir, gdrive_uid_dict = googleio.create_drive_directories(rxndict,
-                                                                                            drive_target_folder,
-                                                                                            lab_safeget(config.lab_vars, globals.get_lab(),'required_files'))
+            with trace.span('drive directories'):
+                primary_dir, secondary_dir, gdrive_uid_dict = googleio.create_drive_directories(rxndict,
+                                                                                                drive_target_folder,
+                                                                                                lab_safeget(config.lab_vars, globals.get_lab(),'required_files'))
             if rxndict['lab'] != 'ECL':
 
                 google_drive_client = googleio.get_gdrive_client()
@@ -115,28 +143,28 @@ def datapipeline(rxndict, vardict):
                                  erdf,
                                  rdict,
                                  chemdf)
-                interface.upload_reagent_interface(rxndict,
-                                                   vardict,
-                                                   rdict,
-                                                   regent_spec_df,
-                                                   google_drive_client,
-                                                   reagent_interface_uid)
-                # upload data to observation_interace
-                observation_interface_uid = googleio.get_uid_by_name(
-                                            gdrive_uid_dict,
-                                            'observation_interface')
-                upload_observation_interface_data(rxndict,
-                                                  vardict,
-                                                  google_drive_client,
-                                                  observation_interface_uid)
-                upload_modelinfo_observation_interface(model_info_df,
+                with trace.span('sheets upload'):
+                    interface.upload_reagent_interface(rxndict,
+                                                       vardict,
+                                                       rdict,
+                                                       regent_spec_df,
                                                        google_drive_client,
-                                                       observation_interface_uid)
+                                                       reagent_interface_uid)
+                    # upload data to observation_interace
+                    observation_interface_uid = googleio.get_uid_by_name(
+                                                gdrive_uid_dict,
+                                                'observation_interface')
+                    upload_observation_interface_data(rxndict,
+                                                      vardict,
+                                                      google_drive_client,
+                                                      observation_interface_uid,
+                                                      model_info_df)
 
             else:
                 modlog.warn('User selected ECL run, no reagent interface generated. Please ensure the JSON is exported from ECL!')
             logfile = '%s/%s'%(os.getcwd(),rxndict['logfile'])
-            googleio.upload_files_to_gdrive(primary_dir, secondary_dir, secfilelist, robotfile, rxndict['RunID'], logfile)
+            with trace.span('file upload'):
+                googleio.upload_files_to_gdrive(primary_dir, secondary_dir, secfilelist, robotfile, rxndict['RunID'], logfile)
             modlog.info('File upload completed successfully')
         else:
             modlog.info('Offline debugging enabled.  No file upload was performed')
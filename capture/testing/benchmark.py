@@ -0,0 +1,233 @@
+"""Offline micro-benchmarks of the samplers and state set enumerations
+
+Builds synthetic perovskitereagent sets (one pure solvent plus stock solutions of 2 to 8 species) and times
+every engine that can run on this host at several well counts, recording throughput, peak (traced) memory
+and, where the engine rejects candidates, its acceptance rate.  Results go to a JSON file named after the
+current commit so that runs on different commits can be compared.  Engines that cannot run here (no Wolfram
+kernel) are recorded as skipped.
+
+Run from the repository root:
+
+    python -m capture.testing.benchmark --species 2 4 --reagents 3 5 --wells 96 1000
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from math import factorial
+
+import numpy as np
+
+import capture.devconfig as config
+from capture.generate import qrandom
+from capture.generate import statespace
+from capture.generate.nativesampler import NativeSampler
+from capture.generate.wolframsampler import kernel_pool
+from capture.models.reagent import perovskitereagent
+
+modlog = logging.getLogger('capture.testing.benchmark')
+
+SPECIES = range(2, 9)
+REAGENTS = range(2, 8)
+WELLS = (96, 1000, 10000, 100000)
+ENGINES = ('default_sampling', 'native_sampling', 'wolfram_sampling',
+           'default_statedataframe', 'native_statedataframe', 'wolfram_statedataframe')
+
+SOLVENT = 'DMF'
+SOLVENT_CONC = 12.9  # neat DMF (M)
+FINAL_VOLUME = 500
+# largest grid (points per axis ** species) the hull enumerations are run on
+MAX_GRID = 10 ** 7
+
+
+def synthetic_reagents(nspecies, nreagents, rng):
+    """rdict of one pure solvent reagent and nreagents - 1 stock solutions covering nspecies species
+
+    Species are dealt to the stocks in turn (every species is in at least one stock) and then added to
+    other stocks at random; concentrations are drawn between 0.5 and 4 M.
+
+    :return: {reagent number: perovskitereagent}
+    """
+    species = ['S%s' % i for i in range(1, nspecies + 1)]
+    stocks = [[] for _ in range(nreagents - 1)]
+    for position, chemical in enumerate(species):
+        stocks[position % len(stocks)].append(chemical)
+    for stock in stocks:
+        stock.extend(chemical for chemical in species if chemical not in stock and rng.random_sample() < 0.3)
+
+    rdict = {'1': _reagent('1', [SOLVENT], {'conc_item1': SOLVENT_CONC})}
+    for number, stock in enumerate(stocks, start=2):
+        concs = {'conc_item%s' % (i + 1): float(rng.uniform(0.5, 4)) for i in range(len(stock))}
+        rdict[str(number)] = _reagent(str(number), stock + [SOLVENT], concs)
+    return rdict
+
+
+def _reagent(name, chemicals, concs):
+    """perovskitereagent with the attributes the samplers read, without the chemical inventory lookups"""
+    reagent = perovskitereagent.__new__(perovskitereagent)
+    reagent.name = name
+    reagent.chemicals = chemicals
+    reagent.concs = concs
+    reagent.solvent_list = [SOLVENT]
+    reagent.ispurebool = reagent.ispure()
+    reagent.solventnum = reagent.solvent(reagent.solvent_list)
+    return reagent
+
+
+def grid_steps(nreagents, rows):
+    """Smallest number of volspacing steps k whose enumeration (C(k + n, n) rows) reaches rows"""
+    steps = 1
+    while factorial(steps + nreagents) // (factorial(steps) * factorial(nreagents)) < rows:
+        steps += 1
+    return steps
+
+
+def wolfram_available():
+    """(True, None) when a Wolfram kernel can be leased, (False, reason) otherwise"""
+    try:
+        with kernel_pool().lease():
+            pass
+    except Exception as e:
+        return False, 'no Wolfram kernel: %s' % e
+    return True, None
+
+
+def run_engine(engine, rdict, wells, rng):
+    """Run one engine on the reagents of rdict for wells wells (state set rows for the enumerations)
+
+    :return: (rows produced, acceptance rate or None)
+    """
+    expoverview = [[int(number) for number in sorted(rdict, key=int)]]
+    rxndict = {'max_conc': 15., 'ExpWorkflowVer': 2, 'lab': 'LBL', 'totalexperiments': 1}
+
+    if engine.endswith('_sampling'):
+        vollimits = [[FINAL_VOLUME, FINAL_VOLUME]]
+        if engine == 'default_sampling':
+            prdf, _, _ = qrandom.default_sampling(expoverview, rdict, vollimits, rxndict, wells, {}, 1, rng=rng)
+            return len(prdf), None
+        if engine == 'native_sampling':
+            sampler = NativeSampler(seed=rng)
+            prdf, _ = qrandom.hull_sampling(sampler, expoverview, rdict, None, vollimits, rxndict, wells, {}, 1,
+                                            rng=rng)
+            return len(prdf), sampler.acceptance
+        prdf, _, _ = qrandom.wolfram_sampling(expoverview, rdict, None, vollimits, rxndict, {}, wells, {}, 1, rng=rng)
+        return len(prdf), None
+
+    # enumerations: the well volume is set so that the default enumeration has about wells rows
+    steps = grid_steps(len(expoverview[0]), wells)
+    vollimits = [[0, steps * config.volspacing]]
+    if engine == 'default_statedataframe':
+        # generated directly as compositions, nothing is drawn and rejected
+        prdf, _ = statespace.default_statedataframe(rxndict, expoverview, vollimits, rdict, 1)
+        return len(prdf), None
+    if engine == 'native_statedataframe':
+        sampler = NativeSampler()
+        experiments = sampler.enumerativelySample(**statespace.hull_enumeration_inputs(rxndict, expoverview,
+                                                                                      vollimits, rdict))
+        return len(next(iter(experiments['volumes'].values()), [])), sampler.acceptance
+    prdf, _ = statespace.wolfram_statedataframe(rxndict, expoverview, vollimits, rdict, 1)
+    return len(prdf), None
+
+
+def measure(engine, rdict, wells, seed, memory=True):
+    """Time one engine run (and trace its peak memory in a second, identically seeded run)"""
+    start = time.perf_counter()
+    rows, acceptance = run_engine(engine, rdict, wells, np.random.RandomState(seed))
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run_engine(engine, rdict, wells, np.random.RandomState(seed))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'rows': rows,
+            'seconds': seconds,
+            'throughput': rows / seconds if seconds > 0 else None,
+            'peak_bytes': peak,
+            'acceptance': acceptance}
+
+
+def current_commit():
+    """Commit hash of the working tree, 'unknown' outside of a git checkout"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(species=SPECIES, reagents=REAGENTS, wells=WELLS, engines=ENGINES, seed=0, memory=True, max_grid=MAX_GRID):
+    """Benchmark every combination, return the results document written by main
+
+    :param max_grid: hull enumerations of a larger grid (points per axis ** species) are skipped
+    """
+    available = {engine: (True, None) for engine in engines}
+    if any(engine.startswith('wolfram') for engine in engines):
+        status = wolfram_available()
+        available.update({engine: status for engine in engines if engine.startswith('wolfram')})
+
+    results = []
+    for nspecies, nreagents in itertools.product(species, reagents):
+        rdict = synthetic_reagents(nspecies, nreagents, np.random.RandomState([seed, nspecies, nreagents]))
+        for engine, nwells in itertools.product(engines, wells):
+            case = {'engine': engine, 'species': nspecies, 'reagents': nreagents, 'wells': nwells}
+            ok, reason = available[engine]
+            if ok and engine in ('native_statedataframe', 'wolfram_statedataframe'):
+                grid = (grid_steps(nreagents, nwells) + 1) ** nspecies
+                if grid > max_grid:
+                    ok, reason = False, 'grid of %s points exceeds max_grid=%s' % (grid, max_grid)
+            if not ok:
+                case.update(status='skipped', reason=reason)
+            else:
+                try:
+                    case.update(measure(engine, rdict, nwells, seed, memory), status='ok')
+                except Exception as e:
+                    modlog.exception('%s failed for %s' % (engine, case))
+                    case.update(status='failed', reason='%s: %s' % (type(e).__name__, e))
+            results.append(case)
+            print('{engine:24s} species={species} reagents={reagents} wells={wells:<6d} {status}'.format(**case)
+                  + ('  %.3fs' % case['seconds'] if case['status'] == 'ok' else ''))
+
+    return {'commit': current_commit(),
+            'created': datetime.now().isoformat(),
+            'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'cpus': os.cpu_count()},
+            'seed': seed,
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the samplers and state set enumerations')
+    parser.add_argument('--species', type=int, nargs='+', default=list(SPECIES))
+    parser.add_argument('--reagents', type=int, nargs='+', default=list(REAGENTS))
+    parser.add_argument('--wells', type=int, nargs='+', default=list(WELLS))
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run for peak memory')
+    parser.add_argument('--max-grid', type=int, default=MAX_GRID,
+                        help='skip hull enumerations of grids larger than this')
+    parser.add_argument('--output', default=None,
+                        help='results file, localfiles/benchmarks/<commit>.json by default')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    document = run(args.species, args.reagents, args.wells, args.engines, args.seed, not args.no_memory,
+                   args.max_grid)
+    output = args.output or os.path.join('localfiles', 'benchmarks', '%s.json' % document['commit'])
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print('Results written to %s' % output)
+
+
+if __name__ == '__main__':
+    main()
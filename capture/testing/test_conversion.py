@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from capture.generate.conversion import VolumeConverter
+
+# solvent and two stocks over three species, the last species is in no reagent
+SIMPLEX = {'Reagent1 (ul)': [0., 0., 0.], 'Reagent2 (ul)': [2., 0.5, 0.], 'Reagent3 (ul)': [0.5, 3., 0.]}
+# a fourth reagent inside the hull of the other three, volumes are no longer unique
+REDUNDANT = dict(SIMPLEX, **{'Reagent4 (ul)': [0.8, 1., 0.]})
+
+
+def mix(reagent_vectors, volumes, final_volume):
+    return volumes.dot(np.array(list(reagent_vectors.values()))) / final_volume
+
+
+def test_volumes_round_trip():
+    rng = np.random.RandomState(0)
+    volumes = 500. * rng.dirichlet(np.ones(3), size=200)
+    converter = VolumeConverter(SIMPLEX)
+    assert np.allclose(converter.volumes(mix(SIMPLEX, volumes, 500.), 500.), volumes)
+    # points given over the nonzero species only
+    assert np.allclose(converter.volumes(mix(SIMPLEX, volumes, 500.)[:, :2], 500.), volumes)
+
+
+def test_redundant_reagents_round_trip_through_concentrations():
+    rng = np.random.RandomState(1)
+    concentrations = mix(REDUNDANT, 250. * rng.dirichlet(np.ones(4), size=200), 250.)
+    volumes = VolumeConverter(REDUNDANT).volumes(concentrations, 250.)
+    assert (volumes >= 0).all()
+    assert np.allclose(volumes.sum(axis=1), 250.)
+    assert np.allclose(mix(REDUNDANT, volumes, 250.), concentrations)
+
+
+def test_volume_dict_keeps_the_total():
+    rng = np.random.RandomState(2)
+    concentrations = mix(SIMPLEX, 500. * rng.dirichlet(np.ones(3), size=50), 500.)
+    volumes = VolumeConverter(SIMPLEX).volume_dict(concentrations, 500.)
+    assert list(volumes) == list(SIMPLEX)
+    assert np.allclose(np.sum(list(volumes.values()), axis=0), 500.)
+
+
+@pytest.mark.parametrize('point', [[3., 3., 0.], [0.5, 0.5, 1.], [-0.1, 0., 0.]])
+def test_point_outside_the_hull_raises(point):
+    inside = mix(SIMPLEX, np.array([[100., 200., 200.]]), 500.)
+    with pytest.raises(ValueError):
+        VolumeConverter(SIMPLEX).volumes(np.vstack([inside, point]), 500.)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from capture.generate.lowdiscrepancy import SobolEngine, unit_hypercube
+
+# first 16 points of the 5 dimensional Sobol sequence with the Joe & Kuo direction numbers (gray code order)
+SOBOL_REFERENCE = np.array([
+    [0., 0., 0., 0., 0.],
+    [0.5, 0.5, 0.5, 0.5, 0.5],
+    [0.75, 0.25, 0.25, 0.25, 0.75],
+    [0.25, 0.75, 0.75, 0.75, 0.25],
+    [0.375, 0.375, 0.625, 0.875, 0.375],
+    [0.875, 0.875, 0.125, 0.375, 0.875],
+    [0.625, 0.125, 0.875, 0.625, 0.625],
+    [0.125, 0.625, 0.375, 0.125, 0.125],
+    [0.1875, 0.3125, 0.9375, 0.4375, 0.5625],
+    [0.6875, 0.8125, 0.4375, 0.9375, 0.0625],
+    [0.9375, 0.0625, 0.6875, 0.1875, 0.3125],
+    [0.4375, 0.5625, 0.1875, 0.6875, 0.8125],
+    [0.3125, 0.1875, 0.3125, 0.5625, 0.9375],
+    [0.8125, 0.6875, 0.8125, 0.0625, 0.4375],
+    [0.5625, 0.4375, 0.0625, 0.8125, 0.1875],
+    [0.0625, 0.9375, 0.5625, 0.3125, 0.6875],
+])
+
+
+def test_unscrambled_sobol_matches_reference():
+    assert np.array_equal(SobolEngine(5, scramble=False).random(16), SOBOL_REFERENCE)
+
+
+def test_unscrambled_sobol_continues_across_batches():
+    engine = SobolEngine(5, scramble=False)
+    batches = np.vstack([engine.random(3), engine.random(0), engine.random(6), engine.random(7)])
+    assert np.array_equal(batches, SOBOL_REFERENCE)
+    assert np.array_equal(SobolEngine(5, scramble=False).fast_forward(9).random(7), SOBOL_REFERENCE[9:])
+
+
+def test_scrambled_sobol_continues_across_batches():
+    whole = SobolEngine(4, seed=7).random(1000)
+    engine = SobolEngine(4, seed=7)
+    assert np.array_equal(np.vstack([engine.random(1), engine.random(511), engine.random(488)]), whole)
+
+
+def test_scrambled_sobol_is_stratified():
+    m = 8
+    points = unit_hypercube(2 ** m, 6, 'sobol', np.random.RandomState(3))
+    assert ((points >= 0) & (points < 1)).all()
+    assert not np.array_equal(points, SobolEngine(6, scramble=False).random(2 ** m))
+    # one point in each of the 2^m intervals of every dimension
+    for d in range(points.shape[1]):
+        assert np.array_equal(np.sort(np.floor(points[:, d] * 2 ** m)), np.arange(2 ** m))
+    # the first two dimensions are a (0, m, 2)-net: one point in every 2^-k x 2^-(m-k) box
+    for k in range(m + 1):
+        boxes = np.floor(points[:, 0] * 2 ** k) * 2 ** (m - k) + np.floor(points[:, 1] * 2 ** (m - k))
+        assert np.array_equal(np.sort(boxes), np.arange(2 ** m))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from capture.generate.nativesampler import NativeSampler
+from capture.generate.polytope import ReagentHull
+
+# the [0, 2] x [0, 2] square: four reagents, not a simplex, so hit-and-run does the sampling
+SQUARE = {'Reagent1 (ul)': [0., 0.], 'Reagent2 (ul)': [2., 0.], 'Reagent3 (ul)': [0., 2.], 'Reagent4 (ul)': [2., 2.]}
+# simplex with corners at 3 M cut by a 2 M max_conc: x, y >= 0, x + y <= 3, x, y <= 2 (area 3.5)
+SIMPLEX = {'Reagent1 (ul)': [0., 0.], 'Reagent2 (ul)': [3., 0.], 'Reagent3 (ul)': [0., 3.]}
+# old reagents covering the corner x + y <= 1 of the square
+CORNER = {'Reagent1 (ul)': [0., 0.], 'Reagent2 (ul)': [1., 0.], 'Reagent3 (ul)': [0., 1.]}
+
+
+def test_hit_and_run_uniform_in_square():
+    hull = ReagentHull(SQUARE, 15.)
+    points = NativeSampler(seed=0).sampleHitAndRun(hull, 4000)
+
+    assert points.shape == (4000, 2)
+    assert hull.contains(points).all()
+    assert np.allclose(points.mean(axis=0), [1., 1.], atol=0.05)
+    # variance of U(0, 2) is 1/3
+    assert np.allclose(points.var(axis=0), 1 / 3., atol=0.04)
+    quadrants = np.bincount(2 * (points[:, 0] > 1) + (points[:, 1] > 1), minlength=4) / 4000.
+    assert np.allclose(quadrants, 0.25, atol=0.03)
+
+
+def test_hit_and_run_uniform_in_cut_simplex():
+    hull = ReagentHull(SIMPLEX, 2.)
+    points = NativeSampler(seed=1).sampleHitAndRun(hull, 4000)
+
+    assert hull.contains(points).all()
+    assert (points <= 2 + 1e-9).all() and (points.sum(axis=1) <= 3 + 1e-9).all()
+    # x < 1 is a 1 x 2 strip of the 3.5 M^2 region
+    assert abs((points[:, 0] < 1).mean() - 2 / 3.5) < 0.03
+    # the corner x, y > 1 is the triangle x + y <= 3 above (1, 1), area 0.5
+    assert abs(np.all(points > 1, axis=1).mean() - 0.5 / 3.5) < 0.02
+
+
+def test_sample_difference_stays_outside_old_hull():
+    hull = ReagentHull(SQUARE, 15.)
+    oldhull = ReagentHull(CORNER, 15.)
+    sampler = NativeSampler(seed=2)
+    points = sampler.sampleDifference(hull, oldhull, 2000)
+
+    assert points.shape == (2000, 2)
+    assert hull.contains(points).all()
+    assert not oldhull.contains(points).any()
+    assert (points.sum(axis=1) >= 1 - 1e-9).all()
+    # the old hull covers 0.5 of the 4 M^2 square
+    assert abs(sampler.acceptance - 3.5 / 4) < 0.03
+
+
+def test_sample_difference_covered_hull_raises():
+    with pytest.raises(ValueError):
+        NativeSampler(seed=3).sampleDifference(ReagentHull(CORNER, 15.), ReagentHull(SQUARE, 15.), 10)
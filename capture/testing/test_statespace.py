@@ -0,0 +1,67 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import capture.devconfig as config
+from capture.generate import calcs
+from capture.generate import statespace
+from capture.testing import benchmark
+
+
+def spec(**limits):
+    rxndict = {'max_conc': 15., 'totalexperiments': 1}
+    rxndict.update(limits)
+    return rxndict
+
+
+@pytest.mark.parametrize('nparts, summin, summax, caps', [
+    (1, 0, 5, 5),
+    (3, 0, 6, 6),
+    (3, 4, 6, [1, 5, 3]),
+    (4, 7, 7, 3),
+    (4, 2, 9, [0, 4, 2, 6]),
+    (3, 10, 12, 3),
+])
+def test_bounded_compositions_match_brute_force(nparts, summin, summax, caps):
+    bounds = np.broadcast_to(caps, (nparts,))
+    expected = [row for row in itertools.product(*[range(cap + 1) for cap in bounds])
+                if summin <= sum(row) <= summax]
+    result = statespace.bounded_compositions(nparts, summin, summax, caps)
+    assert result.shape == (len(expected), nparts)
+    assert [tuple(row) for row in result.tolist()] == expected
+
+
+def test_portion_volume_rows_match_brute_force():
+    volumes = range(0, 301, 50)
+    expected = [row for row in itertools.product(volumes, volumes, [0, 50, 100])
+                if 100 <= sum(row) <= 300]
+    rows = statespace.portion_volume_rows(3, 100, 300, 50, caps=[300, 300, 120])
+    assert [tuple(row) for row in rows.tolist()] == expected
+
+
+def test_index_keyed_limits_name_the_chemical():
+    rxndict = spec(chem2_abbreviation='S1', chem2_molarmax=0.5, chem3_abbreviation='S2', chem3_molarmin=0.1)
+    assert calcs.molar_limits(rxndict, ['S1', 'S2', 'S3']) == {'S1': (0., 0.5), 'S2': (0.1, np.inf)}
+    # a chemical the reagents do not use is not limited
+    assert calcs.molar_limits(rxndict, ['S2']) == {'S2': (0.1, np.inf)}
+
+
+def test_real_spec_limit_prunes_the_state_set(monkeypatch):
+    monkeypatch.setattr(config, 'volspacing', 50)
+    monkeypatch.setattr(config, 'sampling_molar_limits', False)
+    rdict = benchmark.synthetic_reagents(2, 3, np.random.RandomState(0))
+    expoverview = [[1, 2, 3]]
+    vollimits = [[0, 500]]
+    limited = spec(chem2_abbreviation='S1', chem2_molarmax=0.5)
+
+    full, _ = statespace.default_statedataframe(limited, expoverview, vollimits, rdict, 1)
+    monkeypatch.setattr(config, 'sampling_molar_limits', True)
+    pruned, _ = statespace.default_statedataframe(limited, expoverview, vollimits, rdict, 1)
+
+    molarity = calcs.ConcentrationMatrix(rdict).molarity(pruned)['S1 [M]'].fillna(0)
+    assert 0 < len(pruned) < len(full)
+    assert (molarity <= 0.5 + 1e-9).all()
+    # the rows kept are exactly the rows of the full set within the limit
+    fullmolarity = calcs.ConcentrationMatrix(rdict).molarity(full)['S1 [M]'].fillna(0)
+    assert len(pruned) == (fullmolarity <= 0.5 + 1e-9).sum()
@@ -0,0 +1,153 @@
+"""Timing spans for the stages of a run
+
+Wrap a piece of work in a span to time it:
+
+    with trace.span('buildreagents'):
+        ...
+
+    @trace.traced('google')
+    def upload_something(...):
+        ...
+
+Spans nest (per thread) and are kept in memory for the whole process.  At the end of a run write_trace
+stores them as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) next to the log
+file and summary_table gives the time spent per span name.  Spans recorded in worker processes are
+shipped back with the result when the work is submitted through collected.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+modlog = logging.getLogger('log.trace')
+
+_EVENTS = []
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def _stack():
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = []
+    return _LOCAL.stack
+
+
+@contextmanager
+def span(name, category='stage', **args):
+    """Time the enclosed block as a span called name
+
+    :param category: group of the span in the trace ('stage', 'google', 'sampler', ...)
+    :param args: extra values stored with the span (shown by the trace viewers)
+    """
+    stack = _stack()
+    stack.append(name)
+    start = time.time()
+    clock = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - clock
+        stack.pop()
+        event = {'name': name, 'cat': category, 'ph': 'X',
+                 'ts': start * 1e6, 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident(),
+                 'args': dict(args, depth=len(stack))}
+        with _LOCK:
+            _EVENTS.append(event)
+
+
+def traced(name=None, category='stage'):
+    """Decorator running every call of the function in a span (named after the function by default)"""
+    def decorate(func):
+        spanname = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(spanname, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def events():
+    """Copy of the spans recorded so far (Chrome trace complete events)"""
+    with _LOCK:
+        return list(_EVENTS)
+
+
+def reset():
+    """Forget the recorded spans"""
+    with _LOCK:
+        del _EVENTS[:]
+
+
+def merge(recorded):
+    """Add spans recorded elsewhere (a worker process) to this process' spans"""
+    with _LOCK:
+        _EVENTS.extend(recorded)
+
+
+def collected(func, *args):
+    """Call func(*args) and return (result, spans recorded during the call)
+
+    Submit this instead of func to a process pool and merge the spans into the parent, see
+    capture.generate.parallel.map_experiments
+    """
+    first = len(_EVENTS)
+    result = func(*args)
+    with _LOCK:
+        recorded = _EVENTS[first:]
+    return result, recorded
+
+
+def trace_path(logfile):
+    """Trace file next to the log file: localfiles/<RunID>_LogFile.log -> localfiles/<RunID>_Trace.json"""
+    base = logfile[:-len('_LogFile.log')] if logfile.endswith('_LogFile.log') else os.path.splitext(logfile)[0]
+    return '%s_Trace.json' % base
+
+
+def write_trace(path):
+    """Write the recorded spans as a Chrome trace JSON file"""
+    recorded = sorted(events(), key=lambda event: event['ts'])
+    names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'capture (pid %s)' % pid}}
+             for pid in sorted(set(event['pid'] for event in recorded))]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': names + recorded, 'displayTimeUnit': 'ms'}, f)
+    modlog.info('Trace of %s spans written to %s' % (len(recorded), path))
+    return path
+
+
+def summary(recorded=None):
+    """Time spent per span name, in the order the names first appear
+
+    :return: list of dicts with name, category, depth, calls, total, mean, max (seconds)
+    """
+    recorded = sorted(events() if recorded is None else recorded, key=lambda event: event['ts'])
+    rows = {}
+    for event in recorded:
+        key = (event['cat'], event['name'])
+        if key not in rows:
+            rows[key] = {'name': event['name'], 'category': event['cat'], 'depth': event['args'].get('depth', 0),
+                         'calls': 0, 'total': 0., 'max': 0.}
+        row = rows[key]
+        row['calls'] += 1
+        row['total'] += event['dur'] / 1e6
+        row['max'] = max(row['max'], event['dur'] / 1e6)
+    for row in rows.values():
+        row['mean'] = row['total'] / row['calls']
+    return list(rows.values())
+
+
+def summary_table(recorded=None):
+    """summary as a plain text table, span names indented by nesting depth"""
+    rows = summary(recorded)
+    width = max([len(row['name']) + 2 * row['depth'] for row in rows] + [4])
+    lines = ['%-*s  %-8s %6s %10s %10s %10s' % (width, 'span', 'category', 'calls', 'total (s)', 'mean (s)', 'max (s)')]
+    for row in rows:
+        lines.append('%-*s  %-8s %6d %10.3f %10.3f %10.3f' % (width, '  ' * row['depth'] + row['name'],
+                                                              row['category'], row['calls'], row['total'],
+                                                              row['mean'], row['max']))
+    return '\n'.join(lines)